@@ -36,6 +36,7 @@ from time import time, sleep, clock, localtime, strftime
 import csv
 import struct
 from random import randint
+from ipsc.player import PacingClock
 
 __author__      = 'Cortney T. Buffington, N0MJS'
 __copyright__   = 'Copyright (c) 2013 - 2016 Cortney T. Buffington, N0MJS and the K0USY Group'
@@ -183,41 +184,12 @@ class ambeIPSC(IPSC):
 
     def rewriteFrame( self, _frame, _newSlot, _newGroup, _newSouceID, _newPeerID ):
         
-        _peerid         = _frame[1:5]                 # int32 peer who is sending us a packet
-        _src_sub        = _frame[6:9]                 # int32 Id of source
-        _burst_data_type = _frame[30]
-
         ########################################################################
-        # re-Write the peer radio ID to that of this program
-        _frame = _frame.replace(_peerid, _newPeerID)
-        # re-Write the source subscriber ID to that of this program
-        _frame = _frame.replace(_src_sub, _newSouceID)
-        # Re-Write the destination Group ID
-        _frame = _frame.replace(_frame[9:12], _newGroup)
-
-        # Re-Write IPSC timeslot value
-        _call_info = int_id(_frame[17:18])
-        if _newSlot == 1:
-            _call_info &= ~(1 << 5)
-        elif _newSlot == 2:
-            _call_info |= 1 << 5
-        _call_info = chr(_call_info)
-        _frame = _frame[:17] + _call_info + _frame[18:]
-    
-        _x = struct.pack("i", self._seq)
-        _frame = _frame[:20] + _x[1] + _x[0] + _frame[22:]
+        # re-Write the peer radio ID and source subscriber ID to that of this program, the destination
+        # Group ID, the IPSC and DMR timeslot values and the RTP sequence number
+        _frame = self._rewriter.rewrite(_frame, _newPeerID, _newGroup, _newSlot, _newSouceID, self._seq)
         self._seq = self._seq + 1
         
-        # Re-Write DMR timeslot value
-        # Determine if the slot is present, so we can translate if need be
-        if _burst_data_type == BURST_DATA_TYPE['SLOT1_VOICE'] or _burst_data_type == BURST_DATA_TYPE['SLOT2_VOICE']:
-            # Re-Write timeslot if necessary...
-            if _newSlot == 1:
-                _burst_data_type = BURST_DATA_TYPE['SLOT1_VOICE']
-            elif _newSlot == 2:
-                _burst_data_type = BURST_DATA_TYPE['SLOT2_VOICE']
-            _frame = _frame[:30] + _burst_data_type + _frame[31:]
-        
         if (time() - self._busy_slots[_newSlot]) >= 0.10 :          # slot is not busy so it is safe to transmit
             # Send the packet to all peers in the target IPSC
             self.send_to_ipsc(_frame)
@@ -269,7 +241,7 @@ class ambeIPSC(IPSC):
         return _ambeAll.tobytes()           # Return the 49 * 3 as an array of bytes
 
     # Set up the socket and run the method to gather the AMBE.  Sending it to all peers
-    def launchUDP(self):
+    def launchUDP(self, _name):
         s = socket.socket()                 # Create a socket object
         s.bind(('', self._ambeRxPort))      # Bind to the port
 
@@ -277,14 +249,14 @@ class ambeIPSC(IPSC):
             s.listen(5)                     # Now wait for client connection.
             _sock, addr = s.accept()        # Establish connection with client.
             if int_id(self._tx_tg) > 0:     # Test if we are allowed to transmit
-                self.playbackFromUDP(_sock, self._system)
+                self.playbackFromUDP(_sock)
             else:
-                self.transmitDisabled(_sock, self._system)    #tg is zero, so just eat the network trafic
+                self.transmitDisabled(_sock)    #tg is zero, so just eat the network trafic
             _sock.close()
 
     # This represents a full transmission (HEAD, VOICE and TERM)
     def playbackFromUDP(self, _sock):
-        _delay = 0.055                                      # Yes, I know it should be 0.06, but there seems to be some latency, so this is a hack
+        _clock = PacingClock(_drop = False)                 # One burst every 60ms, on a timeline that doesn't drift (the AMBE comes in live, so none is dropped)
         _src_sub = hex_str_3(self._gateway_dmr_id)          # DMR ID to sign this transmission with
         _src_peer = NETWORK[self._system]['LOCAL']['RADIO_ID']  # Use this peers ID as the source repeater
 
@@ -312,10 +284,11 @@ class ambeIPSC(IPSC):
             _eof = False
             self._seq = randint(0,32767)                    # A transmission uses a random number to begin its sequence (16 bit)
 
+            _clock.start()
             for i in range(0, 3):                           # Output the 3 HEAD frames to our peers
-                self.rewriteFrame(_tempHead[i], self._system, self._tx_ts, self._tx_tg, _src_sub, _src_peer)
+                _clock.pace()
+                self.rewriteFrame(_tempHead[i], self._tx_ts, self._tx_tg, _src_sub, _src_peer)
                 #self.group_voice(self._system, _src_sub, self._tx_tg, True, '', hex_str_3(0), _tempHead[i])
-                sleep(_delay)
 
             i = 0                                           # Initialize the VOICE template index
             while(_eof == False):
@@ -324,19 +297,19 @@ class ambeIPSC(IPSC):
                     i = (i + 1) % 6                         # Round robbin with the 6 VOICE templates
                     _frame = _tempVoice[i][:33] + _ambe + _tempVoice[i][52:]    # Insert the 3 49 bit AMBE frames
                     
-                    self.rewriteFrame(_frame, self._system, self._tx_ts, self._tx_tg, _src_sub, _src_peer)
+                    _clock.pace()                           # Since this comes from a file we have to wait for its slot
+                    self.rewriteFrame(_frame, self._tx_ts, self._tx_tg, _src_sub, _src_peer)
                     #self.group_voice(self._system, _src_sub, self._tx_tg, True, '', hex_str_3(0), _frame)
-
-                    sleep(_delay)                           # Since this comes from a file we have to add delay between IPSC frames
                 else:
                     _eof = True                             # There are no more AMBE frames, so terminate the loop
 
-            self.rewriteFrame(_tempTerm, self._system, self._tx_ts, self._tx_tg, _src_sub, _src_peer)
+            _clock.pace()
+            self.rewriteFrame(_tempTerm, self._tx_ts, self._tx_tg, _src_sub, _src_peer)
             #self.group_voice(self._system, _src_sub, self._tx_tg, True, '', hex_str_3(0), _tempTerm)
 
         except IOError:
             logger.error('Can not transmit to peers')
-        logger.info('Transmit complete')
+        logger.info('Transmit complete: {}'.format(_clock))
 
     def transmitDisabled(self, _sock):
         _eof = False
@@ -352,6 +325,7 @@ class ambeIPSC(IPSC):
     def playbackFromFile(self, _fileName):
         _r = open(_fileName, 'rb')
         _eof = False
+        _clock = PacingClock(_drop = False)
 
         host = socket.gethostbyname(socket.gethostname()) # Get local machine name
         _sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -359,13 +333,13 @@ class ambeIPSC(IPSC):
                      
         while(_eof == False):
         
+            _clock.pace()
             for i in range(0, 3):
                 _ambe = _r.read(7)
                 if _ambe:
                     _sock.send(_ambe)
                 else:
                     _eof = True      
-            sleep(0.055)
         logger.info('File playback complete')
 
     def dumpTemplate(self, _fileName):
@@ -394,7 +368,8 @@ class ambeIPSC(IPSC):
         #self.dumpIPSCFrame(_data)
         
         # THIS FUNCTION IS NOT COMPLETE!!!!
-        _payload_type = _data[30:31]
+        _packet = self.packet_view(_data)
+        _payload_type = _packet.burst_type
         # _ambe_frames = _data[33:52]
         _ambe_frames = BitArray('0x'+h(_data[33:52])) 
         _ambe_frame1 = _ambe_frames[0:49]
@@ -425,7 +400,7 @@ class ambeIPSC(IPSC):
 
                     self._currentTG = _tg_id
                     self._transmitStartTime = time()
-                    self._start_seq = int_id(_data[20:22])
+                    self._start_seq = _packet.rtp_seq
                     self._packet_count = 0
                 else:
                     if self._currentTG != _tg_id:
@@ -436,7 +411,7 @@ class ambeIPSC(IPSC):
                             logger.warning('Transmission in progress, will not decode stream on TG {}'.format(_tg_id))
             if self._currentTG == _tg_id:
                 if _payload_type == BURST_DATA_TYPE['VOICE_TERM']:
-                    _source_packets = ( int_id(_data[20:22]) - self._start_seq ) - 3 # the 3 is because  the start and end are not part of the voice but counted in the RTP
+                    _source_packets = ( _packet.rtp_seq - self._start_seq ) - 3 # the 3 is because  the start and end are not part of the voice but counted in the RTP
                     if self._packet_count > _source_packets:
                         self._packet_count = _source_packets
                     if _source_packets > 0:
@@ -568,52 +543,39 @@ class ambeIPSC(IPSC):
     #************************************************
     def dumpIPSCFrame( self, _frame ):
         
-        _packettype     = int_id(_frame[0:1])                 # int8  GROUP_VOICE, PVT_VOICE, GROUP_DATA, PVT_DATA, CALL_MON_STATUS, CALL_MON_RPT, CALL_MON_NACK, XCMP_XNL, RPT_WAKE_UP, DE_REG_REQ
-        _peerid         = int_id(_frame[1:5])                 # int32 peer who is sending us a packet
-        _ipsc_seq       = int_id(_frame[5:6])                 # int8  looks like a sequence number for a packet
-        _src_sub        = int_id(_frame[6:9])                 # int32 Id of source
-        _dst_sub        = int_id(_frame[9:12])                # int32 Id of destination
-        _call_type      = int_id(_frame[12:13])               # int8 Priority Voice/Data
-        _call_ctrl_info  = int_id(_frame[13:17])              # int32
-        _call_info      = int_id(_frame[17:18])               # int8  Bits 6 and 7 defined as TS and END
+        _packet         = self.packet_view(_frame)
+        _packettype     = ord(_packet.packet_type)            # int8  GROUP_VOICE, PVT_VOICE, GROUP_DATA, PVT_DATA, CALL_MON_STATUS, CALL_MON_RPT, CALL_MON_NACK, XCMP_XNL, RPT_WAKE_UP, DE_REG_REQ
+        _peerid         = int_id(_packet.peer_id)             # int32 peer who is sending us a packet
+        _ipsc_seq       = _packet.ipsc_seq                    # int8  looks like a sequence number for a packet
+        _src_sub        = int_id(_packet.src_sub)             # int32 Id of source
+        _dst_sub        = int_id(_packet.dst_sub)             # int32 Id of destination
+        _call_type      = _packet.call_type                   # int8 Priority Voice/Data
+        _call_ctrl_info = int_id(_packet.call_ctrl)           # int32
+        _call_info      = _packet.call_info                   # int8  Bits 6 and 7 defined as TS and END
         
         # parse out the RTP values
-        _rtp_byte_1 = int_id(_frame[18:19])                 # Call Ctrl Src
-        _rtp_byte_2 = int_id(_frame[19:20])                 # Type
-        _rtp_seq    = int_id(_frame[20:22])                 # Call Seq No
-        _rtp_tmstmp = int_id(_frame[22:26])                 # Timestamp
-        _rtp_ssid   = int_id(_frame[26:30])                 # Sync Src Id
+        _rtp_byte_1, _rtp_byte_2, _rtp_seq, _rtp_tmstmp, _rtp_ssid = _packet.rtp  # Call Ctrl Src, Type, Call Seq No, Timestamp, Sync Src Id
         
-        _payload_type   = _frame[30]                       # int8  VOICE_HEAD, VOICE_TERM, SLOT1_VOICE, SLOT2_VOICE
+        _payload_type   = _packet.burst_type                  # int8  VOICE_HEAD, VOICE_TERM, SLOT1_VOICE, SLOT2_VOICE
         
-        _ts             = bool(_call_info & TS_CALL_MSK)
-        _end            = bool(_call_info & END_MSK)
+        _ts             = _packet.ts
+        _end            = _packet.end
 
         if _payload_type == BURST_DATA_TYPE['VOICE_HEAD']:
             print('HEAD:', h(_frame))
         if _payload_type == BURST_DATA_TYPE['VOICE_TERM']:
             
-            _ipsc_rssi_threshold_and_parity = int_id(_frame[31])
-            _ipsc_length_to_follow = int_id(_frame[32:34])
-            _ipsc_rssi_status = int_id(_frame[34])
-            _ipsc_slot_type_sync = int_id(_frame[35])
-            _ipsc_data_size = int_id(_frame[36:38])
+            (_ipsc_rssi_threshold_and_parity, _ipsc_length_to_follow, _ipsc_rssi_status, _ipsc_slot_type_sync, _ipsc_data_size,
+             _ipsc_full_lc_byte1, _ipsc_full_lc_fid, _ipsc_voice_pdu_service_options, _ipsc_voice_pdu_dst, _ipsc_voice_pdu_src) = _packet.voice_lc
             _ipsc_data = _frame[38:38+(_ipsc_length_to_follow * 2)-4]
-            _ipsc_full_lc_byte1 = int_id(_frame[38])
-            _ipsc_full_lc_fid = int_id(_frame[39])
-            _ipsc_voice_pdu_service_options = int_id(_frame[40])
-            _ipsc_voice_pdu_dst = int_id(_frame[41:44])
-            _ipsc_voice_pdu_src = int_id(_frame[44:47])
+            _ipsc_voice_pdu_dst = int_id(_ipsc_voice_pdu_dst)
+            _ipsc_voice_pdu_src = int_id(_ipsc_voice_pdu_src)
 
             print('{} {} {} {} {} {} {} {} {} {} {}'.format(_ipsc_rssi_threshold_and_parity,_ipsc_length_to_follow,_ipsc_rssi_status,_ipsc_slot_type_sync,_ipsc_data_size,h(_ipsc_data),_ipsc_full_lc_byte1,_ipsc_full_lc_fid,_ipsc_voice_pdu_service_options,_ipsc_voice_pdu_dst,_ipsc_voice_pdu_src))
             print('TERM:', h(_frame))
         if _payload_type == BURST_DATA_TYPE['SLOT1_VOICE']:
-            _rtp_len        = _frame[31:32]
-            _ambe           = _frame[33:52]
             print('SLOT1:', h(_frame))
         if _payload_type == BURST_DATA_TYPE['SLOT2_VOICE']:
-            _rtp_len        = _frame[31:32]
-            _ambe           = _frame[33:52]
             print('SLOT2:', h(_frame))
         print("pt={:02X} pid={} seq={:02X} src={} dst={} ct={:02X} uk={} ci={} rsq={}".format(_packettype, _peerid,_ipsc_seq, _src_sub,_dst_sub,_call_type,_call_ctrl_info,_call_info,_rtp_seq))
     
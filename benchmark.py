@@ -0,0 +1,660 @@
+#!/usr/bin/env python
+#
+###############################################################################
+#   Copyright (C) 2016  Cortney T. Buffington, N0MJS <n0mjs@me.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+# Micro-benchmarks for the hot paths in dmrlink.py and the applications built
+# on it. Each benchmark builds IPSC instances from a synthetic configuration
+# (no dmrlink.cfg needed) with a transport that throws packets away, so only
+# the cost of our own code is measured. Nothing is sent on the network.
+#
+# Run a single benchmark by name, or all of them:
+#   python benchmark.py dispatch
+#   python benchmark.py all
+#
+# To see what a change buys you, run the same benchmark before and after it.
+
+from __future__ import print_function
+
+import sys
+import socket
+import logging
+import argparse
+
+from timeit import Timer
+from time import clock, time, sleep
+from random import Random
+
+from dmr_utils.utils import hex_str_3, hex_str_4
+
+import dmrlink
+import bridge
+import confbridge
+import template
+from ipsc.ipsc_const import *
+from ipsc import sendmmsg
+from ipsc.acl import SubscriberACL
+from ipsc.duplicates import DuplicateFilter, packet_key
+from ipsc.player import PacingClock, FRAME_TIME, MAX_LATE, monotonic
+from ipsc.peer_record import PeerRecord, LinkStatus
+
+__author__      = 'Cortney T. Buffington, N0MJS'
+__copyright__   = 'Copyright (c) 2016 Cortney T. Buffington, N0MJS and the K0USY Group'
+__license__     = 'GNU GPLv3'
+__maintainer__  = 'Cort Buffington, N0MJS'
+__email__       = 'n0mjs@me.com'
+
+
+# Loops per timing run, and how many runs to take the best of
+LOOPS = 100000
+REPEAT = 5
+
+logger = logging.getLogger('benchmark')
+logger.addHandler(logging.NullHandler())
+logger.setLevel(logging.WARNING)
+
+
+# A transport that counts what it was asked to send and throws it away
+#
+class NullTransport(object):
+    def __init__(self):
+        self.writes = 0
+
+    def write(self, _packet, _addr):
+        self.writes += 1
+
+
+# A transport that really sends, on a UDP socket bound to loopback
+#
+class SocketTransport(object):
+    def __init__(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.setblocking(False)
+        self.writes = 0
+
+    def write(self, _packet, _addr):
+        self.writes += 1
+        try:
+            self.socket.sendto(_packet, _addr)
+        except socket.error:
+            pass
+
+    def fileno(self):
+        return self.socket.fileno()
+
+
+# Build a configuration dictionary shaped like the one from dmrlink_config.build_config
+# for _num_systems IPSC systems, each with _num_peers connected peers.
+#
+def mk_config(_num_systems = 1, _num_peers = 0, _auth = False, _master_peer = False):
+    CONFIG = {'GLOBAL': {}, 'REPORTS': {'REPORT_NETWORKS': ''}, 'LOGGER': {}, 'ALIASES': {}, 'SYSTEMS': {}}
+
+    for i in range(_num_systems):
+        _system = 'IPSC-{}'.format(i+1)
+        CONFIG['SYSTEMS'][_system] = {
+            'LOCAL': {
+                'ENABLED': True,
+                'MODE': '\x6A',
+                'FLAGS': '\x00\x00\x00\x0D',
+                'AUTH_ENABLED': _auth,
+                'AUTH_KEY': ('{:x}'.format(i+1).rjust(40, '0')).decode('hex'),
+                'MASTER_PEER': _master_peer,
+                'RADIO_ID': hex_str_4(312000 + i),
+                'IP': '127.0.0.1',
+                'PORT': 50000 + i,
+                'ALIVE_TIMER': 5,
+                'MAX_MISSED': 5,
+                'GROUP_HANGTIME': 5,
+                'NUM_PEERS': _num_peers
+            },
+            'MASTER': PeerRecord('127.0.0.1', 55000 + i, '\x6A', dmrlink.process_mode_byte('\x6A'),
+                                 '\x00\x00\x00\x0D', dmrlink.process_flags_bytes('\x00\x00\x00\x0D'),
+                                 _radio_id = hex_str_4(311000 + i), _status = LinkStatus(_connected = True)),
+            'PEERS': {}
+        }
+        CONFIG['SYSTEMS'][_system]['MASTER'].status.peer_list = True
+
+        for j in range(_num_peers):
+            CONFIG['SYSTEMS'][_system]['PEERS'][hex_str_4(313000 + j)] = PeerRecord(
+                '127.{}.{}.{}'.format(i, j / 250, j % 250 + 1), 56000 + j % 5000, '\x6A', dmrlink.process_mode_byte('\x6A'),
+                _status = LinkStatus(_connected = True))
+    return CONFIG
+
+
+# Create an instance of _class for every system in _config, hooked to a null transport
+#
+def mk_systems(_class, _config, *args):
+    _systems = {}
+    for _system in sorted(_config['SYSTEMS']):
+        _systems[_system] = _class(_system, _config, logger, *args)
+        _systems[_system].transport = NullTransport()
+    return _systems
+
+
+# Re-write the peer ID in a captured packet so it looks like it came from _peerid
+#
+def from_peer(_packet, _peerid):
+    return _packet[0] + _peerid + _packet[5:]
+
+
+# Time _func and report the best cost in microseconds per call, or per item if each
+# call to _func handles _items of them (packets, bursts, etc.)
+#
+def report(_name, _func, _items = 1, _loops = LOOPS):
+    _loops = max(_loops / _items, 1)
+    _best = min(Timer(_func).repeat(REPEAT, _loops)) / _loops / _items
+    print('    {:<52} {:9.3f} us'.format(_name, _best * 1000000))
+    return _best
+
+
+# An IPSC whose user packet callbacks do nothing, so the time measured is our own
+#
+class NullIPSC(dmrlink.IPSC):
+    def group_voice(self, _src_sub, _dst_sub, _ts, _end, _peerid, _data):
+        pass
+
+    def private_voice(self, _src_sub, _dst_sub, _ts, _end, _peerid, _data):
+        pass
+
+    def call_mon_status(self, _data):
+        pass
+
+    def call_mon_rpt(self, _data):
+        pass
+
+
+# Per-packet cost of IPSC.datagramReceived for the traffic mix we see in production:
+# about 95% of what arrives are group voice bursts, the rest is keep-alives and call
+# monitor packets. The callbacks do nothing, so this is the cost of classifying,
+# validating and dispatching a packet.
+#
+def bench_dispatch():
+    print('datagramReceived dispatch')
+    _config = mk_config(1, 10)
+    _ipsc = mk_systems(NullIPSC, _config).values()[0]
+    _master = _ipsc._master.radio_id
+    _peer = sorted(_ipsc._peers)[0]
+    _addr = (_ipsc._master.ip, _ipsc._master.port)
+
+    _voice = [from_peer(_burst, _master) for _burst in (template.voice_1, template.voice_2, template.voice_3, template.voice_4, template.voice_5, template.voice_6)]
+    _mix = _voice * 16 + [_voice[0]] * 3 + [
+        MASTER_ALIVE_REPLY + _master + _ipsc.TS_FLAGS + IPSC_VER,
+        PEER_ALIVE_REPLY + _peer + _ipsc.TS_FLAGS,
+        CALL_MON_STATUS + _peer + '\x00' * 24,
+        CALL_MON_RPT + _peer + '\x01\x02'
+    ]
+    _received = _ipsc.datagramReceived
+
+    def voice():
+        _received(_voice[0], _addr)
+
+    def mix():
+        for _packet in _mix:
+            _received(_packet, _addr)
+
+    report('voice burst, per packet', voice)
+    report('95% voice mix, per packet', mix, len(_mix))
+
+
+# Authenticated voice forwarding: verify the hash on a received burst, then sign and
+# send it to every connected peer in another IPSC, as bridge.py does. Also the cost
+# of sending a keep-alive, which is one of the static maintenance packets.
+#
+def bench_auth():
+    print('Authenticated IPSC')
+    _config = mk_config(2, 10, _auth = True)
+    _systems = mk_systems(NullIPSC, _config)
+    _source, _target = [_systems[_system] for _system in sorted(_systems)]
+    _addr = (_source._master.ip, _source._master.port)
+
+    _voice = from_peer(template.voice_1, _source._master.radio_id)
+    _signed = _source.hashed_packet(_source._local['AUTH_KEY'], _voice)
+    _received = _source.datagramReceived
+    _forward = _target.send_to_ipsc
+    _send = _target.send_packet
+    _keep_alive = _target.MASTER_ALIVE_PKT
+    _master_sock = _target._master_sock
+
+    def receive():
+        _received(_signed, _addr)
+
+    def forward():
+        _received(_signed, _addr)
+        _forward(_voice)
+
+    def keep_alive():
+        _send(_keep_alive, _master_sock)
+
+    report('receive and validate voice burst', receive)
+    report('receive, validate, forward to 11 destinations', forward)
+    report('send keep-alive to master', keep_alive)
+
+
+# Fan-out of one forwarded burst to 6 IPSC systems with 10 peers each, all of them
+# real UDP sockets on loopback. Reports system calls and CPU time per forwarded burst,
+# first with one transport.write per destination, then with sendmmsg if we have it.
+#
+def bench_fanout():
+    print('send_to_ipsc fan-out, 6 systems x (master + 10 peers), loopback')
+    _config = mk_config(6, 10)
+    _receivers = []
+
+    # Point the master and every peer at a socket we're listening on
+    for _system in _config['SYSTEMS'].values():
+        for _station in [_system['MASTER']] + _system['PEERS'].values():
+            _rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            _rx.bind(('127.0.0.1', 0))
+            _rx.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            _receivers.append(_rx)
+            _station.ip, _station.port = _rx.getsockname()
+
+    _systems = mk_systems(NullIPSC, _config).values()
+    for _ipsc in _systems:
+        _ipsc.transport = SocketTransport()
+    _voice = template.voice_1
+    _bursts = 10000
+
+    def forward():
+        for _ipsc in _systems:
+            _ipsc.send_to_ipsc(_voice)
+
+    def run(_name):
+        for _ipsc in _systems:
+            _ipsc.transport.writes = 0
+            if _ipsc._multi_sender:
+                _ipsc._multi_sender.calls = 0
+        _start = clock()
+        for i in xrange(_bursts):
+            forward()
+        _cpu = clock() - _start
+        _calls = sum(_ipsc.transport.writes + (_ipsc._multi_sender.calls if _ipsc._multi_sender else 0) for _ipsc in _systems)
+        print('    {:<52} {:9.1f} syscalls, {:9.3f} us CPU per burst'.format(_name, float(_calls) / _bursts, _cpu / _bursts * 1000000))
+
+    run('transport.write per destination')
+    if sendmmsg.AVAILABLE:
+        for _ipsc in _systems:
+            _ipsc.start_multi_sender()
+        run('sendmmsg')
+    else:
+        print('    sendmmsg is not available on this platform')
+
+    for _rx in _receivers:
+        _rx.close()
+
+
+# Registration storm at the master: 50 repeaters come back after a site power cycle and
+# every one of them asks for the peer list. Compares building and signing the peer list
+# for each request with the cached PEER_LIST_REPLY, and what it costs to refresh that
+# cache when a peer changes mode.
+#
+def bench_peer_list():
+    print('Master PEER_LIST_REPLY, 50 peers, authenticated')
+    _config = mk_config(1, 50, _auth = True, _master_peer = True)
+    for _system in _config['SYSTEMS'].values():
+        _system['MASTER'].status.connected = False
+    _ipsc = mk_systems(NullIPSC, _config).values()[0]
+    _peerid = sorted(_ipsc._peers)[0]
+    _peer = _ipsc._peers[_peerid]
+
+    def rebuild():
+        _ipsc.send_to_ipsc(_ipsc.PEER_LIST_REPLY_PKT + dmrlink.build_peer_list(_ipsc._peers))
+
+    def cached():
+        _ipsc.write_to_ipsc(_ipsc.peer_list_reply_packet())
+
+    def mode_change():
+        _peer.mode = '\x65' if _peer.mode == '\x6A' else '\x6A'
+        _ipsc.update_peer_list(_peerid)
+        _ipsc.write_to_ipsc(_ipsc.peer_list_reply_packet())
+
+    report('build and sign the peer list for each request', rebuild, _loops = LOOPS / 10)
+    report('cached peer list', cached)
+    report('peer changes mode, then peer list sent', mode_change, _loops = LOOPS / 10)
+
+
+# A peer applying the peer list from its master: 250 peers, with nothing changed (by far
+# the common case -- the master re-sends the list every time anyone registers) and with
+# one peer that changed mode.
+#
+def bench_peer_table():
+    print('process_peer_list, 250 peers')
+    _config = mk_config(1, 250)
+    _ipsc = mk_systems(NullIPSC, _config).values()[0]
+    _peers = _ipsc._peers
+    _unchanged = PEER_LIST_REPLY + _ipsc._master.radio_id + dmrlink.build_peer_list(_peers)
+    _peerid = sorted(_peers)[0]
+    _entry = dmrlink.peer_list_entry(_peerid, _peers[_peerid])
+    _modes = [_unchanged.replace(_entry, _entry[:-1] + _mode) for _mode in ('\x65', '\x6A')]
+    _process = _ipsc.process_peer_list
+
+    def unchanged():
+        _process(_unchanged)
+
+    def one_changed():
+        for _list in _modes:
+            _process(_list)
+
+    report('unchanged peer list', unchanged, _loops = LOOPS / 100)
+    report('one peer changed mode', one_changed, 2, _loops = LOOPS / 100)
+
+
+# Keep-alive simulation: one IPSC with 5,000 peers that all answer right away, over 60 seconds
+# of simulated time. For every tick of the keep-alive timer wheel, counts the keep-alives sent
+# (the burst) and the CPU time the tick took. First with every peer due at the same moment and
+# no jitter -- what a single pass over the whole peer table every ALIVE_TIMER looks like -- then
+# with each peer's first keep-alive spread over ALIVE_TIMER and jitter on the ones after it.
+#
+def bench_keep_alive():
+    _num_peers = 5000
+    _seconds = 60
+    print('Keep-alive timer wheel, {} peers, ALIVE_TIMER 5s, {}s simulated, {}s ticks'.format(_num_peers, _seconds, dmrlink.KEEP_ALIVE_TICK))
+    _jitter = dmrlink.KEEP_ALIVE_JITTER
+
+    # Every keep-alive is answered straight away, so none are missed
+    class AnsweringTransport(NullTransport):
+        def __init__(self, _peers):
+            NullTransport.__init__(self)
+            self._status = dict(((_peer.ip, _peer.port), _peer.status) for _peer in _peers.values())
+
+        def write(self, _packet, _addr):
+            self.writes += 1
+            self._status[_addr].keep_alives_outstanding = 0
+
+    def run(_name, _spread):
+        _config = mk_config(1, _num_peers)
+        _ipsc = mk_systems(NullIPSC, _config).values()[0]
+        _ipsc.transport = AnsweringTransport(_ipsc._peers)
+        _start = time()
+        if not _spread:
+            dmrlink.KEEP_ALIVE_JITTER = 0
+            for _peerid in _ipsc._peers:
+                _ipsc._keep_alives.schedule(_peerid, _start)
+        _bursts = []
+        _costs = []
+        try:
+            for _tick in xrange(int(_seconds / dmrlink.KEEP_ALIVE_TICK)):
+                _ipsc.transport.writes = 0
+                _begin = clock()
+                _ipsc.keep_alive_loop(_start + _tick * dmrlink.KEEP_ALIVE_TICK)
+                _costs.append(clock() - _begin)
+                _bursts.append(_ipsc.transport.writes)
+        finally:
+            dmrlink.KEEP_ALIVE_JITTER = _jitter
+        _busy = [_cost for _cost, _burst in zip(_costs, _bursts) if _burst]
+        print('    {:<30} burst max {:5d}, mean {:7.1f} | tick max {:7.2f} ms, mean {:6.3f} ms, {:3d} of {} ticks busy'.format(
+            _name, max(_bursts), float(sum(_bursts)) / len(_bursts), max(_costs) * 1000, sum(_costs) / len(_costs) * 1000, len(_busy), len(_costs)))
+
+    run('all due together, no jitter', False)
+    run('spread and jittered', True)
+
+
+# Bridge rules shaped like the ones build_rules makes from a rule file: _num_rules for
+# each system, half on each timeslot, each sending its TGID on to one of the others.
+# The reciprocal rule (same NAME) is in every system.
+#
+def mk_bridge_rules(_systems, _num_rules):
+    _rules = {}
+    _names = sorted(_systems)
+    for _system in _names:
+        _others = [_other for _other in _names if _other != _system]
+        _rules[_system] = {'TRUNK': False, 'GROUP_HANGTIME': 5, 'GROUP_VOICE': [], 'PRIVATE_VOICE': []}
+        for j in range(_num_rules):
+            _tgid = 1000 + j / 2
+            _ts = j % 2 + 1
+            _rules[_system]['GROUP_VOICE'].append({
+                'NAME': 'TG{}-TS{}'.format(_tgid, _ts), 'ACTIVE': True, 'TO_TYPE': 'ON', 'TIMEOUT': 600, 'TIMER': time(),
+                'ON': [hex_str_3(_tgid + 10000)], 'OFF': [hex_str_3(_tgid + 20000)],
+                'SRC_TS': _ts, 'SRC_GROUP': hex_str_3(_tgid), 'DST_NET': _others[j % len(_others)], 'DST_TS': _ts, 'DST_GROUP': hex_str_3(_tgid)
+            })
+    return _rules
+
+
+# bridge.py group voice routing with 500 rules in each of 6 systems: a voice burst on the
+# TGID of the last rule in the file, one on a TGID that isn't bridged at all, and the
+# voice terminator that ends a call on the last rule (timer resets for it and its
+# reciprocal, and the ON/OFF trigger checks).
+#
+def bench_bridge():
+    _num_systems, _num_rules = 6, 500
+    print('bridge.py group_voice, {} systems x {} rules'.format(_num_systems, _num_rules))
+    _config = mk_config(_num_systems, 0)
+    bridge.DUPLICATE_WINDOW = 0     # the same packets are sent over and over (see bench_duplicates)
+    _systems = mk_systems(bridge.bridgeIPSC, _config, [])
+    bridge.systems.clear()
+    bridge.systems.update(_systems)
+    bridge.RULES = mk_bridge_rules(_systems, _num_rules)
+    bridge.RULE_INDEX = bridge.build_rule_index(bridge.RULES)
+    bridge.allow_sub = SubscriberACL().allow
+
+    _source = _systems[sorted(_systems)[0]]
+    _last = bridge.RULES[_source._system]['GROUP_VOICE'][-1]
+    _voice = template.voice_1
+    _peerid, _src_sub = _voice[1:5], _voice[6:9]
+    _routed = _voice[:9] + _last['SRC_GROUP'] + _voice[12:]
+    _unrouted = _voice[:9] + hex_str_3(9) + _voice[12:]
+    _term = template.voice_t[:9] + _last['SRC_GROUP'] + template.voice_t[12:]
+    _group_voice = _source.group_voice
+
+    def routed():
+        _group_voice(_src_sub, _last['SRC_GROUP'], _last['SRC_TS'], False, _peerid, _routed)
+
+    def unrouted():
+        _group_voice(_src_sub, hex_str_3(9), _last['SRC_TS'], False, _peerid, _unrouted)
+
+    def term():
+        _group_voice(_src_sub, _last['SRC_GROUP'], _last['SRC_TS'], True, _peerid, _term)
+
+    report('voice burst, last rule in the file', routed, _loops = LOOPS / 10)
+    report('voice burst, TGID not bridged', unrouted, _loops = LOOPS / 10)
+    report('voice terminator, last rule in the file', term, _loops = LOOPS / 100)
+
+
+# Conference bridges shaped like the ones make_bridges makes from a rule file: _num_bridges
+# bridges, each with every system as a member on its own TGID.
+#
+def mk_conf_bridges(_systems, _num_bridges):
+    _bridges = {}
+    for i in range(_num_bridges):
+        _bridges['BRIDGE-{}'.format(i+1)] = [
+            {'SYSTEM': _system, 'TS': i % 2 + 1, 'TGID': hex_str_3(3100 + i), 'ACTIVE': True, 'TIMEOUT': 600, 'TIMER': time(), 'TO_TYPE': 'NONE', 'ON': [], 'OFF': []}
+            for _system in sorted(_systems)
+        ]
+    return _bridges
+
+
+# confbridge.py group voice routing on a node with 40 conference bridges across 6 systems:
+# routing the start of a call on the last bridge, and the voice bursts after it.
+#
+def bench_confbridge():
+    _num_systems, _num_bridges = 6, 40
+    print('confbridge.py group_voice, {} systems, {} bridges'.format(_num_systems, _num_bridges))
+    _config = mk_config(_num_systems, 0)
+    confbridge.DUPLICATE_WINDOW = 0     # the same packets are sent over and over (see bench_duplicates)
+    _systems = mk_systems(confbridge.confbridgeIPSC, _config)
+    confbridge.systems.clear()
+    confbridge.systems.update(_systems)
+    confbridge.BRIDGES = mk_conf_bridges(_systems, _num_bridges)
+    confbridge.BRIDGE_INDEX = confbridge.build_bridge_index(confbridge.BRIDGES)
+    confbridge.allow_sub = SubscriberACL().allow
+
+    _source = _systems[sorted(_systems)[0]]
+    _member = confbridge.BRIDGES['BRIDGE-{}'.format(_num_bridges)][0]
+    _tgid, _ts = _member['TGID'], _member['TS']
+    _voice = template.voice_1
+    _peerid, _src_sub = _voice[1:5], _voice[6:9]
+    _head = template.v_hed_1[:9] + _tgid + template.v_hed_1[12:]
+    _burst = _voice[:9] + _tgid + _voice[12:]
+    _group_voice = _source.group_voice
+
+    def head():
+        _source.STREAMS.clear()
+        _group_voice(_src_sub, _tgid, _ts, False, _peerid, _head)
+
+    def burst():
+        _group_voice(_src_sub, _tgid, _ts, False, _peerid, _burst)
+
+    report('voice header, routed to 5 systems', head, _loops = LOOPS / 10)
+    report('voice burst, routed to 5 systems', burst, _loops = LOOPS / 10)
+
+
+# Subscriber ACL check (allow_sub in bridge.py and confbridge.py) for every voice packet,
+# against a 50,000 entry DENY list plus ranges, with and without per-system ACLs as well.
+#
+def bench_acl():
+    _num_ids = 50000
+    print('SubscriberACL.allow, {} denied IDs'.format(_num_ids))
+    _entries = range(3100000, 3100000 + _num_ids * 2, 2) + [(1000000, 1099999)]
+    _acl = SubscriberACL('DENY', _entries)
+    _system_acl = SubscriberACL('DENY', _entries, {'SYSTEM-0': ('PERMIT', [(3000000, 3999999)]), ('SYSTEM-0', 1): ('DENY', [3100001])})
+    _allowed, _denied = hex_str_3(3100001), hex_str_3(3100000 + _num_ids)
+    _allow, _allow_system = _acl.allow, _system_acl.allow
+
+    def allowed():
+        _allow(_allowed, 'SYSTEM-0', 1)
+
+    def denied():
+        _allow(_denied, 'SYSTEM-0', 1)
+
+    def system():
+        _allow_system(_allowed, 'SYSTEM-0', 2)
+
+    report('allowed subscriber', allowed)
+    report('denied subscriber', denied)
+    report('allowed subscriber, global + system + TS ACLs', system)
+
+
+# Duplicate filter check for every group voice packet in bridge.py and confbridge.py: a new
+# packet (remembered, and one that has aged out forgotten) and a duplicate of one, with the
+# filter holding a full window of 100 calls' worth of packets.
+#
+def bench_duplicates():
+    _window, _size = 1, 5000
+    print('DuplicateFilter.is_duplicate, {} s window, {} packets'.format(_window, _size))
+    _filter = DuplicateFilter(_window, _size)
+    _voice = template.voice_1
+    _packets = [_voice[:20] + hex_str_4(i)[2:] + _voice[22:] for i in xrange(_size)]
+    _now = [0.0]
+    for _packet in _packets:
+        _filter.is_duplicate(packet_key(_packet), _now[0])
+        _now[0] += float(_window) / _size
+    _packets = iter(_packets * (LOOPS * REPEAT / _size + 1))
+    _duplicate = packet_key(template.voice_1)
+    _is_duplicate = _filter.is_duplicate
+
+    def new():
+        _now[0] += float(_window) / _size
+        _is_duplicate(packet_key(next(_packets)), _now[0])
+
+    def duplicate():
+        _is_duplicate(_duplicate, _now[0])
+
+    report('new packet', new)
+    _is_duplicate(_duplicate, _now[0])
+    report('duplicate packet', duplicate)
+
+
+# The pacing clock used for transmitting: the cost of a tick, how it deals with a stall (on a
+# simulated clock), and how far off the 60 ms timeline it gets in real time while the sender
+# is busy -- compared with sleeping 60 ms after each burst, as we used to. The statistics are
+# checked, so this fails if the timeline drifts or jitters by a slot or more.
+#
+def bench_pacing():
+    print('PacingClock')
+    _now = [0.0]
+    _clock = PacingClock(_clock = lambda: _now[0])
+    _tick = _clock.tick
+
+    def tick():
+        _now[0] += FRAME_TIME
+        _tick()
+
+    report('tick', tick)
+
+    _frames, _stall = 100, 0.5
+    for _drop in (True, False):
+        _now[0] = 0.0
+        _clock = PacingClock(_drop, _clock = lambda: _now[0])
+        _clock.start()
+        for i in xrange(_frames):
+            _now[0] = max(_now[0], _clock.due())
+            if i == _frames / 2:
+                _now[0] += _stall
+            _clock.tick()
+        print('    {:<52} {}'.format('{:.0f} ms stall, {}'.format(_stall * 1000, 'dropping' if _drop else 'live'), _clock))
+        assert _clock.overruns == 1
+        assert _clock.sent + _clock.dropped == _frames
+        if _drop:
+            assert _clock.dropped == int((_stall - MAX_LATE) / FRAME_TIME) + 1
+        else:
+            assert _clock.dropped == 0
+            assert _clock.late == 1 and abs(_clock.jitter_max - _stall) < 1e-6
+
+    # 50 bursts for real, each taking up to 40 ms to prepare
+    _frames = 50
+    _random = Random(0)
+    _work = [_random.uniform(0, 0.04) for i in xrange(_frames)]
+
+    def busy(_seconds):
+        _until = monotonic() + _seconds
+        while monotonic() < _until:
+            pass
+
+    _clock = PacingClock()
+    _clock.start()
+    for i in xrange(_frames):
+        busy(_work[i])
+        _clock.pace()
+    _drift = monotonic() - (_clock.due() - FRAME_TIME)
+    print('    {:<52} {}, {:.1f} ms drift'.format('{} bursts, paced'.format(_frames), _clock, _drift * 1000))
+    assert _clock.dropped == 0 and _clock.overruns == 0
+    assert _clock.jitter_max < FRAME_TIME and abs(_drift) < FRAME_TIME
+
+    _start = monotonic()
+    for i in xrange(_frames):
+        busy(_work[i])
+        sleep(FRAME_TIME)
+    _drift = monotonic() - (_start + _frames * FRAME_TIME)
+    print('    {:<52} {:.1f} ms drift'.format('{} bursts, sleeping {:.0f} ms each'.format(_frames, FRAME_TIME * 1000), _drift * 1000))
+
+
+BENCHMARKS = {
+    'acl':        bench_acl,
+    'dispatch':   bench_dispatch,
+    'duplicates': bench_duplicates,
+    'auth':       bench_auth,
+    'bridge':     bench_bridge,
+    'confbridge': bench_confbridge,
+    'fanout':     bench_fanout,
+    'keep_alive': bench_keep_alive,
+    'pacing':     bench_pacing,
+    'peer_list':  bench_peer_list,
+    'peer_table': bench_peer_table
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmark', nargs='?', default='all', choices=sorted(BENCHMARKS.keys()) + ['all'], help='benchmark to run (default: all)')
+    cli_args = parser.parse_args()
+
+    if cli_args.benchmark == 'all':
+        for _name in sorted(BENCHMARKS):
+            BENCHMARKS[_name]()
+    else:
+        BENCHMARKS[cli_args.benchmark]()
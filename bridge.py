@@ -30,12 +30,17 @@
 # used when you want bridge.py to be "polite" or serve as a backup bridge. If
 # a known bridge exists in either a source OR target IPSC network, then no
 # bridging between those IPSC systems will take place. This behavior is
-# dynamic and updates each keep-alive interval (main configuration file).
-# For faster failover, configure a short keep-alive time and a low number of
-# missed keep-alives before timout. I recommend 5 sec keep-alive and 3 missed.
-# That gives a worst-case scenario of 15 seconds to fail over. Recovery will
-# typically happen with a single "blip" in the transmission up to about 5
-# seconds.
+# dynamic and updates as soon as a known bridge registers, changes mode or is
+# dropped from the IPSC. For faster failover, configure a short keep-alive
+# time and a low number of missed keep-alives before timout, since that's how
+# long it takes to notice a bridge that has gone away. I recommend 5 sec
+# keep-alive and 3 missed. That gives a worst-case scenario of 15 seconds to
+# fail over.
+#
+# These files, and the subscriber ACL (sub_acl.py), are read again without
+# restarting or dropping out of the IPSC networks when bridge.py gets a SIGHUP
+# (systemctl reload). Rules still in "bridge_rules" (by NAME) keep their
+# current state and timers.
 #
 # While this file is listed as Beta status, K0USY Group depends on this code
 # for the bridigng of it's many repeaters. We consider it reliable, but you
@@ -48,7 +53,7 @@ from twisted.internet import reactor
 from twisted.internet import task
 from binascii import b2a_hex as ahex
 from time import time
-from importlib import import_module
+import imp
 
 import sys
 
@@ -56,6 +61,8 @@ from dmr_utils.utils import hex_str_3, hex_str_4, int_id
 
 from dmrlink import IPSC, systems, config_reports
 from ipsc.ipsc_const import BURST_DATA_TYPE
+from ipsc.acl import SubscriberACL
+from ipsc.duplicates import DuplicateFilter, packet_key
 
 
 __author__      = 'Cortney T. Buffington, N0MJS'
@@ -70,6 +77,38 @@ __email__       = 'n0mjs@me.com'
 #
 TS_CLEAR_TIME = .2
 
+# How long a call can go without a packet before we forget how it was routed
+#
+STREAM_TIMEOUT = 1
+
+# Group voice packets already received within DUPLICATE_WINDOW seconds (the same packet from
+# the same peer) are dropped, so a stream arriving twice isn't forwarded twice. At most
+# DUPLICATE_SIZE packets are remembered per system. A DUPLICATE_WINDOW of 0 turns this off.
+#
+DUPLICATE_WINDOW = 1
+DUPLICATE_SIZE = 5000
+
+# Counts changes to the rules (activated or de-activated) and to each system's bridging
+# status. Calls in progress are routed again when it changes -- see bridgeIPSC.group_voice
+#
+RULE_VERSION = 0
+
+# Load one of the additional configuration files. It's read into a new module every time, never
+# the one loaded before, so loading it again picks up everything that has changed in it --
+# including names that have been taken out (see reload_config). Raises ImportError if there's
+# no such file.
+#
+def load_module(_name):
+    _file, _path, _description = imp.find_module(_name)
+    if _file:
+        _file.close()
+    if _description[2] != imp.PY_SOURCE:
+        raise ImportError('{} is not a Python source file: {}'.format(_name, _path))
+    _module = imp.new_module(_name)
+    _module.__file__ = _path
+    execfile(_path, _module.__dict__)
+    return _module
+
 # Import Bridging rules
 # Note: A stanza *must* exist for any IPSC configured in the main
 # configuration file and listed as "active". It can be empty, 
@@ -77,17 +116,28 @@ TS_CLEAR_TIME = .2
 #
 def build_rules(_bridge_rules):
     try:
-        rule_file = import_module(_bridge_rules)
+        rule_file = load_module(_bridge_rules)
         logger.info('Bridge rules file found and rules imported')
     except ImportError:
         sys.exit('Bridging rules file not found or invalid')
+    try:
+        return compile_rules(rule_file.RULES)
+    except ValueError as e:
+        sys.exit('ERROR: {}'.format(e))
 
-    # Convert integer GROUP ID numbers from the config into hex strings
-    # we need to send in the actual data packets.
-    #
-
-    for _ipsc in rule_file.RULES:
-        for _rule in rule_file.RULES[_ipsc]['GROUP_VOICE']:
+# Convert integer GROUP ID numbers from the config into hex strings
+# we need to send in the actual data packets, and check the rules
+# against the main configuration. Raises ValueError if they don't fit.
+#
+def compile_rules(_rules):
+    for _ipsc in _rules:
+        if _ipsc not in CONFIG['SYSTEMS']:
+            raise ValueError('Bridge rules found for an IPSC network not configured in main configuration')
+        for _rule in _rules[_ipsc]['GROUP_VOICE']:
+            if _rule['DST_NET'] not in CONFIG['SYSTEMS']:
+                raise ValueError('Bridge rule \"{}\" in {} is for an IPSC network not configured in main configuration: {}'.format(_rule['NAME'], _ipsc, _rule['DST_NET']))
+            if _rule['SRC_TS'] not in (1, 2) or _rule['DST_TS'] not in (1, 2):
+                raise ValueError('Bridge rule \"{}\" in {} has a timeslot other than 1 or 2'.format(_rule['NAME'], _ipsc))
             _rule['SRC_GROUP']  = hex_str_3(_rule['SRC_GROUP'])
             _rule['DST_GROUP']  = hex_str_3(_rule['DST_GROUP'])
             _rule['SRC_TS']     = _rule['SRC_TS']
@@ -98,97 +148,216 @@ def build_rules(_bridge_rules):
                 _rule['OFF'][i] = hex_str_3(_rule['OFF'][i])
             _rule['TIMEOUT']= _rule['TIMEOUT']*60
             _rule['TIMER']      = time() + _rule['TIMEOUT']
-        if _ipsc not in CONFIG['SYSTEMS']:
-            sys.exit('ERROR: Bridge rules found for an IPSC network not configured in main configuration')
     for _ipsc in CONFIG['SYSTEMS']:
-        if _ipsc not in rule_file.RULES:
-            sys.exit('ERROR: Bridge rules not found for all IPSC network configured')
+        if _ipsc not in _rules:
+            raise ValueError('Bridge rules not found for all IPSC network configured')
+
+    return _rules
+
+# Index each IPSC's GROUP_VOICE rules, so neither group_voice nor call teardown has to
+# look through all of them:
+#   'SOURCE'  (SRC_GROUP, SRC_TS) -> every rule for it
+#   'ACTIVE'  (SRC_GROUP, SRC_TS) -> just the active ones (in rule file order). Turn rules
+#             on and off with set_rule_active so this stays up to date.
+#   'ON'      TGID -> the rules it activates
+#   'OFF'     TGID -> the rules it de-activates
+#   'NAME'    NAME -> the rules with that name, i.e. the reciprocals of rules in other
+#             IPSCs that have this one as DST_NET
+#
+def build_rule_index(_rules):
+    _index = {}
+    for _ipsc in _rules:
+        _index[_ipsc] = {'SOURCE': {}, 'ACTIVE': {}, 'ON': {}, 'OFF': {}, 'NAME': {}}
+        for _rule in _rules[_ipsc]['GROUP_VOICE']:
+            _index[_ipsc]['SOURCE'].setdefault((_rule['SRC_GROUP'], _rule['SRC_TS']), []).append(_rule)
+            for _tgid in set(_rule['ON']):
+                _index[_ipsc]['ON'].setdefault(_tgid, []).append(_rule)
+            for _tgid in set(_rule['OFF']):
+                _index[_ipsc]['OFF'].setdefault(_tgid, []).append(_rule)
+            _index[_ipsc]['NAME'].setdefault(_rule['NAME'], []).append(_rule)
+        for _key in _index[_ipsc]['SOURCE']:
+            index_active_rules(_index[_ipsc], _key)
+    return _index
+
+def index_active_rules(_ipsc_index, _key):
+    _active = [_rule for _rule in _ipsc_index['SOURCE'][_key] if _rule['ACTIVE'] == True]
+    if _active:
+        _ipsc_index['ACTIVE'][_key] = _active
+    else:
+        _ipsc_index['ACTIVE'].pop(_key, None)
 
-    return rule_file.RULES
+# Activate or de-activate a rule of IPSC _ipsc
+def set_rule_active(_ipsc, _rule, _active):
+    if _rule['ACTIVE'] != _active:
+        _rule['ACTIVE'] = _active
+        index_active_rules(RULE_INDEX[_ipsc], (_rule['SRC_GROUP'], _rule['SRC_TS']))
+        arm_rule_timer(_ipsc, _rule)
+        rules_changed()
+
+def rules_changed():
+    global RULE_VERSION
+    RULE_VERSION += 1
 
 # Import List of Bridges
 # This is how we identify known bridges. If one of these is present
 # and it's mode byte is set to bridge, we don't
+# Returns the set of their radio IDs as they appear in packets (4 bytes).
 #
 def build_bridges(_known_bridges):
     try:
-        bridges_file = import_module(_known_bridges)
+        bridges_file = load_module(_known_bridges)
+        for _bridge in bridges_file.BRIDGES:
+            if not isinstance(_bridge, (int, long)):
+                raise ValueError('Known bridges must be integer radio IDs: {!r}'.format(_bridge))
         logger.info('Known bridges file found and bridge ID list imported ')
-        return bridges_file.BRIDGES
+        return frozenset(hex_str_4(_bridge) for _bridge in bridges_file.BRIDGES)
     except ImportError:
         logger.critical('\'known_bridges.py\' not found - backup bridge service will not be enabled')
-        return []
+        return frozenset()
     
 
 # Import subscriber ACL
-# ACL may be a single list of subscriber IDs
-# Global action is to allow or deny them. Multiple lists with different actions and ranges
-# are not yet implemented.
+# The global ACL_ACTION (PERMIT or DENY) applies to the subscriber IDs and ID ranges in ACL.
+# SYSTEM_ACL can add ACLs of the same kind for calls from a system or one timeslot of it (see
+# sub_acl_SAMPLE.py). They are compiled into a SubscriberACL, and allow_sub is its check.
 def build_acl(_sub_acl):
     try:
-        acl_file = import_module(_sub_acl)
-        for i, e in enumerate(acl_file.ACL):
-            acl_file.ACL[i] = hex_str_3(acl_file.ACL[i])
+        acl_file = load_module(_sub_acl)
+        for _name in ('ACL_ACTION', 'ACL'):
+            if not hasattr(acl_file, _name):
+                raise ValueError('ACL file has no {}'.format(_name))
+        _system_acls = getattr(acl_file, 'SYSTEM_ACL', {})
+        if not isinstance(_system_acls, dict):
+            raise ValueError('SYSTEM_ACL must be a dictionary')
+        _systems = {}
+        for _key, _acl in _system_acls.items():
+            if isinstance(_key, tuple) and (len(_key) != 2 or _key[1] not in (1, 2)):
+                raise ValueError('ACL found for a timeslot that isn\'t (SYSTEM, 1) or (SYSTEM, 2): {}'.format(_key))
+            if (_key[0] if isinstance(_key, tuple) else _key) not in CONFIG['SYSTEMS']:
+                raise ValueError('ACL found for a system not configured in main configuration: {}'.format(_key))
+            if not isinstance(_acl, dict) or 'ACL_ACTION' not in _acl or 'ACL' not in _acl:
+                raise ValueError('ACL for {} must be a dictionary with an ACL_ACTION and an ACL'.format(_key))
+            _systems[_key] = (_acl['ACL_ACTION'], _acl['ACL'])
+        ACL = SubscriberACL(acl_file.ACL_ACTION, acl_file.ACL, _systems)
         logger.info('ACL file found and ACL entries imported')
-        ACL_ACTION = acl_file.ACL_ACTION
-        ACL = acl_file.ACL_ACTION
     except ImportError:
         logger.info('ACL file not found or invalid - all subscriber IDs are valid')
-        ACL_ACTION = 'NONE'
-        ACL = []
+        ACL = SubscriberACL()
 
-    # Depending on which type of ACL is used (PERMIT, DENY... or there isn't one)
-    # define a differnet function to be used to check the ACL
     global allow_sub
-    if ACL_ACTION == 'PERMIT':
-        def allow_sub(_sub):
-            if _sub in ACL:
-                return True
-            else:
-                return False
-    elif ACL_ACTION == 'DENY':
-        def allow_sub(_sub):
-            if _sub not in ACL:
-                return True
-            else:
-                return False
-    else:
-        def allow_sub(_sub):
-            return True
-    
+    allow_sub = ACL.allow
+
     return ACL
     
     
-# Run this every minute for rule timer updates
-def rule_timer_loop():
-    logger.debug('(ALL IPSC) Rule timer loop started')
-    _now = time()
-    for _network in RULES:
-        for _rule in RULES[_network]['GROUP_VOICE']:
-            if _rule['TO_TYPE'] == 'ON':
-                if _rule['ACTIVE'] == True:
-                    if _rule['TIMER'] < _now:
-                        _rule['ACTIVE'] = False
-                        logger.info('(%s) Rule timout DEACTIVATE: Rule name: %s, Target IPSC: %s, TS: %s, TGID: %s', _network, _rule['NAME'], _rule['DST_NET'], _rule['DST_TS'], int_id(_rule['DST_GROUP']))
-                    else:
-                        timeout_in = _rule['TIMER'] - _now
-                        logger.info('(%s) Rule ACTIVE with ON timer running: Timeout eligible in: %ds, Rule name: %s, Target IPSC: %s, TS: %s, TGID: %s', _network, timeout_in, _rule['NAME'], _rule['DST_NET'], _rule['DST_TS'], int_id(_rule['DST_GROUP']))
-            elif _rule['TO_TYPE'] == 'OFF':
-                if _rule['ACTIVE'] == False:
-                    if _rule['TIMER'] < _now:
-                        _rule['ACTIVE'] = True
-                        logger.info('(%s) Rule timout ACTIVATE: Rule name: %s, Target IPSC: %s, TS: %s, TGID: %s', _network, _rule['NAME'], _rule['DST_NET'], _rule['DST_TS'], int_id(_rule['DST_GROUP']))
-                    else:
-                        timeout_in = _rule['TIMER'] - _now
-                        logger.info('(%s) Rule DEACTIVE with OFF timer running: Timeout eligible in: %ds, Rule name: %s, Target IPSC: %s, TS: %s, TGID: %s', _network, timeout_in, _rule['NAME'], _rule['DST_NET'], _rule['DST_TS'], int_id(_rule['DST_GROUP']))
-            else:
-                logger.debug('Rule timer loop made no rule changes')
+# Rule timers: a rule with TO_TYPE 'ON' turns itself off when its TIMER runs out while it's
+# active, one with TO_TYPE 'OFF' turns itself back on when its TIMER runs out while it's
+# inactive. Every rule in the state its timer applies to has a reactor.callLater armed for
+# its TIMER (kept in the rule as 'TIMER_CALL'), which is moved whenever the TIMER is reset
+# -- so each timeout fires once, on time, and rules that are just sitting there cost nothing.
+#
+def arm_rule_timer(_ipsc, _rule):
+    _call = _rule.get('TIMER_CALL')
+    if (_rule['TO_TYPE'] == 'ON' and _rule['ACTIVE'] == True) or (_rule['TO_TYPE'] == 'OFF' and _rule['ACTIVE'] == False):
+        _delay = max(_rule['TIMER'] - time(), 0)
+        if _call and _call.active():
+            _call.reset(_delay)
+        else:
+            _rule['TIMER_CALL'] = reactor.callLater(_delay, rule_timeout, _ipsc, _rule)
+    elif _call and _call.active():
+        _call.cancel()
+
+def arm_rule_timers(_rules):
+    for _ipsc in _rules:
+        for _rule in _rules[_ipsc]['GROUP_VOICE']:
+            arm_rule_timer(_ipsc, _rule)
+
+# Start a rule's TIMEOUT over
+def reset_rule_timer(_ipsc, _rule, _now):
+    _rule['TIMER'] = _now + _rule['TIMEOUT']
+    arm_rule_timer(_ipsc, _rule)
+
+def rule_timeout(_ipsc, _rule):
+    if _rule['TO_TYPE'] == 'ON' and _rule['ACTIVE'] == True:
+        set_rule_active(_ipsc, _rule, False)
+        logger.info('(%s) Rule timout DEACTIVATE: Rule name: %s, Target IPSC: %s, TS: %s, TGID: %s', _ipsc, _rule['NAME'], _rule['DST_NET'], _rule['DST_TS'], int_id(_rule['DST_GROUP']))
+    elif _rule['TO_TYPE'] == 'OFF' and _rule['ACTIVE'] == False:
+        set_rule_active(_ipsc, _rule, True)
+        logger.info('(%s) Rule timout ACTIVATE: Rule name: %s, Target IPSC: %s, TS: %s, TGID: %s', _ipsc, _rule['NAME'], _rule['DST_NET'], _rule['DST_TS'], int_id(_rule['DST_GROUP']))
+
+
+# Re-read bridge_rules, known_bridges and sub_acl without restarting (on SIGHUP). Each file is
+# loaded and checked in full before anything in use is touched; one that won't load or doesn't
+# check out is logged and the old one is kept. This runs in the reactor (see __main__), so
+# every packet is handled either entirely with the old configuration or entirely with the new.
+#
+def reload_config():
+    try:
+        _rules = compile_rules(load_module('bridge_rules').RULES)
+    except Exception as e:
+        logger.error('Bridge rules NOT reloaded, keeping the rules in use: %s', e)
+    else:
+        swap_rules(_rules)
+        logger.info('Bridge rules reloaded')
+
+    try:
+        _bridges = build_bridges('known_bridges')
+    except Exception as e:
+        logger.error('Known bridges NOT reloaded, keeping the list in use: %s', e)
+    else:
+        for _system in systems.values():
+            _system.set_bridges(_bridges)
+
+    try:
+        build_acl('sub_acl')
+    except Exception as e:
+        logger.error('ACL NOT reloaded, keeping the ACL in use: %s', e)
+
+# Put a new set of compiled rules in use. A rule with the same NAME as one in use (in the same
+# IPSC) picks up where that one was: its ACTIVE state and TIMER carry over.
+#
+def swap_rules(_rules):
+    global RULES, RULE_INDEX
+    for _ipsc in _rules:
+        _old_rules = {}
+        for _rule in RULES.get(_ipsc, {}).get('GROUP_VOICE', ()):
+            _old_rules.setdefault(_rule['NAME'], []).append(_rule)
+        for _rule in _rules[_ipsc]['GROUP_VOICE']:
+            if _old_rules.get(_rule['NAME']):
+                _old_rule = _old_rules[_rule['NAME']].pop(0)
+                _rule['ACTIVE'] = _old_rule['ACTIVE']
+                _rule['TIMER']  = _old_rule['TIMER']
+
+    for _ipsc in RULES:
+        for _rule in RULES[_ipsc]['GROUP_VOICE']:
+            _call = _rule.get('TIMER_CALL')
+            if _call and _call.active():
+                _call.cancel()
+
+    RULES = _rules
+    RULE_INDEX = build_rule_index(RULES)
+    arm_rule_timers(RULES)
+    rules_changed()
+
+
+
+# Log the duplicate filter counters for each system that has dropped any since the last report
+#
+def report_duplicates():
+    for _system in sorted(systems):
+        _duplicates = systems[_system]._duplicates
+        _last = DUPLICATES_REPORTED.get(_system, 0)
+        if _duplicates.dropped != _last:
+            logger.info('(%s) Duplicate packets dropped: %s since last report, %s in total (%s passed)', _system, _duplicates.dropped - _last, _duplicates.dropped, _duplicates.passed)
+            DUPLICATES_REPORTED[_system] = _duplicates.dropped
+
+DUPLICATES_REPORTED = {}
 
     
 class bridgeIPSC(IPSC):
     def __init__(self, _name, _config, _logger, _bridges):
         IPSC.__init__(self, _name, _config, _logger)
-        self.BRIDGES = _bridges
+        self.BRIDGES = _bridges     # radio IDs of the known bridges, see build_bridges
         if self.BRIDGES:
             self._logger.info('(%s) Initializing backup/polite bridging', self._system)
             self.BRIDGE = False
@@ -204,36 +373,155 @@ class bridgeIPSC(IPSC):
         self.last_seq_id = '\x00'
         self.call_start = 0
         
-    # Setup the backup/polite bridging maintenance loop (based on keep-alive timer)
-    
-    
+        # How each call in progress is being routed, see group_voice
+        self.STREAMS = {}
+
+        # Packets we've had recently, see DUPLICATE_WINDOW
+        self._duplicates = DuplicateFilter(DUPLICATE_WINDOW, DUPLICATE_SIZE) if DUPLICATE_WINDOW else None
+        
+    # Backup/polite bridging: we only bridge while none of the known bridges is active (keyed up
+    # on either timeslot) in this IPSC. That can only change when the peer table or our master
+    # changes, so instead of polling, the bridge status is worked out again on just those events --
+    # and only peer events for the known bridges themselves.
+
     def startProtocol(self):
         IPSC.startProtocol(self)
         if self.BRIDGES:
-            self._bridge_presence = task.LoopingCall(self.bridge_presence_loop)
-            self._bridge_presence_loop = self._bridge_presence.start(self._local['ALIVE_TIMER'])
+            self.update_bridge_status()
+
+    def peer_added(self, _peerid):
+        IPSC.peer_added(self, _peerid)
+        if _peerid in self.BRIDGES:
+            self.update_bridge_status()
+
+    def peer_removed(self, _peerid):
+        IPSC.peer_removed(self, _peerid)
+        if _peerid in self.BRIDGES:
+            self.update_bridge_status()
+
+    def peer_changed(self, _peerid):
+        IPSC.peer_changed(self, _peerid)
+        if _peerid in self.BRIDGES:
+            self.update_bridge_status()
+
+    def master_connected(self):
+        IPSC.master_connected(self)
+        if self.BRIDGES:
+            self.update_bridge_status()
+
+    def master_disconnected(self):
+        IPSC.master_disconnected(self)
+        if self.BRIDGES:
+            self.update_bridge_status()
+
+    # Use a new set of known bridges (see reload_config)
+    def set_bridges(self, _bridges):
+        if _bridges and not self.BRIDGES:
+            self._logger.info('(%s) Initializing backup/polite bridging', self._system)
+        elif self.BRIDGES and not _bridges:
+            self._logger.info('(%s) No known bridges, changing to standard bridging', self._system)
+        self.BRIDGES = _bridges
+        self.update_bridge_status()
 
-    # This is the backup/polite bridge maintenance loop
-    def bridge_presence_loop(self):
-        self._logger.debug('(%s) Bridge presence loop initiated', self._system)
+    def update_bridge_status(self):
         _temp_bridge = True
-        for peer in self.BRIDGES:
-            _peer = hex_str_4(peer)
-        
-            if _peer in self._peers.keys() and (self._peers[_peer]['MODE_DECODE']['TS_1'] or self._peers[_peer]['MODE_DECODE']['TS_2']):
-                _temp_bridge = False
-                self._logger.debug('(%s) Peer %s is an active bridge', self._system, int_id(_peer))
-        
-            if _peer == self._master['RADIO_ID'] \
-                and self._master['STATUS']['CONNECTED'] \
-                and (self._master['MODE_DECODE']['TS_1'] or self._master['MODE_DECODE']['TS_2']):
+        for _peerid in self.BRIDGES:
+            _peer = self._peers.get(_peerid)
+            if _peer is not None and (_peer.mode_decode['TS_1'] or _peer.mode_decode['TS_2']):
                 _temp_bridge = False
-                self._logger.debug('(%s) Master %s is an active bridge',self._system, int_id(_peer))
-        
+                self._logger.debug('(%s) Peer %s is an active bridge', self._system, int_id(_peerid))
+
+        if self._master.radio_id in self.BRIDGES \
+            and self._master.status.connected \
+            and (self._master.mode_decode['TS_1'] or self._master.mode_decode['TS_2']):
+            _temp_bridge = False
+            self._logger.debug('(%s) Master %s is an active bridge',self._system, int_id(self._master.radio_id))
+
         if self.BRIDGE != _temp_bridge:
             self._logger.info('(%s) Changing bridge status to: %s', self._system, _temp_bridge )
+            rules_changed()
         self.BRIDGE = _temp_bridge
 
+
+    # Decide whether a call may be bridged by rule, based on what else is going on in the
+    # target IPSC. Returns True if it may NOT be, logging why if this is a voice header.
+    #
+    def contention(self, rule, _src_sub, _burst_data_type, now):
+        _target = rule['DST_NET']               # Shorthand to reduce length and make it easier to read
+        _status = systems[_target].IPSC_STATUS # Shorthand to reduce length and make it easier to read
+        
+        # The rules for each of the 4 "ifs" below are listed here for readability. The Frame To Send is:
+        #   From a different group than last RX from this IPSC, but it has been less than Group Hangtime
+        #   From a different group than last TX to this IPSC, but it has been less than Group Hangtime
+        #   From the same group as the last RX from this IPSC, but from a different subscriber, and it has been less than TS Clear Time
+        #   From the same group as the last TX to this IPSC, but from a different subscriber, and it has been less than TS Clear Time
+        #
+        if ((rule['DST_GROUP'] != _status[rule['DST_TS']]['RX_GROUP']) and ((now - _status[rule['DST_TS']]['RX_TIME']) < RULES[_target]['GROUP_HANGTIME'])):
+            if _burst_data_type == BURST_DATA_TYPE['VOICE_HEAD']:
+                self._logger.info('(%s) Call not bridged to TGID%s, target active or in group hangtime: IPSC: %s, TS: %s, TGID: %s', self._system, int_id(rule['DST_GROUP']), _target, rule['DST_TS'], int_id(_status[rule['DST_TS']]['RX_GROUP']))
+            return True
+        if ((rule['DST_GROUP'] != _status[rule['DST_TS']]['TX_GROUP']) and ((now - _status[rule['DST_TS']]['TX_TIME']) < RULES[_target]['GROUP_HANGTIME'])):
+            if _burst_data_type == BURST_DATA_TYPE['VOICE_HEAD']:
+                self._logger.info('(%s) Call not bridged to TGID%s, target in group hangtime: IPSC: %s, TS: %s, TGID: %s', self._system, int_id(rule['DST_GROUP']), _target, rule['DST_TS'], int_id(_status[rule['DST_TS']]['TX_GROUP']))
+            return True
+        if (rule['DST_GROUP'] == _status[rule['DST_TS']]['RX_GROUP']) and ((now - _status[rule['DST_TS']]['RX_TIME']) < TS_CLEAR_TIME):
+            if _burst_data_type == BURST_DATA_TYPE['VOICE_HEAD']:
+                self._logger.info('(%s) Call not bridged to TGID%s, matching call already active on target: IPSC: %s, TS: %s, TGID: %s', self._system, int_id(rule['DST_GROUP']), _target, rule['DST_TS'], int_id(_status[rule['DST_TS']]['RX_GROUP']))
+            return True
+        if (rule['DST_GROUP'] == _status[rule['DST_TS']]['TX_GROUP']) and (_src_sub != _status[rule['DST_TS']]['TX_SRC_SUB']) and ((now - _status[rule['DST_TS']]['TX_TIME']) < TS_CLEAR_TIME):
+            if _burst_data_type == BURST_DATA_TYPE['VOICE_HEAD']:
+                self._logger.info('(%s) Call not bridged for subscriber %s, call bridge in progress on target: IPSC: %s, TS: %s, TGID: %s SUB: %s', self._system, int_id(_src_sub), _target, rule['DST_TS'], int_id(_status[rule['DST_TS']]['TX_GROUP']), int_id(_status[rule['DST_TS']]['TX_SRC_SUB']))
+            return True
+        return False
+    
+    # Re-write a packet for, and send it to, the target of a rule: a tuple of
+    # (target IPSC, its RADIO_ID, DST_GROUP, DST_TS, target IPSC_STATUS) -- see route_stream
+    #
+    def forward(self, _forward, _src_sub, _ts, _data, now):
+        _target, _radio_id, _dst_group, _dst_ts, _status = _forward
+        
+        # Re-Write the IPSC SRC to match the target network's ID, the destination Group ID,
+        # and the IPSC and DMR timeslot values, then send the packet to all peers in the target IPSC
+        _target.send_to_ipsc(self._rewriter.rewrite(_data, _radio_id, _dst_group, _dst_ts))
+        
+        # Set values for the contention handler to test next time there is a frame to forward
+        _status[_ts]['TX_GROUP'] = _dst_group
+        _status[_ts]['TX_TIME'] = now
+        _status[_ts]['TX_SRC_SUB'] = _src_sub
+    
+    def forward_to(self, rule):
+        _target = rule['DST_NET']
+        return (systems[_target], self._CONFIG['SYSTEMS'][_target]['LOCAL']['RADIO_ID'], rule['DST_GROUP'], rule['DST_TS'], systems[_target].IPSC_STATUS)
+    
+    # Route a call: run every matching rule through contention handling, forwarding this packet
+    # to the targets it passes. Those are remembered in the stream's 'TARGETS', and the rules
+    # that didn't pass in 'BLOCKED' so they can be tried again on later packets of the call.
+    #
+    def route_stream(self, _stream_id, _src_sub, _dst_group, _ts, _burst_data_type, _data, now):
+        _stream = {'VERSION': RULE_VERSION, 'LAST': now, 'TARGETS': [], 'BLOCKED': []}
+        
+        # Only the active rules for this TGID and timeslot (see build_rule_index)
+        for rule in RULE_INDEX[self._system]['ACTIVE'].get((_dst_group, _ts), ()):
+            
+            # This is the primary rule match to determine if the call will be routed.
+            if self.BRIDGE == True or systems[rule['DST_NET']].BRIDGE == True:
+                
+                # If this is an inter-DMRlink trunk, contention handling isn't necessary
+                if RULES[self._system]['TRUNK'] == False and self.contention(rule, _src_sub, _burst_data_type, now):
+                    _stream['BLOCKED'].append(rule)
+                    continue
+                
+                _forward = self.forward_to(rule)
+                self.forward(_forward, _src_sub, _ts, _data, now)
+                _stream['TARGETS'].append(_forward)
+        
+        # Forget calls that have gone quiet without a terminator
+        for _old_id in [_old_id for _old_id in self.STREAMS if (now - self.STREAMS[_old_id]['LAST']) > STREAM_TIMEOUT]:
+            del self.STREAMS[_old_id]
+        
+        self.STREAMS[_stream_id] = _stream
+        return _stream
+    
     
     #************************************************
     #     CALLBACK FUNCTIONS FOR USER PACKET TYPES
@@ -241,105 +529,48 @@ class bridgeIPSC(IPSC):
     #
     def group_voice(self, _src_sub, _dst_group, _ts, _end, _peerid, _data):
         # Check for ACL match, and return if the subscriber is not allowed
-        if allow_sub(_src_sub) == False:
+        if allow_sub(_src_sub, self._system, _ts) == False:
             self._logger.warning('(%s) Group Voice Packet ***REJECTED BY ACL*** From: %s, IPSC Peer %s, Destination %s', self._system, int_id(_src_sub), int_id(_peerid), int_id(_dst_group))
             return
         
+        now = time() # Mark packet arrival time -- we'll need this for call contention handling 
+        
+        # Drop packets we've already had
+        if self._duplicates is not None and self._duplicates.is_duplicate(packet_key(_data), now):
+            self._logger.debug('(%s) Group Voice Packet DUPLICATE dropped From: %s, IPSC Peer %s, Destination %s', self._system, int_id(_src_sub), int_id(_peerid), int_id(_dst_group))
+            return
+        
         # Process the packet
         self._logger.debug('(%s) Group Voice Packet Received From: %s, IPSC Peer %s, Destination %s', self._system, int_id(_src_sub), int_id(_peerid), int_id(_dst_group))
         _burst_data_type = _data[30] # Determine the type of voice packet this is (see top of file for possible types)
         _seq_id = _data[5]
         
-        now = time() # Mark packet arrival time -- we'll need this for call contention handling 
+        #
+        # BEGIN FRAME FORWARDING
+        #
+        # The first packet of a call (normally the voice header) is routed through the rules and
+        # contention handling. The rest of the call goes where that one did, until it ends, goes
+        # quiet for STREAM_TIMEOUT, or a rule or bridge status changes. Rules that were blocked
+        # by contention handling are tried again on every packet, in case the target frees up.
+        #
+        _stream_id = (_ts, _dst_group, _src_sub, _seq_id)
+        _stream = self.STREAMS.get(_stream_id)
+        if _stream is None or _stream['VERSION'] != RULE_VERSION or (now - _stream['LAST']) > STREAM_TIMEOUT:
+            _stream = self.route_stream(_stream_id, _src_sub, _dst_group, _ts, _burst_data_type, _data, now)
+        else:
+            _stream['LAST'] = now
+            for _forward in _stream['TARGETS']:
+                self.forward(_forward, _src_sub, _ts, _data, now)
+            for rule in _stream['BLOCKED'][:]:
+                if not self.contention(rule, _src_sub, _burst_data_type, now):
+                    _stream['BLOCKED'].remove(rule)
+                    _forward = self.forward_to(rule)
+                    self.forward(_forward, _src_sub, _ts, _data, now)
+                    _stream['TARGETS'].append(_forward)
+        #
+        # END FRAME FORWARDING
+        #
         
-        for rule in RULES[self._system]['GROUP_VOICE']:
-            _target = rule['DST_NET']               # Shorthand to reduce length and make it easier to read
-            _status = systems[_target].IPSC_STATUS # Shorthand to reduce length and make it easier to read
-            
-            # This is the primary rule match to determine if the call will be routed.
-            if (rule['SRC_GROUP'] == _dst_group and rule['SRC_TS'] == _ts and rule['ACTIVE'] == True) and (self.BRIDGE == True or systems[_target].BRIDGE == True):
-                
-                #
-                # BEGIN CONTENTION HANDLING
-                # 
-                # If this is an inter-DMRlink trunk, this isn't necessary
-                if RULES[self._system]['TRUNK'] == False: 
-                    
-                    # The rules for each of the 4 "ifs" below are listed here for readability. The Frame To Send is:
-                    #   From a different group than last RX from this IPSC, but it has been less than Group Hangtime
-                    #   From a different group than last TX to this IPSC, but it has been less than Group Hangtime
-                    #   From the same group as the last RX from this IPSC, but from a different subscriber, and it has been less than TS Clear Time
-                    #   From the same group as the last TX to this IPSC, but from a different subscriber, and it has been less than TS Clear Time
-                    # The "continue" at the end of each means the next iteration of the for loop that tests for matching rules
-                    #
-                    if ((rule['DST_GROUP'] != _status[rule['DST_TS']]['RX_GROUP']) and ((now - _status[rule['DST_TS']]['RX_TIME']) < RULES[_target]['GROUP_HANGTIME'])):
-                        if _burst_data_type == BURST_DATA_TYPE['VOICE_HEAD']:
-                            self._logger.info('(%s) Call not bridged to TGID%s, target active or in group hangtime: IPSC: %s, TS: %s, TGID: %s', self._system, int_id(rule['DST_GROUP']), _target, rule['DST_TS'], int_id(_status[rule['DST_TS']]['RX_GROUP']))
-                        continue    
-                    if ((rule['DST_GROUP'] != _status[rule['DST_TS']]['TX_GROUP']) and ((now - _status[rule['DST_TS']]['TX_TIME']) < RULES[_target]['GROUP_HANGTIME'])):
-                        if _burst_data_type == BURST_DATA_TYPE['VOICE_HEAD']:
-                            self._logger.info('(%s) Call not bridged to TGID%s, target in group hangtime: IPSC: %s, TS: %s, TGID: %s', self._system, int_id(rule['DST_GROUP']), _target, rule['DST_TS'], int_id(_status[rule['DST_TS']]['TX_GROUP']))
-                        continue
-                    if (rule['DST_GROUP'] == _status[rule['DST_TS']]['RX_GROUP']) and ((now - _status[rule['DST_TS']]['RX_TIME']) < TS_CLEAR_TIME):
-                        if _burst_data_type == BURST_DATA_TYPE['VOICE_HEAD']:
-                            self._logger.info('(%s) Call not bridged to TGID%s, matching call already active on target: IPSC: %s, TS: %s, TGID: %s', self._system, int_id(rule['DST_GROUP']), _target, rule['DST_TS'], int_id(_status[rule['DST_TS']]['RX_GROUP']))
-                        continue
-                    if (rule['DST_GROUP'] == _status[rule['DST_TS']]['TX_GROUP']) and (_src_sub != _status[rule['DST_TS']]['TX_SRC_SUB']) and ((now - _status[rule['DST_TS']]['TX_TIME']) < TS_CLEAR_TIME):
-                        if _burst_data_type == BURST_DATA_TYPE['VOICE_HEAD']:
-                            self._logger.info('(%s) Call not bridged for subscriber %s, call bridge in progress on target: IPSC: %s, TS: %s, TGID: %s SUB: %s', self._system, int_id(_src_sub), _target, rule['DST_TS'], int_id(_status[rule['DST_TS']]['TX_GROUP']), int_id(_status[rule['DST_TS']]['TX_SRC_SUB']))
-                        continue
-                #
-                # END CONTENTION HANDLING
-                #
-                
-                #
-                # BEGIN FRAME FORWARDING
-                #     
-                # Make a copy of the payload       
-                _tmp_data = _data
-                
-                # Re-Write the IPSC SRC to match the target network's ID
-                _tmp_data = _tmp_data.replace(_peerid, self._CONFIG['SYSTEMS'][_target]['LOCAL']['RADIO_ID'])
-                
-                # Re-Write the destination Group ID
-                _tmp_data = _tmp_data.replace(_dst_group, rule['DST_GROUP'])
-            
-                # Re-Write IPSC timeslot value
-                _call_info = int_id(_data[17:18])
-                if rule['DST_TS'] == 1:
-                    _call_info &= ~(1 << 5)
-                elif rule['DST_TS'] == 2:
-                    _call_info |= 1 << 5
-                _call_info = chr(_call_info)
-                _tmp_data = _tmp_data[:17] + _call_info + _tmp_data[18:] 
-                
-                # Re-Write DMR timeslot value
-                # Determine if the slot is present, so we can translate if need be
-                if _burst_data_type == BURST_DATA_TYPE['SLOT1_VOICE'] or _burst_data_type == BURST_DATA_TYPE['SLOT2_VOICE']:
-                    _slot_valid = True
-                else:
-                    _slot_valid = False
-                # Re-Write timeslot if necessary...
-                if _slot_valid:
-                    if rule['DST_TS'] == 1:
-                        _burst_data_type = BURST_DATA_TYPE['SLOT1_VOICE']
-                    elif rule['DST_TS'] == 1:
-                        _burst_data_type = BURST_DATA_TYPE['SLOT2_VOICE']
-                    _tmp_data = _tmp_data[:30] + _burst_data_type + _tmp_data[31:]
-
-                # Send the packet to all peers in the target IPSC
-                systems[_target].send_to_ipsc(_tmp_data)
-                #
-                # END FRAME FORWARDING
-                #
-                
-                
-                # Set values for the contention handler to test next time there is a frame to forward
-                _status[_ts]['TX_GROUP'] = rule['DST_GROUP']
-                _status[_ts]['TX_TIME'] = now
-                _status[_ts]['TX_SRC_SUB'] = _src_sub
-                
-
         # Mark the group and time that a packet was recieved for the contention handler to use later
         self.IPSC_STATUS[_ts]['RX_GROUP'] = _dst_group
         self.IPSC_STATUS[_ts]['RX_TIME']  = now
@@ -366,47 +597,50 @@ class bridgeIPSC(IPSC):
             else:
                 self._logger.warning('(%s) GROUP VOICE END WITHOUT MATCHING START:   CallID: %s PEER: %s, SUB: %s, TS: %s, TGID: %s', self._system, int_id(_seq_id), int_id(_peerid), int_id(_src_sub), _ts, int_id(_dst_group),)
             
-            # Iterate the rules dictionary
-            for rule in RULES[self._system]['GROUP_VOICE']:
-                _target = rule['DST_NET']
-                
-                # TGID matches a rule source, reset its timer
-                if _ts == rule['SRC_TS'] and _dst_group == rule['SRC_GROUP'] and ((rule['TO_TYPE'] == 'ON' and (rule['ACTIVE'] == True)) or (rule['TO_TYPE'] == 'OFF' and rule['ACTIVE'] == False)):
-                    rule['TIMER'] = now + rule['TIMEOUT']
+            _index = RULE_INDEX[self._system]
+            
+            # TGID matches a rule source, reset its timer
+            for rule in _index['SOURCE'].get((_dst_group, _ts), ()):
+                if (rule['TO_TYPE'] == 'ON' and (rule['ACTIVE'] == True)) or (rule['TO_TYPE'] == 'OFF' and rule['ACTIVE'] == False):
+                    _target = rule['DST_NET']
+                    reset_rule_timer(self._system, rule, now)
                     self._logger.info('(%s) Source group transmission match for rule \"%s\". Reset timeout to %s', self._system, rule['NAME'], rule['TIMER'])
                     
-                    # Scan for reciprocal rules and reset their timers as well.
-                    for target_rule in RULES[_target]['GROUP_VOICE']:
-                        if target_rule['NAME'] == rule['NAME']:
-                            target_rule['TIMER'] = now + target_rule['TIMEOUT']
-                            self._logger.info('(%s) Reciprocal group transmission match for rule \"%s\" on IPSC \"%s\". Reset timeout to %s', self._system, target_rule['NAME'], _target, rule['TIMER'])
+                    # Reciprocal rules get their timers reset as well.
+                    for target_rule in RULE_INDEX[_target]['NAME'].get(rule['NAME'], ()):
+                        reset_rule_timer(_target, target_rule, now)
+                        self._logger.info('(%s) Reciprocal group transmission match for rule \"%s\" on IPSC \"%s\". Reset timeout to %s', self._system, target_rule['NAME'], _target, rule['TIMER'])
+            
+            # TGID matches an ACTIVATION trigger
+            for rule in _index['ON'].get(_dst_group, ()):
+                _target = rule['DST_NET']
+                # Set the matching rule as ACTIVE
+                set_rule_active(self._system, rule, True)
+                reset_rule_timer(self._system, rule, now)
+                self._logger.info('(%s) Primary Bridge Rule \"%s\" changed to state: %s', self._system, rule['NAME'], rule['ACTIVE'])
                 
-                # TGID matches an ACTIVATION trigger
-                if _dst_group in rule['ON']:
-                    # Set the matching rule as ACTIVE
-                    rule['ACTIVE'] = True
-                    rule['TIMER'] = now + rule['TIMEOUT']
-                    self._logger.info('(%s) Primary Bridge Rule \"%s\" changed to state: %s', self._system, rule['NAME'], rule['ACTIVE'])
-                    
-                    # Set reciprocal rules for other IPSCs as ACTIVE
-                    for target_rule in RULES[_target]['GROUP_VOICE']:
-                        if target_rule['NAME'] == rule['NAME']:
-                            target_rule['ACTIVE'] = True
-                            target_rule['TIMER'] = now + target_rule['TIMEOUT']
-                            self._logger.info('(%s) Reciprocal Bridge Rule \"%s\" in IPSC \"%s\" changed to state: %s', self._system, target_rule['NAME'], _target, rule['ACTIVE'])
-                            
-                # TGID matches an DE-ACTIVATION trigger
-                if _dst_group in rule['OFF']:
-                    # Set the matching rule as ACTIVE
-                    rule['ACTIVE'] = False
-                    self._logger.info('(%s) Bridge Rule \"%s\" changed to state: %s', self._system, rule['NAME'], rule['ACTIVE'])
-                    
-                    # Set reciprocal rules for other IPSCs as ACTIVE
-                    _target = rule['DST_NET']
-                    for target_rule in RULES[_target]['GROUP_VOICE']:
-                        if target_rule['NAME'] == rule['NAME']:
-                            target_rule['ACTIVE'] = False
-                            self._logger.info('(%s) Reciprocal Bridge Rule \"%s\" in IPSC \"%s\" changed to state: %s', self._system, target_rule['NAME'], _target, rule['ACTIVE'])
+                # Set reciprocal rules for other IPSCs as ACTIVE
+                for target_rule in RULE_INDEX[_target]['NAME'].get(rule['NAME'], ()):
+                    set_rule_active(_target, target_rule, True)
+                    reset_rule_timer(_target, target_rule, now)
+                    self._logger.info('(%s) Reciprocal Bridge Rule \"%s\" in IPSC \"%s\" changed to state: %s', self._system, target_rule['NAME'], _target, rule['ACTIVE'])
+                        
+            # TGID matches an DE-ACTIVATION trigger
+            for rule in _index['OFF'].get(_dst_group, ()):
+                _target = rule['DST_NET']
+                # Set the matching rule as INACTIVE
+                set_rule_active(self._system, rule, False)
+                reset_rule_timer(self._system, rule, now)
+                self._logger.info('(%s) Bridge Rule \"%s\" changed to state: %s', self._system, rule['NAME'], rule['ACTIVE'])
+                
+                # Set reciprocal rules for other IPSCs as INACTIVE
+                for target_rule in RULE_INDEX[_target]['NAME'].get(rule['NAME'], ()):
+                    set_rule_active(_target, target_rule, False)
+                    reset_rule_timer(_target, target_rule, now)
+                    self._logger.info('(%s) Reciprocal Bridge Rule \"%s\" in IPSC \"%s\" changed to state: %s', self._system, target_rule['NAME'], _target, rule['ACTIVE'])
+            
+            # The call is over
+            self.STREAMS.pop(_stream_id, None)
         #                    
         # END IN-BAND SIGNALLING
         #
@@ -483,15 +717,28 @@ if __name__ == '__main__':
     # Set signal handers so that we can gracefully exit if need be
     for sig in [signal.SIGTERM, signal.SIGINT, signal.SIGQUIT]:
         signal.signal(sig, sig_handler)
+
+    # Re-read the rules, known bridges and ACL on SIGHUP. The reload is handed to the reactor
+    # so it happens between packets, not in the middle of one.
+    def reload_handler(_signal, _frame):
+        logger.info('*** DMRLINK RELOADING CONFIGURATION FILES ON SIGNAL %s ***', str(_signal))
+        reactor.callFromThread(reload_config)
+
+    signal.signal(signal.SIGHUP, reload_handler)
     
     # Build the routing rules file
     RULES = build_rules('bridge_rules')
+    RULE_INDEX = build_rule_index(RULES)
     
     # Build list of known bridge IDs
     BRIDGES = build_bridges('known_bridges')
 
     # Build the Access Control List
-    ACL = build_acl('sub_acl')
+    try:
+        ACL = build_acl('sub_acl')
+    except ValueError as e:
+        logger.critical('ACL file could not be used: %s', e)
+        sys.exit('ERROR: {}'.format(e))
     
     
     # INITIALIZE AN IPSC OBJECT (SELF SUSTAINING) FOR EACH CONFIGUED IPSC
@@ -505,9 +752,13 @@ if __name__ == '__main__':
         reporting_loop = config_reports(CONFIG)
         reporting = task.LoopingCall(reporting_loop, logger)
         reporting.start(CONFIG['REPORTS']['REPORT_INTERVAL'])
+
+    # REPORT DROPPED DUPLICATES ON THE SAME INTERVAL
+    if DUPLICATE_WINDOW:
+        duplicate_reporting = task.LoopingCall(report_duplicates)
+        duplicate_reporting.start(CONFIG['REPORTS']['REPORT_INTERVAL'], now = False)
         
-    # INITIALIZE THE REPORTING LOOP IF CONFIGURED
-    rule_timer = task.LoopingCall(rule_timer_loop)
-    rule_timer.start(60)
+    # START THE RULE TIMERS
+    arm_rule_timers(RULES)
   
     reactor.run()
\ No newline at end of file
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#
+###############################################################################
+#   Copyright (C) 2016  Cortney T. Buffington, N0MJS <n0mjs@me.com>
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software Foundation,
+#   Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+###############################################################################
+
+# Finds calls that record.py has recorded, using its index, and lists them or
+# exports them. An export is the calls' records one after the other, read
+# straight out of the recordings: a file that play_group.py can play back, or
+# for anything else that reads template.bin's format.
+#
+#   ./call_archive.py --tgid 3100 --since '2016-10-01'
+#   ./call_archive.py --src 3112138 --limit 1 --export last_call.bin
+
+from __future__ import print_function
+
+import os
+import sys
+from time import localtime, mktime, strftime, strptime
+from ipsc.archive import CallIndex, read_calls
+
+__author__      = 'Cortney T. Buffington, N0MJS'
+__copyright__   = 'Copyright (c) 2016 Cortney T. Buffington, N0MJS and the K0USY Group'
+__credits__     = 'Adam Fast, KC0YLK; Dave Kierzkowski KD8EYF'
+__license__     = 'GNU GPLv3'
+__maintainer__  = 'Cort Buffington, N0MJS'
+__email__       = 'n0mjs@me.com'
+
+
+# Time formats accepted on the command line (local time), besides seconds since the epoch
+TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+
+def parse_time(_time):
+    try:
+        return float(_time)
+    except ValueError:
+        pass
+    for _format in TIME_FORMATS:
+        try:
+            return mktime(strptime(_time, _format))
+        except ValueError:
+            pass
+    raise ValueError('not a time: {!r}'.format(_time))
+
+def print_calls(_calls):
+    print('{:19}  {:>7}  {:12} {:2} {:>9} {:>9} {:>6} {:>5} {:>5}  {}'.format('START', 'SECONDS', 'SYSTEM', 'TS', 'SOURCE', 'DEST', 'BURSTS', 'LOST', 'LATE', 'RECORDING'))
+    for _call in _calls:
+        print('{:19}  {:7.1f}  {:12} {:2} {:>9} {:>9} {:6} {:5} {:5}  {}'.format(
+            strftime('%Y-%m-%d %H:%M:%S', localtime(_call['START'])), _call['DURATION'], _call['SYSTEM'], _call['TS'],
+            _call['SRC'], ('TG' if _call['TYPE'] == 'g' else '') + str(_call['DST']),
+            _call['BURSTS'], _call['LOST'], _call['LATE'], _call['PATH']))
+
+def export_calls(_calls, _file):
+    _count = 0
+    for _call, _records in read_calls(_calls):
+        _file.write(_records)
+        _count += 1
+    return _count
+
+
+if __name__ == '__main__':
+    import argparse
+
+    # Change the current directory to the location of the application
+    os.chdir(os.path.dirname(os.path.realpath(sys.argv[0])))
+
+    parser = argparse.ArgumentParser(description='Find recorded calls (see record.py) and list or export them.')
+    parser.add_argument('-x', '--index', action='store', dest='INDEX', default='recordings/calls.db', help='index of the recordings (default: %(default)s)')
+    parser.add_argument('--since', action='store', dest='SINCE', type=parse_time, help='calls that started at or after this time (YYYY-MM-DD [HH:MM[:SS]], local)')
+    parser.add_argument('--until', action='store', dest='UNTIL', type=parse_time, help='calls that started before this time')
+    parser.add_argument('-g', '--tgid', '--dst', action='store', dest='DST', type=int, help='calls to this group or subscriber ID')
+    parser.add_argument('-s', '--src', action='store', dest='SRC', type=int, help='calls from this subscriber ID')
+    parser.add_argument('--system', action='store', dest='SYSTEM', help='calls on this system (as named in dmrlink.cfg)')
+    parser.add_argument('--ts', action='store', dest='TS', type=int, choices=[1, 2], help='calls on this timeslot')
+    parser.add_argument('-n', '--limit', action='store', dest='LIMIT', type=int, help='only the most recent LIMIT calls')
+    parser.add_argument('-o', '--export', action='store', dest='EXPORT', help='write the calls\' records to this file (- for standard output) instead of listing them')
+    cli_args = parser.parse_args()
+
+    if not os.path.isfile(cli_args.INDEX):
+        sys.exit('Index {} not found'.format(cli_args.INDEX))
+
+    index = CallIndex(cli_args.INDEX)
+    calls = index.find(cli_args.SINCE, cli_args.UNTIL, cli_args.DST, cli_args.SRC, cli_args.SYSTEM, cli_args.TS, cli_args.LIMIT)
+
+    if not cli_args.EXPORT:
+        print_calls(calls)
+    elif cli_args.EXPORT == '-':
+        export_calls(calls, sys.stdout)
+    else:
+        with open(cli_args.EXPORT, 'wb') as export:
+            count = export_calls(calls, export)
+        print('{} calls exported to {}'.format(count, cli_args.EXPORT), file=sys.stderr)
+
+    index.close()
@@ -46,6 +46,8 @@
 from __future__ import print_function
 from twisted.internet import reactor
 from twisted.internet import task
+from twisted.internet.protocol import Factory
+from twisted.protocols.basic import LineReceiver
 from binascii import b2a_hex as ahex
 from time import time
 from importlib import import_module
@@ -56,6 +58,8 @@ from dmr_utils.utils import hex_str_3, hex_str_4, int_id
 
 from dmrlink import IPSC, systems, config_reports
 from ipsc.ipsc_const import BURST_DATA_TYPE
+from ipsc.acl import SubscriberACL
+from ipsc.duplicates import DuplicateFilter, packet_key
 
 
 __author__      = 'Cortney T. Buffington, N0MJS'
@@ -70,6 +74,27 @@ __email__       = 'n0mjs@me.com'
 #
 TS_CLEAR_TIME = .2
 
+# How long a call can go without a packet before we forget how it was routed
+#
+STREAM_TIMEOUT = 1
+
+# Group voice packets already received within DUPLICATE_WINDOW seconds (the same packet from
+# the same peer) are dropped, so a stream arriving twice isn't forwarded twice. At most
+# DUPLICATE_SIZE packets are remembered per system. A DUPLICATE_WINDOW of 0 turns this off.
+#
+DUPLICATE_WINDOW = 1
+DUPLICATE_SIZE = 5000
+
+# Counts changes to the bridges (a system's connection to one turned on or off). Calls
+# in progress are routed again when it changes -- see confbridgeIPSC.group_voice
+#
+BRIDGE_VERSION = 0
+
+# Port the control connection listens on (localhost only) to add, remove and list conference
+# bridge members without a restart -- see confbridgeControl. None to turn it off.
+#
+CONTROL_PORT = 31010
+
 # Build the conference bridging structure from the bridge file.
 #
 def make_bridges(_confbridge_rules):
@@ -84,90 +109,200 @@ def make_bridges(_confbridge_rules):
     #
     for _bridge in bridge_file.BRIDGES:
         for _system in bridge_file.BRIDGES[_bridge]:
-            from pprint import pprint
             if _system['SYSTEM'] not in CONFIG['SYSTEMS']:
                 print(_system['SYSTEM'])
                 sys.exit('ERROR: Conference bridges found for system not configured main configuration')
-                
-            _system['TGID']       = hex_str_3(_system['TGID'])
-            for i, e in enumerate(_system['ON']):
-                _system['ON'][i]  = hex_str_3(_system['ON'][i])
-            for i, e in enumerate(_system['OFF']):
-                _system['OFF'][i] = hex_str_3(_system['OFF'][i])
-            _system['TIMEOUT']    = _system['TIMEOUT']*60
-            _system['TIMER']      = time() + _system['TIMEOUT']
+            make_member(_system)
 
     return bridge_file.BRIDGES
+
+# Convert one system's entry of a conference bridge, as written in the bridge file, to the
+# form used at run time.
+#
+def make_member(_system):
+    _system['TGID']       = hex_str_3(_system['TGID'])
+    for i, e in enumerate(_system['ON']):
+        _system['ON'][i]  = hex_str_3(_system['ON'][i])
+    for i, e in enumerate(_system['OFF']):
+        _system['OFF'][i] = hex_str_3(_system['OFF'][i])
+    _system['TIMEOUT']    = _system['TIMEOUT']*60
+    _system['TIMER']      = time() + _system['TIMEOUT']
+    return _system
     
 
 # Import subscriber ACL
-# ACL may be a single list of subscriber IDs
-# Global action is to allow or deny them. Multiple lists with different actions and ranges
-# are not yet implemented.
+# The global ACL_ACTION (PERMIT or DENY) applies to the subscriber IDs and ID ranges in ACL.
+# SYSTEM_ACL can add ACLs of the same kind for calls from a system or one timeslot of it (see
+# sub_acl_SAMPLE.py). They are compiled into a SubscriberACL, and allow_sub is its check.
 def build_acl(_sub_acl):
     try:
         acl_file = import_module(_sub_acl)
-        for i, e in enumerate(acl_file.ACL):
-            acl_file.ACL[i] = hex_str_3(acl_file.ACL[i])
+        for _name in ('ACL_ACTION', 'ACL'):
+            if not hasattr(acl_file, _name):
+                raise ValueError('ACL file has no {}'.format(_name))
+        _system_acls = getattr(acl_file, 'SYSTEM_ACL', {})
+        if not isinstance(_system_acls, dict):
+            raise ValueError('SYSTEM_ACL must be a dictionary')
+        _systems = {}
+        for _key, _acl in _system_acls.items():
+            if isinstance(_key, tuple) and (len(_key) != 2 or _key[1] not in (1, 2)):
+                raise ValueError('ACL found for a timeslot that isn\'t (SYSTEM, 1) or (SYSTEM, 2): {}'.format(_key))
+            if (_key[0] if isinstance(_key, tuple) else _key) not in CONFIG['SYSTEMS']:
+                raise ValueError('ACL found for a system not configured in main configuration: {}'.format(_key))
+            if not isinstance(_acl, dict) or 'ACL_ACTION' not in _acl or 'ACL' not in _acl:
+                raise ValueError('ACL for {} must be a dictionary with an ACL_ACTION and an ACL'.format(_key))
+            _systems[_key] = (_acl['ACL_ACTION'], _acl['ACL'])
+        ACL = SubscriberACL(acl_file.ACL_ACTION, acl_file.ACL, _systems)
         logger.info('ACL file found and ACL entries imported')
-        ACL_ACTION = acl_file.ACL_ACTION
-        ACL = acl_file.ACL_ACTION
     except ImportError:
         logger.info('ACL file not found or invalid - all subscriber IDs are valid')
-        ACL_ACTION = 'NONE'
-        ACL = []
+        ACL = SubscriberACL()
 
-    # Depending on which type of ACL is used (PERMIT, DENY... or there isn't one)
-    # define a differnet function to be used to check the ACL
     global allow_sub
-    if ACL_ACTION == 'PERMIT':
-        def allow_sub(_sub):
-            if _sub in ACL:
-                return True
-            else:
-                return False
-    elif ACL_ACTION == 'DENY':
-        def allow_sub(_sub):
-            if _sub not in ACL:
-                return True
-            else:
-                return False
-    else:
-        def allow_sub(_sub):
-            return True
-    
+    allow_sub = ACL.allow
+
     return ACL
     
     
-# Run this every minute for rule timer updates
-def rule_timer_loop():
-    logger.info('(ALL IPSC SYSTEMS) Rule timer loop started')
-    _now = time()
-
-    for _bridge in BRIDGES:
-        for _system in BRIDGES[_bridge]:
-            if _system['TO_TYPE'] == 'ON':
-                if _system['ACTIVE'] == True:
-                    if _system['TIMER'] < _now:
-                        _system['ACTIVE'] = False
-                        logger.info('Conference Bridge TIMEOUT: DEACTIVATE System: %s, Bridge: %s, TS: %s, TGID: %s', _system['SYSTEM'], _bridge, _system['TS'], int_id(_system['TGID']))
-                    else:
-                        timeout_in = _system['TIMER'] - _now
-                        logger.info('Conference Bridge ACTIVE (ON timer running): System: %s Bridge: %s, TS: %s, TGID: %s, Timeout in: %ss,', _system['SYSTEM'], _bridge, _system['TS'], int_id(_system['TGID']),  timeout_in)
-                elif _system['ACTIVE'] == False:
-                    logger.debug('Conference Bridge INACTIVE (no change): System: %s Bridge: %s, TS: %s, TGID: %s', _system['SYSTEM'], _bridge, _system['TS'], int_id(_system['TGID']))
-            elif _system['TO_TYPE'] == 'OFF':
-                if _system['ACTIVE'] == False:
-                    if _system['TIMER'] < _now:
-                        _system['ACTIVE'] = True
-                        logger.info('Conference Bridge TIMEOUT: ACTIVATE System: %s, Bridge: %s, TS: %s, TGID: %s', _system['SYSTEM'], _bridge, _system['TS'], int_id(_system['TGID']))
-                    else:
-                        timeout_in = _system['TIMER'] - _now
-                        logger.info('Conference Bridge INACTIVE (OFF timer running): System: %s Bridge: %s, TS: %s, TGID: %s, Timeout in: %ss,', _system['SYSTEM'], _bridge, _system['TS'], int_id(_system['TGID']),  timeout_in)
-                elif _system['ACTIVE'] == True:
-                    logger.debug('Conference Bridge ACTIVE (no change): System: %s Bridge: %s, TS: %s, TGID: %s', _system['SYSTEM'], _bridge, _system['TS'], int_id(_system['TGID']))
-            else:
-                logger.debug('Conference Bridge NO ACTION: System: %s, Bridge: %s, TS: %s, TGID: %s', _system['SYSTEM'], _bridge, _system['TS'], int_id(_system['TGID']))
+# Index the conference bridges, so a packet only has to look at the bridges it concerns:
+#   'ROUTE':  (SYSTEM, TGID, TS) maps to a list of (bridge name, [the other systems of that
+#             bridge]) for each bridge that system, TGID and TS is an active member of
+#   'MEMBER': (SYSTEM, TGID, TS) maps to a list of (bridge name, member) for each bridge that
+#             system, TGID and TS is a member of, active or not -- for the timer resets
+#   'ON', 'OFF': (SYSTEM, TGID) maps to a list of (bridge name, member) for each member of
+#             that system with TGID as an activation (deactivation) trigger
+# 'ROUTE' depends on which members are active, so the index has to be updated (index_bridge)
+# whenever a member of a bridge is connected or disconnected, as well as added or removed.
+#
+def build_bridge_index(_bridges):
+    _index = {'ROUTE': {}, 'MEMBER': {}, 'ON': {}, 'OFF': {}}
+    for _bridge in _bridges:
+        index_bridge(_index, _bridge, _bridges[_bridge])
+    return _index
+
+def unindex_bridge(_index, _bridge, _members):
+    _keys = {
+        'ROUTE':  set((_system['SYSTEM'], _system['TGID'], _system['TS']) for _system in _members),
+        'ON':     set((_system['SYSTEM'], _tgid) for _system in _members for _tgid in _system['ON']),
+        'OFF':    set((_system['SYSTEM'], _tgid) for _system in _members for _tgid in _system['OFF'])
+    }
+    _keys['MEMBER'] = _keys['ROUTE']
+    for _table in _keys:
+        _table_index = _index[_table]
+        for _key in _keys[_table]:
+            if _key in _table_index:
+                _table_index[_key] = [_entry for _entry in _table_index[_key] if _entry[0] != _bridge]
+                if not _table_index[_key]:
+                    del _table_index[_key]
+
+def index_bridge(_index, _bridge, _members):
+    # Take the bridge out...
+    unindex_bridge(_index, _bridge, _members)
+    # ...and put its members back in
+    for _system in _members:
+        _key = (_system['SYSTEM'], _system['TGID'], _system['TS'])
+        _index['MEMBER'].setdefault(_key, []).append((_bridge, _system))
+        for _trigger in ('ON', 'OFF'):
+            for _tgid in set(_system[_trigger]):
+                _index[_trigger].setdefault((_system['SYSTEM'], _tgid), []).append((_bridge, _system))
+        if _system['ACTIVE'] == True:
+            _targets = [_target for _target in _members if _target['SYSTEM'] != _system['SYSTEM'] and _target['ACTIVE'] == True]
+            if _targets:
+                _index['ROUTE'].setdefault(_key, []).append((_bridge, _targets))
+
+# Connect or disconnect a system (one of the entries of conference bridge _bridge)
+def set_bridge_active(_bridge, _system, _active):
+    global BRIDGE_VERSION
+    if _system['ACTIVE'] != _active:
+        _system['ACTIVE'] = _active
+        index_bridge(BRIDGE_INDEX, _bridge, BRIDGES[_bridge])
+        arm_bridge_timer(_bridge, _system)
+        BRIDGE_VERSION += 1
+
+
+# Bridge timers: a system with TO_TYPE 'ON' is disconnected from its bridge when its TIMER
+# runs out while it's connected, one with TO_TYPE 'OFF' is connected again when its TIMER
+# runs out while it's disconnected. Every system in the state its timer applies to has a
+# reactor.callLater armed for its TIMER (kept as 'TIMER_CALL'), which is moved whenever the
+# TIMER is reset -- so each timeout fires once, on time, and idle bridges cost nothing.
+#
+def arm_bridge_timer(_bridge, _system):
+    _call = _system.get('TIMER_CALL')
+    if (_system['TO_TYPE'] == 'ON' and _system['ACTIVE'] == True) or (_system['TO_TYPE'] == 'OFF' and _system['ACTIVE'] == False):
+        _delay = max(_system['TIMER'] - time(), 0)
+        if _call and _call.active():
+            _call.reset(_delay)
+        else:
+            _system['TIMER_CALL'] = reactor.callLater(_delay, bridge_timeout, _bridge, _system)
+    elif _call and _call.active():
+        _call.cancel()
+
+def arm_bridge_timers(_bridges):
+    for _bridge in _bridges:
+        for _system in _bridges[_bridge]:
+            arm_bridge_timer(_bridge, _system)
+
+# Start a system's TIMEOUT over
+def reset_bridge_timer(_bridge, _system, _now):
+    _system['TIMER'] = _now + _system['TIMEOUT']
+    arm_bridge_timer(_bridge, _system)
+
+def bridge_timeout(_bridge, _system):
+    if _system['TO_TYPE'] == 'ON' and _system['ACTIVE'] == True:
+        set_bridge_active(_bridge, _system, False)
+        logger.info('Conference Bridge TIMEOUT: DEACTIVATE System: %s, Bridge: %s, TS: %s, TGID: %s', _system['SYSTEM'], _bridge, _system['TS'], int_id(_system['TGID']))
+    elif _system['TO_TYPE'] == 'OFF' and _system['ACTIVE'] == False:
+        set_bridge_active(_bridge, _system, True)
+        logger.info('Conference Bridge TIMEOUT: ACTIVATE System: %s, Bridge: %s, TS: %s, TGID: %s', _system['SYSTEM'], _bridge, _system['TS'], int_id(_system['TGID']))
+
+    
+
+# Add a system (an entry made by make_member) to conference bridge _bridge, making the bridge if
+# there isn't one by that name, or take one out -- while running. The bridge gets a new list of
+# members rather than having its list changed, and the routing index and timers are brought up to
+# date before returning, so routing never sees a half-made change. Calls in progress are routed
+# again (BRIDGE_VERSION).
+#
+def add_bridge_member(_bridge, _system):
+    global BRIDGE_VERSION
+    BRIDGES[_bridge] = BRIDGES.get(_bridge, []) + [_system]
+    index_bridge(BRIDGE_INDEX, _bridge, BRIDGES[_bridge])
+    arm_bridge_timer(_bridge, _system)
+    BRIDGE_VERSION += 1
+
+def find_bridge_member(_bridge, _system, _ts, _tgid):
+    for _member in BRIDGES.get(_bridge, ()):
+        if _member['SYSTEM'] == _system and _member['TS'] == _ts and _member['TGID'] == _tgid:
+            return _member
+    return None
+
+def remove_bridge_member(_bridge, _system):
+    global BRIDGE_VERSION
+    _members = [_member for _member in BRIDGES[_bridge] if _member is not _system]
+    unindex_bridge(BRIDGE_INDEX, _bridge, BRIDGES[_bridge])
+    if _members:
+        BRIDGES[_bridge] = _members
+        index_bridge(BRIDGE_INDEX, _bridge, _members)
+    else:
+        del BRIDGES[_bridge]
+    _call = _system.get('TIMER_CALL')
+    if _call and _call.active():
+        _call.cancel()
+    BRIDGE_VERSION += 1
+
+
+
+# Log the duplicate filter counters for each system that has dropped any since the last report
+#
+def report_duplicates():
+    for _system in sorted(systems):
+        _duplicates = systems[_system]._duplicates
+        _last = DUPLICATES_REPORTED.get(_system, 0)
+        if _duplicates.dropped != _last:
+            logger.info('(%s) Duplicate packets dropped: %s since last report, %s in total (%s passed)', _system, _duplicates.dropped - _last, _duplicates.dropped, _duplicates.passed)
+            DUPLICATES_REPORTED[_system] = _duplicates.dropped
+
+DUPLICATES_REPORTED = {}
 
     
 class confbridgeIPSC(IPSC):
@@ -181,7 +316,91 @@ class confbridgeIPSC(IPSC):
         
         self.last_seq_id = '\x00'
         self.call_start = 0
+        
+        # How each call in progress is being routed, see group_voice
+        self.STREAMS = {}
 
+        # Packets we've had recently, see DUPLICATE_WINDOW
+        self._duplicates = DuplicateFilter(DUPLICATE_WINDOW, DUPLICATE_SIZE) if DUPLICATE_WINDOW else None
+
+    # Decide whether a call may be sent to _target (an entry of a conference bridge), based on
+    # what else is going on in the target system. Returns True if it may NOT be, logging why if
+    # this is a voice header.
+    #
+    def contention(self, _target, _src_sub, _burst_data_type, now):
+        _target_status = systems[_target['SYSTEM']].STATUS
+        _target_system = self._CONFIG['SYSTEMS'][_target['SYSTEM']]
+        
+        # The rules for each of the 4 "ifs" below are listed here for readability. The Frame To Send is:
+        #   From a different group than last RX from this IPSC, but it has been less than Group Hangtime
+        #   From a different group than last TX to this IPSC, but it has been less than Group Hangtime
+        #   From the same group as the last RX from this IPSC, but from a different subscriber, and it has been less than TS Clear Time
+        #   From the same group as the last TX to this IPSC, but from a different subscriber, and it has been less than TS Clear Time
+        #
+        if ((_target['TGID'] != _target_status[_target['TS']]['RX_TGID']) and ((now - _target_status[_target['TS']]['RX_TIME']) < _target_system['LOCAL']['GROUP_HANGTIME'])):
+            if _burst_data_type == BURST_DATA_TYPE['VOICE_HEAD']:
+                self._logger.info('(%s) Call not bridged to TGID%s, target active or in group hangtime: IPSC: %s, TS: %s, TGID: %s', self._system, int_id(_target['TGID']), _target['SYSTEM'], _target['TS'], int_id(_target_status[_target['TS']]['RX_TGID']))
+            return True
+        if ((_target['TGID'] != _target_status[_target['TS']]['TX_TGID']) and ((now - _target_status[_target['TS']]['TX_TIME']) < _target_system['LOCAL']['GROUP_HANGTIME'])):
+            if _burst_data_type == BURST_DATA_TYPE['VOICE_HEAD']:
+                self._logger.info('(%s) Call not bridged to TGID%s, target in group hangtime: IPSC: %s, TS: %s, TGID: %s', self._system, int_id(_target['TGID']), _target['SYSTEM'], _target['TS'], int_id(_target_status[_target['TS']]['TX_TGID']))
+            return True
+        if (_target['TGID'] == _target_status[_target['TS']]['RX_TGID']) and ((now - _target_status[_target['TS']]['RX_TIME']) < TS_CLEAR_TIME):
+            if _burst_data_type == BURST_DATA_TYPE['VOICE_HEAD']:
+                self._logger.info('(%s) Call not bridged to TGID%s, matching call already active on target: IPSC: %s, TS: %s, TGID: %s', self._system, int_id(_target['TGID']), _target['SYSTEM'], _target['TS'], int_id(_target_status[_target['TS']]['RX_TGID']))
+            return True
+        if (_target['TGID'] == _target_status[_target['TS']]['TX_TGID']) and (_src_sub != _target_status[_target['TS']]['TX_SRC_SUB']) and ((now - _target_status[_target['TS']]['TX_TIME']) < TS_CLEAR_TIME):
+            if _burst_data_type == BURST_DATA_TYPE['VOICE_HEAD']:
+                self._logger.info('(%s) Call not bridged for subscriber %s, call bridge in progress on target: IPSC: %s, TS: %s, TGID: %s SUB: %s', self._system, int_id(_src_sub), _target['SYSTEM'], _target['TS'], int_id(_target_status[_target['TS']]['TX_TGID']), int_id(_target_status[_target['TS']]['TX_SRC_SUB']))
+            return True
+        return False
+    
+    # Re-write a packet for, and send it to, a target: a tuple of (target IPSC, its RADIO_ID,
+    # TGID, TS, target STATUS for that TS) -- see route_stream
+    #
+    def forward(self, _forward, _src_sub, _data, now):
+        _target, _radio_id, _tgid, _ts, _status = _forward
+        
+        # Re-Write the IPSC SRC to match the target network's ID, the destination Group ID,
+        # and the IPSC and DMR timeslot values, then send the packet to all peers in the target IPSC
+        _target.send_to_ipsc(self._rewriter.rewrite(_data, _radio_id, _tgid, _ts))
+        
+        # Set values for the contention handler to test next time there is a frame to forward
+        _status['TX_TGID'] = _tgid
+        _status['TX_TIME'] = now
+        _status['TX_SRC_SUB'] = _src_sub
+    
+    def forward_to(self, _target):
+        _system = systems[_target['SYSTEM']]
+        return (_system, self._CONFIG['SYSTEMS'][_target['SYSTEM']]['LOCAL']['RADIO_ID'], _target['TGID'], _target['TS'], _system.STATUS[_target['TS']])
+    
+    # Route a call: run every active system of every bridge this call is on through contention
+    # handling, forwarding this packet to the ones it passes. Those are remembered in the stream's
+    # 'TARGETS', and the ones that didn't pass in 'BLOCKED' so they can be tried again on later
+    # packets of the call.
+    #
+    def route_stream(self, _stream_id, _src_sub, _dst_group, _ts, _burst_data_type, _data, now):
+        _stream = {'VERSION': BRIDGE_VERSION, 'LAST': now, 'TARGETS': [], 'BLOCKED': []}
+        
+        # Only the bridges this system, TGID and TS is active on (see build_bridge_index)
+        for _bridge, _targets in BRIDGE_INDEX['ROUTE'].get((self._system, _dst_group, _ts), ()):
+            for _target in _targets:
+                if self.contention(_target, _src_sub, _burst_data_type, now):
+                    _stream['BLOCKED'].append(_target)
+                    continue
+                
+                _forward = self.forward_to(_target)
+                self.forward(_forward, _src_sub, _data, now)
+                _stream['TARGETS'].append(_forward)
+        
+        # Forget calls that have gone quiet without a terminator
+        for _old_id in [_old_id for _old_id in self.STREAMS if (now - self.STREAMS[_old_id]['LAST']) > STREAM_TIMEOUT]:
+            del self.STREAMS[_old_id]
+        
+        self.STREAMS[_stream_id] = _stream
+        return _stream
+    
+    
     #************************************************
     #     CALLBACK FUNCTIONS FOR USER PACKET TYPES
     #************************************************
@@ -189,103 +408,47 @@ class confbridgeIPSC(IPSC):
     def group_voice(self, _src_sub, _dst_group, _ts, _end, _peerid, _data):
 
         # Check for ACL match, and return if the subscriber is not allowed
-        if allow_sub(_src_sub) == False:
+        if allow_sub(_src_sub, self._system, _ts) == False:
             self._logger.warning('(%s) Group Voice Packet ***REJECTED BY ACL*** From: %s, IPSC Peer %s, Destination %s', self._system, int_id(_src_sub), int_id(_peerid), int_id(_dst_group))
             return
         
+        now = time() # Mark packet arrival time -- we'll need this for call contention handling 
+        
+        # Drop packets we've already had
+        if self._duplicates is not None and self._duplicates.is_duplicate(packet_key(_data), now):
+            self._logger.debug('(%s) Group Voice Packet DUPLICATE dropped From: %s, IPSC Peer %s, Destination %s', self._system, int_id(_src_sub), int_id(_peerid), int_id(_dst_group))
+            return
+        
         # Process the packet
         self._logger.debug('(%s) Group Voice Packet Received From: %s, IPSC Peer %s, Destination %s', self._system, int_id(_src_sub), int_id(_peerid), int_id(_dst_group))
         _burst_data_type = _data[30] # Determine the type of voice packet this is (see top of file for possible types)
         _seq_id = _data[5]
         
-        now = time() # Mark packet arrival time -- we'll need this for call contention handling 
-        
-        for _bridge in BRIDGES:
-            for _system in BRIDGES[_bridge]:
-
-                if (_system['SYSTEM'] == self._system and _system['TGID'] == _dst_group and _system['TS'] == _ts and _system['ACTIVE'] == True):
-                    
-                    for _target in BRIDGES[_bridge]:
-                        if _target['SYSTEM'] != self._system:
-                            if _target['ACTIVE']:                          
-                                _target_status = systems[_target['SYSTEM']].STATUS
-                                _target_system = self._CONFIG['SYSTEMS'][_target['SYSTEM']]
-                
-                                # BEGIN CONTENTION HANDLING
-                                # 
-                                # The rules for each of the 4 "ifs" below are listed here for readability. The Frame To Send is:
-                                #   From a different group than last RX from this IPSC, but it has been less than Group Hangtime
-                                #   From a different group than last TX to this IPSC, but it has been less than Group Hangtime
-                                #   From the same group as the last RX from this IPSC, but from a different subscriber, and it has been less than TS Clear Time
-                                #   From the same group as the last TX to this IPSC, but from a different subscriber, and it has been less than TS Clear Time
-                                # The "continue" at the end of each means the next iteration of the for loop that tests for matching rules
-                                #                            
-                                if ((_target['TGID'] != _target_status[_target['TS']]['RX_TGID']) and ((now - _target_status[_target['TS']]['RX_TIME']) < _target_system['LOCAL']['GROUP_HANGTIME'])):
-                                    if _burst_data_type == BURST_DATA_TYPE['VOICE_HEAD']:
-                                        self._logger.info('(%s) Call not bridged to TGID%s, target active or in group hangtime: IPSC: %s, TS: %s, TGID: %s', self._system, int_id(_target['TGID']), _target['SYSTEM'], _target['TS'], int_id(_target_status[_target['TS']]['RX_TGID']))
-                                    continue    
-                                if ((_target['TGID'] != _target_status[_target['TS']]['TX_TGID']) and ((now - _target_status[_target['TS']]['TX_TIME']) < _target_system['LOCAL']['GROUP_HANGTIME'])):
-                                    if _burst_data_type == BURST_DATA_TYPE['VOICE_HEAD']:
-                                        self._logger.info('(%s) Call not bridged to TGID%s, target in group hangtime: IPSC: %s, TS: %s, TGID: %s', self._system, int_id(_target['TGID']), _target['SYSTEM'], _target['TS'], int_id(_target_status[_target['TS']]['TX_TGID']))
-                                    continue
-                                if (_target['TGID'] == _target_status[_target['TS']]['RX_TGID']) and ((now - _target_status[_target['TS']]['RX_TIME']) < TS_CLEAR_TIME):
-                                    if _burst_data_type == BURST_DATA_TYPE['VOICE_HEAD']:
-                                        self._logger.info('(%s) Call not bridged to TGID%s, matching call already active on target: IPSC: %s, TS: %s, TGID: %s', self._system, int_id(_target['TGID']), _target['SYSTEM'], _target['TS'], int_id(_target_status[rule['DST_TS']]['RX_TGID']))
-                                    continue
-                                if (_target['TGID'] == _target_status[_target['TS']]['TX_TGID']) and (_src_sub != _target_status[_target['TS']]['TX_SRC_SUB']) and ((now - _target_status[_target['TS']]['TX_TIME']) < TS_CLEAR_TIME):
-                                    if _burst_data_type == BURST_DATA_TYPE['VOICE_HEAD']:
-                                        self._logger.info('(%s) Call not bridged for subscriber %s, call bridge in progress on target: IPSC: %s, TS: %s, TGID: %s SUB: %s', self._system, int_id(_src_sub), _target['SYSTEM'], _target['TGID'], int_id(_target_status[_target['TS']]['TX_TGID']), int_id(_target_status[_target['TS']]['TX_SRC_SUB']))
-                                    continue
-                                #
-                                # END CONTENTION HANDLING
-                                #
-                
-                                #
-                                # BEGIN FRAME FORWARDING
-                                #     
-                                # Make a copy of the payload       
-                                _tmp_data = _data
-                
-                                # Re-Write the IPSC SRC to match the target network's ID
-                                _tmp_data = _tmp_data.replace(_peerid, _target_system['LOCAL']['RADIO_ID'])
-                
-                                # Re-Write the destination Group ID
-                                _tmp_data = _tmp_data.replace(_dst_group, _target['TGID'])
-            
-                                # Re-Write IPSC timeslot value
-                                _call_info = int_id(_data[17:18])
-                                if _target['TS'] == 1:
-                                    _call_info &= ~(1 << 5)
-                                elif _target['TS'] == 2:
-                                    _call_info |= 1 << 5
-                                _call_info = chr(_call_info)
-                                _tmp_data = _tmp_data[:17] + _call_info + _tmp_data[18:] 
-                
-                                # Re-Write DMR timeslot value
-                                # Determine if the slot is present, so we can translate if need be
-                                if _burst_data_type == BURST_DATA_TYPE['SLOT1_VOICE'] or _burst_data_type == BURST_DATA_TYPE['SLOT2_VOICE']:
-                                    _slot_valid = True
-                                else:
-                                    _slot_valid = False
-                                # Re-Write timeslot if necessary...
-                                if _slot_valid:
-                                    if _target['TS'] == 1:
-                                        _burst_data_type = BURST_DATA_TYPE['SLOT1_VOICE']
-                                    elif _target['TS'] == 1:
-                                        _burst_data_type = BURST_DATA_TYPE['SLOT2_VOICE']
-                                    _tmp_data = _tmp_data[:30] + _burst_data_type + _tmp_data[31:]
-
-                                # Send the packet to all peers in the target IPSC
-                                systems[_target['SYSTEM']].send_to_ipsc(_tmp_data)
-                                #
-                                # END FRAME FORWARDING
-                                #
-                
-                
-                                # Set values for the contention handler to test next time there is a frame to forward
-                                _target_status[_target['TS']]['TX_TGID'] = _target['TGID']
-                                _target_status[_target['TS']]['TX_TIME'] = now
-                                _target_status[_target['TS']]['TX_SRC_SUB'] = _src_sub
+        #
+        # BEGIN FRAME FORWARDING
+        #
+        # The first packet of a call (normally the voice header) is routed through the bridges and
+        # contention handling. The rest of the call goes where that one did, until it ends, goes
+        # quiet for STREAM_TIMEOUT, or a bridge connection changes. Targets that were blocked by
+        # contention handling are tried again on every packet, in case they free up.
+        #
+        _stream_id = (_ts, _dst_group, _src_sub, _seq_id)
+        _stream = self.STREAMS.get(_stream_id)
+        if _stream is None or _stream['VERSION'] != BRIDGE_VERSION or (now - _stream['LAST']) > STREAM_TIMEOUT:
+            _stream = self.route_stream(_stream_id, _src_sub, _dst_group, _ts, _burst_data_type, _data, now)
+        else:
+            _stream['LAST'] = now
+            for _forward in _stream['TARGETS']:
+                self.forward(_forward, _src_sub, _data, now)
+            for _target in _stream['BLOCKED'][:]:
+                if not self.contention(_target, _src_sub, _burst_data_type, now):
+                    _stream['BLOCKED'].remove(_target)
+                    _forward = self.forward_to(_target)
+                    self.forward(_forward, _src_sub, _data, now)
+                    _stream['TARGETS'].append(_forward)
+        #
+        # END FRAME FORWARDING
+        #
                 
 
         # Mark the group and time that a packet was recieved for the contention handler to use later
@@ -314,33 +477,143 @@ class confbridgeIPSC(IPSC):
             else:
                 self._logger.warning('(%s) GROUP VOICE END WITHOUT MATCHING START:   CallID: %s PEER: %s, SUB: %s, TS: %s, TGID: %s', self._system, int_id(_seq_id), int_id(_peerid), int_id(_src_sub), _ts, int_id(_dst_group),)
             
-            # Iterate the rules dictionary
-            for _bridge in BRIDGES:
-                for _system in BRIDGES[_bridge]:
-                    if _system['SYSTEM'] == self._system:
+            # Only the bridge members this system, TGID and TS is (see build_bridge_index). Each list
+            # is copied, as connecting or disconnecting a member re-builds the index.
+            for _bridge, _system in tuple(BRIDGE_INDEX['MEMBER'].get((self._system, _dst_group, _ts), ())):
         
-                        # TGID matches a rule source, reset its timer
-                        if _ts == _system['TS'] and _dst_group == _system['TGID'] and ((_system['TO_TYPE'] == 'ON' and (_system['ACTIVE'] == True)) or (_system['TO_TYPE'] == 'OFF' and _system['ACTIVE'] == False)):
-                            _system['TIMER'] = now + _system['TIMEOUT']
-                            self._logger.info('(%s) Transmission match for Bridge: %s. Reset timeout to %s', self._system, _bridge, _system['TIMER'])
+                # TGID matches a rule source, reset its timer
+                if (_system['TO_TYPE'] == 'ON' and (_system['ACTIVE'] == True)) or (_system['TO_TYPE'] == 'OFF' and _system['ACTIVE'] == False):
+                    reset_bridge_timer(_bridge, _system, now)
+                    self._logger.info('(%s) Transmission match for Bridge: %s. Reset timeout to %s', self._system, _bridge, _system['TIMER'])
         
-                        # TGID matches an ACTIVATION trigger
-                        if _dst_group in _system['ON']:
-                            # Set the matching rule as ACTIVE
-                            _system['ACTIVE'] = True
-                            _system['TIMER'] = now + _system['TIMEOUT']
-                            self._logger.info('(%s) Bridge: %s, connection changed to state: %s', self._system, _bridge, _system['ACTIVE'])
-                    
-                        # TGID matches an DE-ACTIVATION trigger
-                        if _dst_group in _system['OFF']:
-                            # Set the matching rule as ACTIVE
-                            _system['ACTIVE'] = False
-                            self._logger.info('(%s) Bridge: %s, connection changed to state: %s', self._system, _bridge, _system['ACTIVE'])
+            # TGID matches an ACTIVATION trigger
+            for _bridge, _system in tuple(BRIDGE_INDEX['ON'].get((self._system, _dst_group), ())):
+                # Set the matching rule as ACTIVE
+                set_bridge_active(_bridge, _system, True)
+                reset_bridge_timer(_bridge, _system, now)
+                self._logger.info('(%s) Bridge: %s, connection changed to state: %s', self._system, _bridge, _system['ACTIVE'])
                     
+            # TGID matches an DE-ACTIVATION trigger
+            for _bridge, _system in tuple(BRIDGE_INDEX['OFF'].get((self._system, _dst_group), ())):
+                # Set the matching rule as INACTIVE
+                set_bridge_active(_bridge, _system, False)
+                reset_bridge_timer(_bridge, _system, now)
+                self._logger.info('(%s) Bridge: %s, connection changed to state: %s', self._system, _bridge, _system['ACTIVE'])
+            
+            # The call is over
+            self.STREAMS.pop(_stream_id, None)
         #                    
         # END IN-BAND SIGNALLING
         #
 
+# Control connection: one command per line, answered with one or more lines, the last of which
+# is "OK" or starts with "ERROR". Only listens on localhost (see CONTROL_PORT), e.g.
+#
+#   echo "list" | nc -q 1 127.0.0.1 31010
+#   echo "add WORLDWIDE CLIENT-2 1 3100 ACTIVE=False TO_TYPE=OFF TIMEOUT=5 ON=2 OFF=9,10" | nc -q 1 127.0.0.1 31010
+#   echo "remove WORLDWIDE CLIENT-2 1 3100" | nc -q 1 127.0.0.1 31010
+#
+#   list [BRIDGE]                       the members of every (or one) conference bridge
+#   add BRIDGE SYSTEM TS TGID [OPTIONS] add a system to a bridge (which is made if it doesn't exist). OPTIONS
+#                                       are the bridge file's: ACTIVE=True|False (True), TO_TYPE=ON|OFF|NONE (NONE),
+#                                       TIMEOUT=minutes (0), ON=tgid,tgid... and OFF=tgid,tgid... (none)
+#   remove BRIDGE SYSTEM TS TGID        take a system off a bridge (a bridge with no systems left is removed)
+#
+# Commands are carried out by the reactor between packets, so they take effect all at once.
+#
+class confbridgeControl(LineReceiver):
+    delimiter = '\n'
+
+    def connectionMade(self):
+        self._peer = self.transport.getPeer()
+
+    def lineReceived(self, _line):
+        _words = _line.strip().split()
+        if not _words:
+            return
+        _command = _words[0].lower()
+        try:
+            if _command == 'list':
+                self.list_bridges(_words[1:])
+            elif _command == 'add':
+                self.add_member(_words[1:])
+            elif _command == 'remove':
+                self.remove_member(_words[1:])
+            else:
+                raise ValueError('unknown command: {}'.format(_command))
+        except ValueError as e:
+            self.sendLine('ERROR: {}'.format(e))
+            return
+        self.sendLine('OK')
+
+    def list_bridges(self, _args):
+        if _args and _args[0] not in BRIDGES:
+            raise ValueError('no such bridge: {}'.format(_args[0]))
+        _now = time()
+        for _bridge in sorted(_args[:1] or BRIDGES):
+            for _system in BRIDGES[_bridge]:
+                _call = _system.get('TIMER_CALL')
+                self.sendLine('{} {} TS={} TGID={} ACTIVE={} TO_TYPE={} TIMEOUT={} ON={} OFF={} TIMER={}'.format(
+                    _bridge, _system['SYSTEM'], _system['TS'], int_id(_system['TGID']), _system['ACTIVE'],
+                    _system['TO_TYPE'], _system['TIMEOUT']/60, ','.join(str(int_id(_tgid)) for _tgid in _system['ON']),
+                    ','.join(str(int_id(_tgid)) for _tgid in _system['OFF']),
+                    int(max(_system['TIMER'] - _now, 0)) if _call and _call.active() else 'NONE'))
+
+    # A TGID, which has to fit in the 3 bytes it's sent in
+    def tgid(self, _value):
+        _tgid = int(_value)
+        if not 0 <= _tgid <= 0xFFFFFF:
+            raise ValueError('TGID out of range: {}'.format(_value))
+        return _tgid
+
+    # BRIDGE SYSTEM TS TGID, checked against the main configuration
+    def member_key(self, _args):
+        if len(_args) < 4:
+            raise ValueError('need BRIDGE SYSTEM TS TGID')
+        _bridge, _system = _args[0], _args[1]
+        if _system not in systems:
+            raise ValueError('system not configured or not enabled: {}'.format(_system))
+        try:
+            _ts, _tgid = int(_args[2]), int(_args[3])
+        except ValueError:
+            raise ValueError('TS and TGID must be numbers')
+        if _ts not in (1, 2):
+            raise ValueError('TS must be 1 or 2')
+        return _bridge, _system, _ts, self.tgid(_tgid)
+
+    def add_member(self, _args):
+        _bridge, _system, _ts, _tgid = self.member_key(_args)
+        if find_bridge_member(_bridge, _system, _ts, hex_str_3(_tgid)):
+            raise ValueError('{} TS {} TGID {} is already on bridge {}'.format(_system, _ts, _tgid, _bridge))
+        _member = {'SYSTEM': _system, 'TS': _ts, 'TGID': _tgid, 'ACTIVE': True, 'TIMEOUT': 0, 'TO_TYPE': 'NONE', 'ON': [], 'OFF': []}
+        for _option in _args[4:]:
+            _key, _, _value = _option.partition('=')
+            _key = _key.upper()
+            try:
+                if _key == 'ACTIVE' and _value.lower() in ('true', 'false'):
+                    _member['ACTIVE'] = _value.lower() == 'true'
+                elif _key == 'TO_TYPE' and _value.upper() in ('ON', 'OFF', 'NONE'):
+                    _member['TO_TYPE'] = _value.upper()
+                elif _key == 'TIMEOUT' and int(_value) >= 0:
+                    _member['TIMEOUT'] = int(_value)
+                elif _key in ('ON', 'OFF'):
+                    _member[_key] = [self.tgid(_id) for _id in _value.split(',') if _id]
+                else:
+                    raise ValueError
+            except ValueError:
+                raise ValueError('bad option: {}'.format(_option))
+        add_bridge_member(_bridge, make_member(_member))
+        logger.info('Conference Bridge CONTROL (%s): ADD System: %s, Bridge: %s, TS: %s, TGID: %s, ACTIVE: %s', self._peer.host, _system, _bridge, _ts, _tgid, _member['ACTIVE'])
+
+    def remove_member(self, _args):
+        _bridge, _system, _ts, _tgid = self.member_key(_args)
+        _member = find_bridge_member(_bridge, _system, _ts, hex_str_3(_tgid))
+        if not _member:
+            raise ValueError('{} TS {} TGID {} is not on bridge {}'.format(_system, _ts, _tgid, _bridge))
+        remove_bridge_member(_bridge, _member)
+        logger.info('Conference Bridge CONTROL (%s): REMOVE System: %s, Bridge: %s, TS: %s, TGID: %s', self._peer.host, _system, _bridge, _ts, _tgid)
+
+
     
 if __name__ == '__main__':    
     import argparse
@@ -412,9 +685,14 @@ if __name__ == '__main__':
     
     # Build the routing rules file
     BRIDGES = make_bridges('confbridge_rules')
+    BRIDGE_INDEX = build_bridge_index(BRIDGES)
 
     # Build the Access Control List
-    ACL = build_acl('sub_acl')
+    try:
+        ACL = build_acl('sub_acl')
+    except ValueError as e:
+        logger.critical('ACL file could not be used: %s', e)
+        sys.exit('ERROR: {}'.format(e))
     
     # INITIALIZE AN IPSC OBJECT (SELF SUSTAINING) FOR EACH CONFIGUED IPSC
     for system in CONFIG['SYSTEMS']:
@@ -427,9 +705,20 @@ if __name__ == '__main__':
         reporting_loop = config_reports(CONFIG)
         reporting = task.LoopingCall(reporting_loop, logger)
         reporting.start(CONFIG['REPORTS']['REPORT_INTERVAL'])
+
+    # REPORT DROPPED DUPLICATES ON THE SAME INTERVAL
+    if DUPLICATE_WINDOW:
+        duplicate_reporting = task.LoopingCall(report_duplicates)
+        duplicate_reporting.start(CONFIG['REPORTS']['REPORT_INTERVAL'], now = False)
         
-    # INITIALIZE THE REPORTING LOOP IF CONFIGURED
-    rule_timer = task.LoopingCall(rule_timer_loop)
-    rule_timer.start(60)
+    # START THE BRIDGE TIMERS
+    arm_bridge_timers(BRIDGES)
+
+    # LISTEN FOR BRIDGE CONTROL COMMANDS
+    if CONTROL_PORT:
+        control = Factory()
+        control.protocol = confbridgeControl
+        reactor.listenTCP(CONTROL_PORT, control, interface='127.0.0.1')
+        logger.info('Conference bridge control listening on 127.0.0.1:%s', CONTROL_PORT)
   
     reactor.run()
\ No newline at end of file
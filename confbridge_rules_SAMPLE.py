@@ -26,6 +26,10 @@ configuration file.
     * TIMOUT is a value in minutes for the timout timer. No, I won't make it 'seconds', so don't
         ask. Timers are performance "expense".
 
+Systems can also be added to and removed from conference bridges while confbridge.py is running,
+without editing this file or restarting, with the control connection on 127.0.0.1 -- see
+confbridgeControl in confbridge.py, e.g.:  echo "list" | nc -q 1 127.0.0.1 31010
+
 '''
 
 BRIDGES = {
@@ -36,11 +36,11 @@ import signal
 from logging.config import dictConfig
 from hmac import new as hmac_new
 from binascii import b2a_hex as ahex
-from binascii import a2b_hex as bhex
 from hashlib import sha1
 from socket import inet_ntoa as IPAddr
 from socket import inet_aton as IPHexStr
 from time import time
+from random import uniform
 from cPickle import dump as pickle_dump
 
 from twisted.internet.protocol import DatagramProtocol
@@ -49,6 +49,11 @@ from twisted.internet import task
 
 from ipsc.ipsc_const import *
 from ipsc.ipsc_mask import *
+from ipsc import sendmmsg
+from ipsc.peer_record import PeerRecord, LinkStatus, systems_to_dict
+from ipsc.timer_wheel import TimerWheel
+from ipsc.packet import IPSCPacketView
+from ipsc.rewriter import BurstRewriter
 from dmrlink_config import build_config
 from dmrlink_log import config_logging
 from dmr_utils.utils import hex_str_2, hex_str_3, hex_str_4, int_id
@@ -65,6 +70,13 @@ __email__       = 'n0mjs@me.com'
 # Global variables used whether we are a module or __main__
 systems = {}
 
+# Keep-alive timing: how often (in seconds) the keep-alive timer wheel ticks, how far (as a fraction
+# of ALIVE_TIMER) each peer keep-alive is randomly moved to keep them from bunching up, and how long
+# the master waits to hear from a peer before de-registering it.
+KEEP_ALIVE_TICK = 0.25
+KEEP_ALIVE_JITTER = 0.1
+PEER_TIMEOUT = 120
+
 # Timed loop used for reporting IPSC status
 #
 # REPORT BASED ON THE TYPE SELECTED IN THE MAIN CONFIG FILE
@@ -74,7 +86,7 @@ def config_reports(_config):
             _logger.debug('Periodic Reporting Loop Started (PICKLE)')
             try:
                 with open(_config['REPORTS']['REPORT_PATH']+'dmrlink_stats.pickle', 'wb') as file:
-                    pickle_dump(_config['SYSTEMS'], file, 2)
+                    pickle_dump(systems_to_dict(_config['SYSTEMS']), file, 2)
                     file.close()
             except IOError as detail:
                 _logger.error('I/O Error: %s', detail)
@@ -151,15 +163,16 @@ def process_flags_bytes(_hex_flags):
         'MASTER': _master
         } 
 
+# Encode one peer's entry in a peer list: RADIO_ID, IP, PORT, MODE
+#
+def peer_list_entry(_peerid, _peer):
+    return _peerid + IPHexStr(_peer.ip) + hex_str_2(_peer.port) + _peer.mode
+
 # Build a peer list - used when a peer registers, re-regiseters or times out
+# (the IPSC class keeps its own up-to-date copy, see IPSC.update_peer_list)
 #
 def build_peer_list(_peers):
-    concatenated_peers = ''
-    for peer in _peers:
-        hex_ip = IPHexStr(_peers[peer]['IP'])
-        hex_port = hex_str_2(_peers[peer]['PORT'])
-        mode = _peers[peer]['MODE']        
-        concatenated_peers += peer + hex_ip + hex_port + mode
+    concatenated_peers = ''.join([peer_list_entry(peer, _peers[peer]) for peer in _peers])
     
     peer_list = hex_str_2(len(concatenated_peers)) + concatenated_peers
     return peer_list
@@ -169,7 +182,7 @@ def build_peer_list(_peers):
 def print_peer_list(_config, _network):
     _peers = _config['SYSTEMS'][_network]['PEERS']
     
-    _status = _config['SYSTEMS'][_network]['MASTER']['STATUS']['PEER_LIST']
+    _status = _config['SYSTEMS'][_network]['MASTER'].status.peer_list
     #print('Peer List Status for {}: {}' .format(_network, _status))
     
     if _status and not _config['SYSTEMS'][_network]['PEERS']:
@@ -180,7 +193,7 @@ def print_peer_list(_config, _network):
     print('Peer List for: %s' % _network)
     for peer in _peers.keys():
         _this_peer = _peers[peer]
-        _this_peer_stat = _this_peer['STATUS']
+        _this_peer_stat = _this_peer.status
         
         if peer == _config['SYSTEMS'][_network]['LOCAL']['RADIO_ID']:
             me = '(self)'
@@ -188,17 +201,17 @@ def print_peer_list(_config, _network):
             me = ''
              
         print('\tRADIO ID: {} {}' .format(int_id(peer), me))
-        print('\t\tIP Address: {}:{}' .format(_this_peer['IP'], _this_peer['PORT']))
-        if _this_peer['MODE_DECODE'] and _config['REPORTS']['PRINT_PEERS_INC_MODE']:
+        print('\t\tIP Address: {}:{}' .format(_this_peer.ip, _this_peer.port))
+        if _this_peer.mode_decode and _config['REPORTS']['PRINT_PEERS_INC_MODE']:
             print('\t\tMode Values:')
-            for name, value in _this_peer['MODE_DECODE'].items():
+            for name, value in _this_peer.mode_decode.items():
                 print('\t\t\t{}: {}' .format(name, value))
-        if _this_peer['FLAGS_DECODE'] and _config['REPORTS']['PRINT_PEERS_INC_FLAGS']:
+        if _this_peer.flags_decode and _config['REPORTS']['PRINT_PEERS_INC_FLAGS']:
             print('\t\tService Flags:')
-            for name, value in _this_peer['FLAGS_DECODE'].items():
+            for name, value in _this_peer.flags_decode.items():
                 print('\t\t\t{}: {}' .format(name, value))
-        print('\t\tStatus: {},  KeepAlives Sent: {},  KeepAlives Outstanding: {},  KeepAlives Missed: {}' .format(_this_peer_stat['CONNECTED'], _this_peer_stat['KEEP_ALIVES_SENT'], _this_peer_stat['KEEP_ALIVES_OUTSTANDING'], _this_peer_stat['KEEP_ALIVES_MISSED']))
-        print('\t\t                KeepAlives Received: {},  Last KeepAlive Received at: {}' .format(_this_peer_stat['KEEP_ALIVES_RECEIVED'], _this_peer_stat['KEEP_ALIVE_RX_TIME']))
+        print('\t\tStatus: {},  KeepAlives Sent: {},  KeepAlives Outstanding: {},  KeepAlives Missed: {}' .format(_this_peer_stat.connected, _this_peer_stat.keep_alives_sent, _this_peer_stat.keep_alives_outstanding, _this_peer_stat.keep_alives_missed))
+        print('\t\t                KeepAlives Received: {},  Last KeepAlive Received at: {}' .format(_this_peer_stat.keep_alives_received, _this_peer_stat.keep_alive_rx_time))
         
     print('')
  
@@ -210,17 +223,17 @@ def print_master(_config, _network):
     else:
         _master = _config['SYSTEMS'][_network]['MASTER']
         print('Master for %s' % _network)
-        print('\tRADIO ID: {}' .format(int(ahex(_master['RADIO_ID']), 16)))
-        if _master['MODE_DECODE'] and _config['REPORTS']['PRINT_PEERS_INC_MODE']:
+        print('\tRADIO ID: {}' .format(int(ahex(_master.radio_id), 16)))
+        if _master.mode_decode and _config['REPORTS']['PRINT_PEERS_INC_MODE']:
             print('\t\tMode Values:')
-            for name, value in _master['MODE_DECODE'].items():
+            for name, value in _master.mode_decode.items():
                 print('\t\t\t{}: {}' .format(name, value))
-        if _master['FLAGS_DECODE'] and _config['REPORTS']['PRINT_PEERS_INC_FLAGS']:
+        if _master.flags_decode and _config['REPORTS']['PRINT_PEERS_INC_FLAGS']:
             print('\t\tService Flags:')
-            for name, value in _master['FLAGS_DECODE'].items():
+            for name, value in _master.flags_decode.items():
                 print('\t\t\t{}: {}' .format(name, value))
-        print('\t\tStatus: {},  KeepAlives Sent: {},  KeepAlives Outstanding: {},  KeepAlives Missed: {}' .format(_master['STATUS']['CONNECTED'], _master['STATUS']['KEEP_ALIVES_SENT'], _master['STATUS']['KEEP_ALIVES_OUTSTANDING'], _master['STATUS']['KEEP_ALIVES_MISSED']))
-        print('\t\t                KeepAlives Received: {},  Last KeepAlive Received at: {}' .format(_master['STATUS']['KEEP_ALIVES_RECEIVED'], _master['STATUS']['KEEP_ALIVE_RX_TIME']))
+        print('\t\tStatus: {},  KeepAlives Sent: {},  KeepAlives Outstanding: {},  KeepAlives Missed: {}' .format(_master.status.connected, _master.status.keep_alives_sent, _master.status.keep_alives_outstanding, _master.status.keep_alives_missed))
+        print('\t\t                KeepAlives Received: {},  Last KeepAlive Received at: {}' .format(_master.status.keep_alives_received, _master.status.keep_alive_rx_time))
     
 
 
@@ -233,7 +246,7 @@ class IPSC(DatagramProtocol):
 
         # Housekeeping: create references to the configuration and status data for this IPSC instance.
         # Some configuration objects that are used frequently and have lengthy names are shortened
-        # such as (self._master_sock) expands to (self._config['MASTER']['IP'], self._config['MASTER']['PORT']).
+        # such as (self._master_sock) expands to (self._config['MASTER'].ip, self._config['MASTER'].port).
         # Note that many of them reference each other... this is the Pythonic way.
         #
         self._system = _name
@@ -245,11 +258,18 @@ class IPSC(DatagramProtocol):
         self._local_id = self._local['RADIO_ID']
         #
         self._master = self._config['MASTER']
-        self._master_stat = self._master['STATUS']
-        self._master_sock = self._master['IP'], self._master['PORT']
+        self._master_stat = self._master.status
+        self._master_sock = self._master.ip, self._master.port
         #
         self._peers = self._config['PEERS']
         #
+        # (IP, PORT) of the master and every peer we're connected to -- where send_to_ipsc sends.
+        # Rebuilt by update_destinations only when connection state changes, not for every packet.
+        # When we can (Linux), send_to_ipsc uses _multi_sender to send to all of them with one system call.
+        self._destinations = ()
+        self._multi_sender = None
+        self.update_destinations()
+        #
         # This is a regular list to store peers for the IPSC. At times, parsing a simple list is much less
         # Spendy than iterating a list of dictionaries... Maybe I'll find a better way in the future. Also
         # We have to know when we have a new peer list, so a variable to indicate we do (or don't)
@@ -280,6 +300,37 @@ class IPSC(DatagramProtocol):
         self.DE_REG_REQ_PKT         = (DE_REG_REQ + self._local_id)
         self.DE_REG_REPLY_PKT       = (DE_REG_REPLY + self._local_id)
         #
+        # Authentication: a keyed HMAC context is built once and copied for each packet, rather than
+        # re-keying HMAC-SHA1 every time. The static maintenance packets above never change, so they
+        # are signed once, here, and send_packet looks them up instead of hashing them again.
+        if self._local['AUTH_ENABLED']:
+            self._auth_hmac = hmac_new(self._local['AUTH_KEY'], digestmod=sha1)
+            self._signed_packets = {}
+            for _packet in (self.MASTER_REG_REQ_PKT, self.MASTER_ALIVE_PKT, self.PEER_LIST_REQ_PKT, self.PEER_REG_REQ_PKT, self.PEER_REG_REPLY_PKT,
+                            self.PEER_ALIVE_REQ_PKT, self.PEER_ALIVE_REPLY_PKT, self.MASTER_ALIVE_REPLY_PKT, self.DE_REG_REQ_PKT, self.DE_REG_REPLY_PKT):
+                self._signed_packets[_packet] = self.sign_packet(_packet)
+        #
+        # When we're the master: each peer's encoded peer list entry, and the complete PEER_LIST_REPLY
+        # (signed, if we authenticate) built from them. The reply is only rebuilt after a peer is added,
+        # removed, or changes address or mode -- not for every peer that asks for it.
+        self._peer_list_entries = {}
+        self._peer_list_reply = None
+        #
+        # Keep-alive deadlines for each peer: as a peer, when to send the next keep-alive; as the master,
+        # when a peer will have timed out. See keep_alive_loop.
+        self._keep_alives = TimerWheel(KEEP_ALIVE_TICK, int(max(self._local['ALIVE_TIMER'] * (1 + KEEP_ALIVE_JITTER), PEER_TIMEOUT + 1) / KEEP_ALIVE_TICK) + 1)
+        #
+        for _peerid in self._peers:
+            self.update_peer_list(_peerid)
+            self.schedule_keep_alive(_peerid)
+        #
+        # Packet dispatch table - maps each packet type to its validation policy and handler
+        self.build_dispatch()
+        # The last packet view made, see packet_view
+        self._packet_view = None
+        # For re-writing packets we pass on to other systems or talkgroups (bridge.py, playback.py, etc.)
+        self._rewriter = BurstRewriter()
+        #
         self._logger.info('(%s) IPSC Instance Created: %s, %s:%s', self._system, int_id(self._local['RADIO_ID']), self._local['IP'], self._local['PORT'])
 
 
@@ -297,29 +348,93 @@ class IPSC(DatagramProtocol):
     # Determine if the provided master ID is valid for the provided network
     #
     def valid_master(self, _peerid):
-        if self._master['RADIO_ID'] == _peerid:
+        if self._master.radio_id == _peerid:
             return True     
         else:
             return False
+    
+    # Determine if the provided ID is either our master or a valid peer for the provided network
+    #
+    def valid_any_peer(self, _peerid):
+        if _peerid in self._peers or self._master.radio_id == _peerid:
+            return True
+        return False
+
+    # When we're the master, keep the encoded peer list in step with the peer table. This MUST be
+    # called with the peer's ID any time a peer is added, removed, or changes IP, port or mode.
+    #
+    def update_peer_list(self, _peerid):
+        if not self._local['MASTER_PEER']:
+            return
+        if _peerid in self._peers:
+            _entry = peer_list_entry(_peerid, self._peers[_peerid])
+            if self._peer_list_entries.get(_peerid) == _entry:
+                return
+            self._peer_list_entries[_peerid] = _entry
+        elif self._peer_list_entries.pop(_peerid, None) is None:
+            return
+        self._peer_list_reply = None
+
+    # The PEER_LIST_REPLY packet for our current peers, ready to go on the wire
+    #
+    def peer_list_reply_packet(self):
+        if self._peer_list_reply is None:
+            _entries = ''.join(self._peer_list_entries.values())
+            _packet = self.PEER_LIST_REPLY_PKT + hex_str_2(len(_entries)) + _entries
+            if self._local['AUTH_ENABLED']:
+                _packet = self.sign_packet(_packet)
+            self._peer_list_reply = _packet
+        return self._peer_list_reply
+
+    # Rebuild the tuple of destinations send_to_ipsc uses. This MUST be called any time the master
+    # or a peer is connected, disconnected, added, removed or changes address.
+    #
+    def update_destinations(self):
+        _destinations = []
+        if self._master_stat.connected:
+            _destinations.append(self._master_sock)
+        for _peer in self._peers.values():
+            if _peer.status.connected:
+                _destinations.append((_peer.ip, _peer.port))
+        self._destinations = tuple(_destinations)
+        if self._multi_sender:
+            self._multi_sender.set_destinations(self._destinations)
+    
+    # Use sendmmsg to send to all destinations in a single system call, if this platform has it.
+    # Needs the transport, so it is called from startProtocol.
+    #
+    def start_multi_sender(self):
+        if sendmmsg.AVAILABLE:
+            self._multi_sender = sendmmsg.MultiSender(self.transport.fileno())
+            self._multi_sender.set_destinations(self._destinations)
+            self._logger.info('(%s) Using sendmmsg for packets to multiple destinations', self._system)
 
     # De-register a peer from an IPSC by removing it's information
     #
     def de_register_peer(self, _peerid):
         # Iterate for the peer in our data
-        if _peerid in self._peers.keys():
+        if _peerid in self._peers:
             del self._peers[_peerid]
+            self.update_destinations()
+            self.update_peer_list(_peerid)
+            self._keep_alives.cancel(_peerid)
             self._logger.info('(%s) Peer De-Registration Requested for: %s', self._system, int_id(_peerid))
+            self.peer_removed(_peerid)
             return
         else:
             self._logger.warning('(%s) Peer De-Registration Requested for: %s, but we don\'t have a listing for this peer', self._system, int_id(_peerid))
             pass
 
-    # Take a received peer list and the network it belongs to, process and populate the
-    # data structure in my_ipsc_config with the results, and return a simple list of peers.
+    # Take a received peer list and apply it to our peer table as a diff: new peers are added, peers
+    # that are no longer listed are removed, and peers whose IP, port or mode changed are updated.
+    # Peers that haven't changed aren't touched at all. Each change is reported with the peer_added,
+    # peer_removed or peer_changed callback. Returns the (added, removed, changed) peer ID lists.
     #
     def process_peer_list(self, _data):
-        # Create a temporary peer list to track who we should have in our list -- used to find old peers we should remove.
-        _temp_peers = []
+        _added = []
+        _changed = []
+        # Every peer ID in this list -- used to find old peers we should remove.
+        _listed = set()
         # Determine the length of the peer list for the parsing iterator
         _peer_list_length = int(ahex(_data[5:7]), 16)
         # Record the number of peers in the data structure... we'll use it later (11 bytes per peer entry)
@@ -327,58 +442,83 @@ class IPSC(DatagramProtocol):
         self._logger.info('(%s) Peer List Received from Master: %s peers in this IPSC', self._system, self._local['NUM_PEERS'])
     
         # Iterate each peer entry in the peer list. Skip the header, then pull the next peer, the next, etc.
-        for i in range(7, _peer_list_length +7, 11):
+        for i in xrange(7, _peer_list_length +7, 11):
             # Extract various elements from each entry...
-            _hex_radio_id = (_data[i:i+4])
-            _hex_address  = (_data[i+4:i+8])
-            _ip_address   = IPAddr(_hex_address)
-            _hex_port     = (_data[i+8:i+10])
-            _port         = int(ahex(_hex_port), 16)
-            _hex_mode     = (_data[i+10:i+11])
+            _hex_radio_id = _data[i:i+4]
+            _ip_address   = IPAddr(_data[i+4:i+8])
+            _port         = int(ahex(_data[i+8:i+10]), 16)
+            _hex_mode     = _data[i+10:i+11]
+            _listed.add(_hex_radio_id)
+            
+            _peer = self._peers.get(_hex_radio_id)
      
-            # Add this peer to a temporary PeerID list - used to remove any old peers no longer with us
-            _temp_peers.append(_hex_radio_id)
-        
-            # This is done elsewhere for the master too, so we use a separate function
-            _decoded_mode = process_mode_byte(_hex_mode)
-
-            # If this entry WAS already in our list, update everything except the stats
-            # in case this was a re-registration with a different mode, flags, etc.
-            if _hex_radio_id in self._peers.keys():
-                self._peers[_hex_radio_id]['IP'] = _ip_address
-                self._peers[_hex_radio_id]['PORT'] = _port
-                self._peers[_hex_radio_id]['MODE'] = _hex_mode
-                self._peers[_hex_radio_id]['MODE_DECODE'] = _decoded_mode
-                self._peers[_hex_radio_id]['FLAGS'] = ''
-                self._peers[_hex_radio_id]['FLAGS_DECODE'] = ''
-                self._logger.debug('(%s) Peer Updated: %s', self._system, self._peers[_hex_radio_id])
-
             # If this entry was NOT already in our list, add it.
-            if _hex_radio_id not in self._peers.keys():
-                self._peers[_hex_radio_id] = {
-                    'IP':          _ip_address, 
-                    'PORT':        _port, 
-                    'MODE':        _hex_mode,            
-                    'MODE_DECODE': _decoded_mode,
-                    'FLAGS': '',
-                    'FLAGS_DECODE': '',
-                    'STATUS': {
-                        'CONNECTED':               False,
-                        'KEEP_ALIVES_SENT':        0,
-                        'KEEP_ALIVES_MISSED':      0,
-                        'KEEP_ALIVES_OUTSTANDING': 0,
-                        'KEEP_ALIVES_RECEIVED':    0,
-                        'KEEP_ALIVE_RX_TIME':      0
-                        }
-                    }
+            if _peer is None:
+                self._peers[_hex_radio_id] = PeerRecord(_ip_address, _port, _hex_mode, process_mode_byte(_hex_mode))
+                _added.append(_hex_radio_id)
                 self._logger.debug('(%s) Peer Added: %s', self._system, self._peers[_hex_radio_id])
+            
+            # If this entry WAS already in our list and something changed, update everything except the
+            # stats in case this was a re-registration with a different mode, flags, etc.
+            elif _peer.ip != _ip_address or _peer.port != _port or _peer.mode != _hex_mode:
+                _peer.ip = _ip_address
+                _peer.port = _port
+                if _peer.mode != _hex_mode:
+                    _peer.mode = _hex_mode
+                    _peer.mode_decode = process_mode_byte(_hex_mode)
+                _peer.flags = ''
+                _peer.flags_decode = ''
+                _changed.append(_hex_radio_id)
+                self._logger.debug('(%s) Peer Updated: %s', self._system, _peer)
     
         # Finally, check to see if there's a peer already in our list that was not in this peer list
         # and if so, delete it.
-        for peer in self._peers.keys():
-            if peer not in _temp_peers:
-                self.de_register_peer(peer)
-                self._logger.warning('(%s) Peer Deleted (not in new peer list): %s', self._system, int_id(peer))
+        _removed = [peer for peer in self._peers if peer not in _listed]
+        for peer in _removed:
+            self.de_register_peer(peer)
+            self._logger.warning('(%s) Peer Deleted (not in new peer list): %s', self._system, int_id(peer))
+        
+        # Addresses may have changed for peers we already had
+        if _changed:
+            self.update_destinations()
+        
+        for peer in _added:
+            self.update_peer_list(peer)
+            self.schedule_keep_alive(peer)
+            self.peer_added(peer)
+        for peer in _changed:
+            self.update_peer_list(peer)
+            self.peer_changed(peer)
+        
+        if _added or _removed or _changed:
+            self._logger.info('(%s) Peer List Applied: %s added, %s removed, %s changed', self._system, len(_added), len(_removed), len(_changed))
+        return _added, _removed, _changed
+
+
+    #************************************************
+    #     CALLBACK FUNCTIONS FOR PEER TABLE CHANGES
+    #************************************************
+    
+    # Called after self._peers has been updated, so the peer's record is already there (or gone).
+    # Override these to keep anything derived from the peer table up to date.
+    
+    def peer_added(self, _peerid):
+        self._logger.debug('(%s) Peer Table: Added %s', self._system, int_id(_peerid))
+    
+    def peer_removed(self, _peerid):
+        self._logger.debug('(%s) Peer Table: Removed %s', self._system, int_id(_peerid))
+    
+    def peer_changed(self, _peerid):
+        self._logger.debug('(%s) Peer Table: Changed %s', self._system, int_id(_peerid))
+
+    # Called when we (as a peer) have registered with the master -- again, possibly with a different
+    # mode -- and when we've given up on it. self._master is up to date by then.
+
+    def master_connected(self):
+        self._logger.debug('(%s) Master Connected: %s', self._system, int_id(self._master.radio_id))
+
+    def master_disconnected(self):
+        self._logger.debug('(%s) Master Disconnected: %s', self._system, int_id(self._master.radio_id))
 
 
     #************************************************
@@ -413,7 +553,7 @@ class IPSC(DatagramProtocol):
         self._logger.debug('(%s) Private Data Packet Received From: %s, IPSC Peer %s, Destination %s', self._system, int_id(_src_sub), int_id(_peerid), int_id(_dst_sub))
 
     def unknown_message(self, _packettype, _peerid, _data):
-        self._logger.error('(%s) Unknown Message - Type: %s From: %s Packet: %s', ahex(_packettype), self._system, int_id(_peerid), ahex(_data))
+        self._logger.error('(%s) Unknown Message - Type: %s From: %s Packet: %s', self._system, ahex(_packettype), int_id(_peerid), ahex(_data))
 
 
     #************************************************
@@ -424,8 +564,10 @@ class IPSC(DatagramProtocol):
     #
     def send_packet(self, _packet, (_host, _port)):
         if self._local['AUTH_ENABLED']:
-            _hash = bhex((hmac_new(self._local['AUTH_KEY'],_packet,sha1)).hexdigest()[:20])
-            _packet = _packet + _hash
+            _signed = self._signed_packets.get(_packet)
+            if _signed is None:
+                _signed = self.sign_packet(_packet)
+            _packet = _signed
         self.transport.write(_packet, (_host, _port))
         # USE THE FOLLOWING ONLY UNDER DIRE CIRCUMSTANCES -- PERFORMANCE IS ADVERSLY AFFECTED!
         #self._logger.debug('(%s) TX Packet to %s on port %s: %s', self._system, _host, _port, ahex(_packet))
@@ -434,15 +576,22 @@ class IPSC(DatagramProtocol):
     #
     def send_to_ipsc(self, _packet):
         if self._local['AUTH_ENABLED']:
-            _hash = bhex((hmac_new(self._local['AUTH_KEY'],_packet,sha1)).hexdigest()[:20])
-            _packet = _packet + _hash
-        # Send to the Master
-        if self._master['STATUS']['CONNECTED']:
-            self.transport.write(_packet, (self._master['IP'], self._master['PORT']))
-        # Send to each connected Peer
-        for peer in self._peers.keys():
-            if self._peers[peer]['STATUS']['CONNECTED']:
-                self.transport.write(_packet, (self._peers[peer]['IP'], self._peers[peer]['PORT']))
+            _packet = self.sign_packet(_packet)
+        self.write_to_ipsc(_packet)
+    
+    # Send a packet that is already signed (or doesn't need to be) to the Master and each connected Peer
+    #
+    def write_to_ipsc(self, _packet):
+        _destinations = self._destinations
+        if self._multi_sender and len(_destinations) > 1:
+            _sent = self._multi_sender.send(_packet)
+            if _sent == len(_destinations):
+                return
+            # Fall back to one write per destination for anything sendmmsg didn't send
+            _destinations = _destinations[_sent:]
+        _write = self.transport.write
+        for _destination in _destinations:
+            _write(_packet, _destination)
         
     
     # FUNTIONS FOR IPSC MAINTENANCE ACTIVITIES WE RESPOND TO
@@ -451,15 +600,21 @@ class IPSC(DatagramProtocol):
     def peer_alive_req(self, _data, _peerid, _host, _port):
         _hex_mode      = (_data[5])
         _hex_flags     = (_data[6:10])
-        _decoded_mode  = process_mode_byte(_hex_mode)
-        _decoded_flags = process_flags_bytes(_hex_flags)
     
-        self._peers[_peerid]['MODE'] = _hex_mode
-        self._peers[_peerid]['MODE_DECODE'] = _decoded_mode
-        self._peers[_peerid]['FLAGS'] = _hex_flags
-        self._peers[_peerid]['FLAGS_DECODE'] = _decoded_flags
+        # Keep-alives are frequent and the mode and flags rarely change, so only decode them when they do
+        _peer = self._peers[_peerid]
+        if _peer.flags != _hex_flags:
+            _peer.flags = _hex_flags
+            _peer.flags_decode = process_flags_bytes(_hex_flags)
+        _mode_changed = _peer.mode != _hex_mode
+        if _mode_changed:
+            _peer.mode = _hex_mode
+            _peer.mode_decode = process_mode_byte(_hex_mode)
         self.send_packet(self.PEER_ALIVE_REPLY_PKT, (_host, _port))
         self.reset_keep_alive(_peerid)  # Might as well reset our own counter, we know it's out there...
+        if _mode_changed:
+            self.update_peer_list(_peerid)
+            self.peer_changed(_peerid)
         self._logger.debug('(%s) Keep-Alive reply sent to Peer %s, %s:%s', self._system, int_id(_peerid), _host, _port)
 
     # SOMEONE WANTS TO REGISTER WITH US - WE'RE COOL WITH THAT
@@ -471,29 +626,31 @@ class IPSC(DatagramProtocol):
     # SOMEONE HAS ANSWERED OUR KEEP-ALIVE REQUEST - KEEP TRACK OF IT
     def peer_alive_reply(self, _peerid):
         self.reset_keep_alive(_peerid)
-        self._peers[_peerid]['STATUS']['KEEP_ALIVES_RECEIVED'] += 1
-        self._peers[_peerid]['STATUS']['KEEP_ALIVE_RX_TIME'] = int(time())
-        self._logger.debug('(%s) Keep-Alive Reply (we sent the request) Received from Peer %s, %s:%s', self._system, int_id(_peerid), self._peers[_peerid]['IP'], self._peers[_peerid]['PORT'])
+        _peer = self._peers[_peerid]
+        _peer.status.keep_alives_received += 1
+        _peer.status.keep_alive_rx_time = int(time())
+        self._logger.debug('(%s) Keep-Alive Reply (we sent the request) Received from Peer %s, %s:%s', self._system, int_id(_peerid), _peer.ip, _peer.port)
     
     # SOMEONE HAS ANSWERED OUR REQEST TO REGISTER WITH THEM - KEEP TRACK OF IT
     def peer_reg_reply(self, _peerid):
         if _peerid in self._peers.keys():
-            self._peers[_peerid]['STATUS']['CONNECTED'] = True
-            self._logger.info('(%s) Registration Reply From: %s, %s:%s', self._system, int_id(_peerid), self._peers[_peerid]['IP'], self._peers[_peerid]['PORT'])
+            self._peers[_peerid].status.connected = True
+            self.update_destinations()
+            self._logger.info('(%s) Registration Reply From: %s, %s:%s', self._system, int_id(_peerid), self._peers[_peerid].ip, self._peers[_peerid].port)
 
     # OUR MASTER HAS ANSWERED OUR KEEP-ALIVE REQUEST - KEEP TRACK OF IT
     def master_alive_reply(self, _peerid):
         self.reset_keep_alive(_peerid)
-        self._master['STATUS']['KEEP_ALIVES_RECEIVED'] += 1
-        self._master['STATUS']['KEEP_ALIVE_RX_TIME'] = int(time())
-        self._logger.debug('(%s) Keep-Alive Reply (we sent the request) Received from the Master %s, %s:%s', self._system, int_id(_peerid), self._master['IP'], self._master['PORT'])
+        self._master_stat.keep_alives_received += 1
+        self._master_stat.keep_alive_rx_time = int(time())
+        self._logger.debug('(%s) Keep-Alive Reply (we sent the request) Received from the Master %s, %s:%s', self._system, int_id(_peerid), self._master.ip, self._master.port)
     
     # OUR MASTER HAS SENT US A PEER LIST - PROCESS IT
     def peer_list_reply(self, _data, _peerid):
-        self._master['STATUS']['PEER_LIST'] = True
+        self._master_stat.peer_list = True
         if len(_data) > 18:
             self.process_peer_list(_data)
-        self._logger.debug('(%s) Peer List Reply Received From Master %s, %s:%s', self._system, int_id(_peerid), self._master['IP'], self._master['PORT'])
+        self._logger.debug('(%s) Peer List Reply Received From Master %s, %s:%s', self._system, int_id(_peerid), self._master.ip, self._master.port)
     
     # OUR MASTER HAS ANSWERED OUR REQUEST TO REGISTER - LOTS OF INFORMATION TO TRACK
     def master_reg_reply(self, _data, _peerid):
@@ -504,14 +661,16 @@ class IPSC(DatagramProtocol):
         _decoded_flags = process_flags_bytes(_hex_flags)
         
         self._local['NUM_PEERS'] = int(ahex(_num_peers), 16)
-        self._master['RADIO_ID'] = _peerid
-        self._master['MODE'] = _hex_mode
-        self._master['MODE_DECODE'] = _decoded_mode
-        self._master['FLAGS'] = _hex_flags
-        self._master['FLAGS_DECODE'] = _decoded_flags
-        self._master_stat['CONNECTED'] = True
-        self._master_stat['KEEP_ALIVES_OUTSTANDING'] = 0
-        self._logger.warning('(%s) Registration response (we requested reg) from the Master: %s, %s:%s (%s peers)', self._system, int_id(_peerid), self._master['IP'], self._master['PORT'], self._local['NUM_PEERS'])
+        self._master.radio_id = _peerid
+        self._master.mode = _hex_mode
+        self._master.mode_decode = _decoded_mode
+        self._master.flags = _hex_flags
+        self._master.flags_decode = _decoded_flags
+        self._master_stat.connected = True
+        self._master_stat.keep_alives_outstanding = 0
+        self.update_destinations()
+        self._logger.warning('(%s) Registration response (we requested reg) from the Master: %s, %s:%s (%s peers)', self._system, int_id(_peerid), self._master.ip, self._master.port, self._local['NUM_PEERS'])
+        self.master_connected()
     
     # WE ARE MASTER AND SOMEONE HAS REQUESTED REGISTRATION FROM US - ANSWER IT
     def master_reg_req(self, _data, _peerid, _host, _port):
@@ -528,30 +687,21 @@ class IPSC(DatagramProtocol):
 
         # If this entry was NOT already in our list, add it.
         if _peerid not in self._peers.keys():
-            self._peers[_peerid] = {
-                'IP':          _ip_address, 
-                'PORT':        _port, 
-                'MODE':        _hex_mode,            
-                'MODE_DECODE': _decoded_mode,
-                'FLAGS':       _hex_flags,
-                'FLAGS_DECODE': _decoded_flags,
-                'STATUS': {
-                    'CONNECTED':               True,
-                    'KEEP_ALIVES_SENT':        0,
-                    'KEEP_ALIVES_MISSED':      0,
-                    'KEEP_ALIVES_OUTSTANDING': 0,
-                    'KEEP_ALIVES_RECEIVED':    0,
-                    'KEEP_ALIVE_RX_TIME':      int(time())
-                    }
-                }
+            self._peers[_peerid] = PeerRecord(_ip_address, _port, _hex_mode, _decoded_mode, _hex_flags, _decoded_flags,
+                                              _status = LinkStatus(_connected = True, _keep_alive_rx_time = int(time())))
+            self.update_destinations()
+            self.update_peer_list(_peerid)
+            self.schedule_keep_alive(_peerid)
+            self.peer_added(_peerid)
         self._local['NUM_PEERS'] = len(self._peers)       
         self._logger.debug('(%s) Peer Added To Peer List: %s, %s:%s (IPSC now has %s Peers)', self._system, self._peers[_peerid], _host, _port, self._local['NUM_PEERS'])
     
     # WE ARE MASTER AND SOEMONE SENT US A KEEP-ALIVE - ANSWER IT, TRACK IT
     def master_alive_req(self, _peerid, _host, _port):
         if _peerid in self._peers.keys():
-            self._peers[_peerid]['STATUS']['KEEP_ALIVES_RECEIVED'] += 1
-            self._peers[_peerid]['STATUS']['KEEP_ALIVE_RX_TIME'] = int(time())
+            _status = self._peers[_peerid].status
+            _status.keep_alives_received += 1
+            _status.keep_alive_rx_time = int(time())
             self.send_packet(self.MASTER_ALIVE_REPLY_PKT, (_host, _port))
             self._logger.debug('(%s) Master Keep-Alive Request Received from peer %s, %s:%s', self._system, int_id(_peerid), _host, _port)
         else:
@@ -561,7 +711,7 @@ class IPSC(DatagramProtocol):
     def peer_list_req(self, _peerid):
         if _peerid in self._peers.keys():
             self._logger.debug('(%s) Peer List Request from peer %s', self._system, int_id(_peerid))
-            self.send_to_ipsc(self.PEER_LIST_REPLY_PKT + build_peer_list(self._peers))
+            self.write_to_ipsc(self.peer_list_reply_packet())
         else:
             self._logger.warning('(%s) Peer List Request Received from *UNREGISTERED* peer %s', self._system, int_id(_peerid))
 
@@ -571,10 +721,11 @@ class IPSC(DatagramProtocol):
     #
     def reset_keep_alive(self, _peerid):
         if _peerid in self._peers.keys():
-            self._peers[_peerid]['STATUS']['KEEP_ALIVES_OUTSTANDING'] = 0
-            self._peers[_peerid]['STATUS']['KEEP_ALIVE_RX_TIME'] = int(time())
-        if _peerid == self._master['RADIO_ID']:
-            self._master_stat['KEEP_ALIVES_OUTSTANDING'] = 0
+            _status = self._peers[_peerid].status
+            _status.keep_alives_outstanding = 0
+            _status.keep_alive_rx_time = int(time())
+        if _peerid == self._master.radio_id:
+            self._master_stat.keep_alives_outstanding = 0
 
 
     # THE NEXT SECTION DEFINES FUNCTIONS THAT MUST BE DIFFERENT FOR HASHED AND UNHASHED PACKETS
@@ -586,9 +737,19 @@ class IPSC(DatagramProtocol):
     # Take a packet to be SENT, calculate auth hash and return the whole thing
     #
     def hashed_packet(self, _key, _data):
-        _hash = bhex((hmac_new(_key,_data,sha1)).hexdigest()[:20])
+        if self._local['AUTH_ENABLED'] and _key == self._local['AUTH_KEY']:
+            return self.sign_packet(_data)
+        _hash = hmac_new(_key,_data,sha1).digest()[:10]
         return _data + _hash
     
+    # Same as hashed_packet, but with this IPSC's own key: copy the keyed HMAC context built
+    # in __init__ and use the raw digest (the first 10 bytes are the IPSC auth hash)
+    #
+    def sign_packet(self, _data):
+        _hmac = self._auth_hmac.copy()
+        _hmac.update(_data)
+        return _data + _hmac.digest()[:10]
+    
     # Remove the hash from a packet and return the payload
     #
     def strip_hash(self, _data):
@@ -599,9 +760,13 @@ class IPSC(DatagramProtocol):
     def validate_auth(self, _key, _data):
         _payload = self.strip_hash(_data)
         _hash = _data[-10:]
-        _chk_hash = bhex((hmac_new(_key,_payload,sha1)).hexdigest()[:20])   
+        if self._local['AUTH_ENABLED'] and _key == self._local['AUTH_KEY']:
+            _hmac = self._auth_hmac.copy()
+            _hmac.update(_payload)
+        else:
+            _hmac = hmac_new(_key,_payload,sha1)
 
-        if _chk_hash == _hash:
+        if _hmac.digest()[:10] == _hash:
             return True
         else:
             return False
@@ -618,136 +783,273 @@ class IPSC(DatagramProtocol):
         #   IPSC connection establishment and maintenance
         #   Reporting/Housekeeping
         #
+        self.start_multi_sender()
+        #
         # IF WE'RE NOT THE MASTER...
         if not self._local['MASTER_PEER']:
             self._peer_maintenance = task.LoopingCall(self.peer_maintenance_loop)
             self._peer_maintenance_loop = self._peer_maintenance.start(self._local['ALIVE_TIMER'])
         #
-        # IF WE ARE THE MASTER...
+        # Peer keep-alives (or, as the master, peer time-outs) are run from the timer wheel
+        self._keep_alive_timer = task.LoopingCall(self.keep_alive_loop)
+        self._keep_alive_timer_loop = self._keep_alive_timer.start(KEEP_ALIVE_TICK)
+
+    # Put _peerid on the keep-alive timer wheel: as a peer, for its first keep-alive (or registration)
+    # at a random point in the next ALIVE_TIMER seconds, so a big peer list doesn't all go out in one
+    # burst; as the master, to check whether it has timed out.
+    #
+    def schedule_keep_alive(self, _peerid, _now = None):
+        if _now is None:
+            _now = time()
         if self._local['MASTER_PEER']:
-            self._master_maintenance = task.LoopingCall(self.master_maintenance_loop)
-            self._master_maintenance_loop = self._master_maintenance.start(self._local['ALIVE_TIMER'])
+            self._keep_alives.schedule(_peerid, self._peers[_peerid].status.keep_alive_rx_time + PEER_TIMEOUT + 1)
+        else:
+            self._keep_alives.schedule(_peerid, _now + uniform(0, self._local['ALIVE_TIMER']))
 
+    # Timed loop that runs the keep-alive timer wheel, every KEEP_ALIVE_TICK seconds. Only the peers
+    # whose deadlines have come up are looked at. _now is only for testing and simulation.
+    #
+    def keep_alive_loop(self, _now = None):
+        if _now is None:
+            _now = time()
+        _due = self._keep_alives.advance(_now)
+        if not _due:
+            return
+        
+        if self._local['MASTER_PEER']:
+            _timed_out = False
+            for peer in _due:
+                _timed_out |= self.peer_time_out(peer, _now)
+            # Tell the remaining peers, once, no matter how many timed out
+            if _timed_out:
+                self.write_to_ipsc(self.peer_list_reply_packet())
+        else:
+            _debug = self._logger.isEnabledFor(logging.DEBUG)
+            for peer in _due:
+                self.peer_keep_alive(peer, _now, _debug)
     
-    # Timed loop used for IPSC connection Maintenance when we are the MASTER
-    #    
-    def master_maintenance_loop(self):
-        self._logger.debug('(%s) MASTER Connection Maintenance Loop Started', self._system)
-        update_time = int(time())
+    # As the MASTER: de-register _peerid if we haven't heard from it in PEER_TIMEOUT seconds,
+    # otherwise check again when it would. Returns True if it was de-registered.
+    #
+    def peer_time_out(self, _peerid, _now):
+        _peer = self._peers.get(_peerid)
+        if _peer is None:
+            return False
+        _deadline = _peer.status.keep_alive_rx_time + PEER_TIMEOUT
+        if _now <= _deadline:
+            self._keep_alives.schedule(_peerid, _deadline + 1)
+            return False
+        self.de_register_peer(_peerid)
+        self._logger.warning('(%s) Timeout Exceeded for Peer %s, De-registering', self._system, int_id(_peerid))
+        return True
+    
+    # As a PEER: register with, or send a keep-alive to, _peerid and schedule the next one
+    # ALIVE_TIMER seconds later (give or take KEEP_ALIVE_JITTER, so they stay spread out).
+    #
+    def peer_keep_alive(self, _peerid, _now, _debug = True):
+        _peer = self._peers.get(_peerid)
+        # We will show up in the peer list, but shouldn't try to talk to ourselves.
+        if _peer is None or _peerid == self._local_id:
+            return
+        self._keep_alives.schedule(_peerid, _now + self._local['ALIVE_TIMER'] * uniform(1 - KEEP_ALIVE_JITTER, 1 + KEEP_ALIVE_JITTER))
         
-        for peer in self._peers.keys():
-            keep_alive_delta = update_time - self._peers[peer]['STATUS']['KEEP_ALIVE_RX_TIME']
-            self._logger.debug('(%s) Time Since Last KeepAlive Request from Peer %s: %s seconds', self._system, int_id(peer), keep_alive_delta)
-          
-            if keep_alive_delta > 120:
-                self.de_register_peer(peer)
-                self.send_to_ipsc(self.PEER_LIST_REPLY_PKT + build_peer_list(self._peers))
-                self._logger.warning('(%s) Timeout Exceeded for Peer %s, De-registering', self._system, int_id(peer))
-    
-    # Timed loop used for IPSC connection Maintenance when we are a PEER
+        # We can't do anything with peers until we have the peer list
+        if not self._master_stat.peer_list:
+            return
+        
+        _status = _peer.status
+
+        # If we haven't registered to a peer, send a registration
+        if not _status.connected:
+            self.send_packet(self.PEER_REG_REQ_PKT, (_peer.ip, _peer.port))
+            self._logger.info('(%s) Registering with Peer %s, %s:%s', self._system, int_id(_peerid), _peer.ip, _peer.port)
+
+        # If we have registered with the peer, then send a keep-alive
+        else:
+            self.send_packet(self.PEER_ALIVE_REQ_PKT, (_peer.ip, _peer.port))
+            if _debug:
+                self._logger.debug('(%s) Keep-Alive Sent to the Peer %s, %s:%s', self._system, int_id(_peerid), _peer.ip, _peer.port)
+
+            # If we have a keep-alive outstanding by the time we send another, mark it missed.
+            if _status.keep_alives_outstanding > 0:
+                _status.keep_alives_missed += 1
+                self._logger.info('(%s) Peer Keep-Alive Missed for %s, %s:%s', self._system, int_id(_peerid), _peer.ip, _peer.port)
+
+            # If we have missed too many keep-alives, de-register the peer and start over.
+            if _status.keep_alives_outstanding >= self._local['MAX_MISSED']:
+                _status.connected = False
+                self.update_destinations()
+                self._logger.warning('(%s) Maximum Peer Keep-Alives Missed -- De-registering the Peer: %s, %s:%s', self._system, int_id(_peerid), _peer.ip, _peer.port)
+            
+            # Update our stats before moving on...
+            _status.keep_alives_sent += 1
+            _status.keep_alives_outstanding += 1
+    
+    # Timed loop used for IPSC connection Maintenance with the MASTER when we are a PEER
+    # (keep-alives to the other peers are done by keep_alive_loop)
     #
     def peer_maintenance_loop(self):
         self._logger.debug('(%s) PEER Connection Maintenance Loop Started', self._system)
 
         # If the master isn't connected, we have to do that before we can do anything else!
         #
-        if not self._master_stat['CONNECTED']:
+        if not self._master_stat.connected:
             self.send_packet(self.MASTER_REG_REQ_PKT, self._master_sock)
-            self._logger.info('(%s) Registering with the Master: %s:%s', self._system, self._master['IP'], self._master['PORT'])
+            self._logger.info('(%s) Registering with the Master: %s:%s', self._system, self._master.ip, self._master.port)
         
         # Once the master is connected, we have to send keep-alives.. and make sure we get them back
-        elif self._master_stat['CONNECTED']:
+        elif self._master_stat.connected:
             # Send keep-alive to the master
             self.send_packet(self.MASTER_ALIVE_PKT, self._master_sock)
-            self._logger.debug('(%s) Keep Alive Sent to the Master: %s, %s:%s', self._system, int_id(self._master['RADIO_ID']) ,self._master['IP'], self._master['PORT'])
+            self._logger.debug('(%s) Keep Alive Sent to the Master: %s, %s:%s', self._system, int_id(self._master.radio_id) ,self._master.ip, self._master.port)
             
             # If we had a keep-alive outstanding by the time we send another, mark it missed.
-            if (self._master_stat['KEEP_ALIVES_OUTSTANDING']) > 0:
-                self._master_stat['KEEP_ALIVES_MISSED'] += 1
-                self._logger.info('(%s) Master Keep-Alive Missed: %s:%s', self._system, self._master['IP'], self._master['PORT'])
+            if (self._master_stat.keep_alives_outstanding) > 0:
+                self._master_stat.keep_alives_missed += 1
+                self._logger.info('(%s) Master Keep-Alive Missed: %s:%s', self._system, self._master.ip, self._master.port)
             
             # If we have missed too many keep-alives, de-register the master and start over.
-            if self._master_stat['KEEP_ALIVES_OUTSTANDING'] >= self._local['MAX_MISSED']:
-                self._master_stat['CONNECTED'] = False
-                self._master_stat['KEEP_ALIVES_OUTSTANDING'] = 0
-                self._logger.error('(%s) Maximum Master Keep-Alives Missed -- De-registering the Master: %s:%s', self._system, self._master['IP'], self._master['PORT'])
+            if self._master_stat.keep_alives_outstanding >= self._local['MAX_MISSED']:
+                self._master_stat.connected = False
+                self._master_stat.keep_alives_outstanding = 0
+                self.update_destinations()
+                self._logger.error('(%s) Maximum Master Keep-Alives Missed -- De-registering the Master: %s:%s', self._system, self._master.ip, self._master.port)
+                self.master_disconnected()
             
             # Update our stats before we move on...
-            self._master_stat['KEEP_ALIVES_SENT'] += 1
-            self._master_stat['KEEP_ALIVES_OUTSTANDING'] += 1
+            self._master_stat.keep_alives_sent += 1
+            self._master_stat.keep_alives_outstanding += 1
             
         else:
             # This is bad. If we get this message, we need to reset the state and try again
             self._logger.error('->> (%s) Master in UNKOWN STATE: %s:%s', self._system, self._master_sock)
-            self._master_stat['CONNECTED'] = False
+            self._master_stat.connected = False
+            self.update_destinations()
+            self.master_disconnected()
         
         
         # If the master is connected and we don't have a peer-list yet....
         #
-        if (self._master_stat['CONNECTED'] == True) and (self._master_stat['PEER_LIST'] == False):
+        if (self._master_stat.connected == True) and (self._master_stat.peer_list == False):
             # Ask the master for a peer-list
             if self._local['NUM_PEERS']:
                 self.send_packet(self.PEER_LIST_REQ_PKT, self._master_sock)
                 self._logger.info('(%s), No Peer List - Requesting One From the Master', self._system)
             else:
-                self._master_stat['PEER_LIST'] = True
+                self._master_stat.peer_list = True
                 self._logger.debug('(%s), Skip asking for a Peer List, we are the only Peer', self._system)
 
 
-        # If we do have a peer-list, we need to register with the peers and send keep-alives...
-        #
-        if self._master_stat['PEER_LIST']:
-            # Iterate the list of peers... so we do this for each one.
-            for peer in self._peers.keys():
-
-                # We will show up in the peer list, but shouldn't try to talk to ourselves.
-                if peer == self._local_id:
-                    continue
-
-                # If we haven't registered to a peer, send a registration
-                if not self._peers[peer]['STATUS']['CONNECTED']:
-                    self.send_packet(self.PEER_REG_REQ_PKT, (self._peers[peer]['IP'], self._peers[peer]['PORT']))
-                    self._logger.info('(%s) Registering with Peer %s, %s:%s', self._system, int_id(peer), self._peers[peer]['IP'], self._peers[peer]['PORT'])
-
-                # If we have registered with the peer, then send a keep-alive
-                elif self._peers[peer]['STATUS']['CONNECTED']:
-                    self.send_packet(self.PEER_ALIVE_REQ_PKT, (self._peers[peer]['IP'], self._peers[peer]['PORT']))
-                    self._logger.debug('(%s) Keep-Alive Sent to the Peer %s, %s:%s', self._system, int_id(peer), self._peers[peer]['IP'], self._peers[peer]['PORT'])
-
-                    # If we have a keep-alive outstanding by the time we send another, mark it missed.
-                    if self._peers[peer]['STATUS']['KEEP_ALIVES_OUTSTANDING'] > 0:
-                        self._peers[peer]['STATUS']['KEEP_ALIVES_MISSED'] += 1
-                        self._logger.info('(%s) Peer Keep-Alive Missed for %s, %s:%s', self._system, int_id(peer), self._peers[peer]['IP'], self._peers[peer]['PORT'])
-
-                    # If we have missed too many keep-alives, de-register the peer and start over.
-                    if self._peers[peer]['STATUS']['KEEP_ALIVES_OUTSTANDING'] >= self._local['MAX_MISSED']:
-                        self._peers[peer]['STATUS']['CONNECTED'] = False
-                        #del peer   # Becuase once it's out of the dictionary, you can't use it for anything else.
-                        self._logger.warning('(%s) Maximum Peer Keep-Alives Missed -- De-registering the Peer: %s, %s:%s', self._system, int_id(peer), self._peers[peer]['IP'], self._peers[peer]['PORT'])
-                    
-                    # Update our stats before moving on...
-                    self._peers[peer]['STATUS']['KEEP_ALIVES_SENT'] += 1
-                    self._peers[peer]['STATUS']['KEEP_ALIVES_OUTSTANDING'] += 1
-    
-
-
     #************************************************
     #     MESSAGE RECEIVED - TAKE ACTION
     #************************************************
 
+    # Build the packet dispatch table for this IPSC instance. Each known packet type byte maps
+    # to a tuple of (validation policy, error message, handler) so datagramReceived does one
+    # dictionary lookup instead of walking the type lists and the if/elif chain on every packet.
+    #
+    # Validation policies are called with the peer ID and return True if the packet is accepted,
+    # None means no validation is done. Handlers all take (data, peerid, host, port).
+    #
+    def build_dispatch(self):
+        _peer_error   = '(%s) PeerError: Peer not in peer-list: %s, %s:%s'
+        _master_error = '(%s) MasterError: %s, %s:%s is not the master peer'
+        
+        self._dispatch = {
+            # ORIGINATED BY SUBSCRIBER UNITS - a.k.a someone transmitted
+            GROUP_VOICE:        (self.valid_any_peer, _peer_error, self.user_packet_handler(self.group_voice)),
+            PVT_VOICE:          (self.valid_any_peer, _peer_error, self.user_packet_handler(self.private_voice)),
+            GROUP_DATA:         (self.valid_any_peer, _peer_error, self.user_packet_handler(self.group_data)),
+            PVT_DATA:           (self.valid_any_peer, _peer_error, self.user_packet_handler(self.private_data)),
+            
+            # MOTOROLA XCMP/XNL CONTROL PROTOCOL: We don't process these (yet)
+            XCMP_XNL:           (self.valid_any_peer, _peer_error, lambda _data, _peerid, _host, _port: self.xcmp_xnl(_data)),
+            
+            # ORIGINATED BY PEERS, NOT IPSC MAINTENANCE: Call monitoring is all we've found here so far
+            CALL_MON_STATUS:    (self.valid_any_peer, _peer_error, lambda _data, _peerid, _host, _port: self.call_mon_status(_data)),
+            CALL_MON_RPT:       (self.valid_any_peer, _peer_error, lambda _data, _peerid, _host, _port: self.call_mon_rpt(_data)),
+            CALL_MON_NACK:      (self.valid_any_peer, _peer_error, lambda _data, _peerid, _host, _port: self.call_mon_nack(_data)),
+            
+            # IPSC CONNECTION MAINTENANCE MESSAGES
+            DE_REG_REQ:         (self.valid_any_peer, _peer_error, self.de_reg_req),
+            DE_REG_REPLY:       (self.valid_any_peer, _peer_error, self.de_reg_reply),
+            RPT_WAKE_UP:        (self.valid_any_peer, _peer_error, self.rpt_wake_up),
+            
+            # THE FOLLOWING PACKETS ARE RECEIVED ONLY IF WE ARE OPERATING AS A PEER
+            # REQUESTS FROM PEERS: WE MUST REPLY IMMEDIATELY FOR IPSC MAINTENANCE
+            PEER_ALIVE_REQ:     (self.valid_peer, _peer_error, lambda _data, _peerid, _host, _port: self.peer_alive_req(_data, _peerid, _host, _port)),
+            PEER_REG_REQ:       (self.valid_peer, _peer_error, lambda _data, _peerid, _host, _port: self.peer_reg_req(_peerid, _host, _port)),
+            
+            # ANSWERS FROM REQUESTS WE SENT TO PEERS: WE DO NOT REPLY
+            PEER_ALIVE_REPLY:   (self.valid_peer, _peer_error, lambda _data, _peerid, _host, _port: self.peer_alive_reply(_peerid)),
+            PEER_REG_REPLY:     (self.valid_peer, _peer_error, lambda _data, _peerid, _host, _port: self.peer_reg_reply(_peerid)),
+            
+            # ANSWERS FROM REQUESTS WE SENT TO THE MASTER: WE DO NOT REPLY
+            MASTER_ALIVE_REPLY: (self.valid_master, _master_error, lambda _data, _peerid, _host, _port: self.master_alive_reply(_peerid)),
+            PEER_LIST_REPLY:    (self.valid_master, _master_error, lambda _data, _peerid, _host, _port: self.peer_list_reply(_data, _peerid)),
+            
+            # THIS MEANS WE HAVE SUCCESSFULLY REGISTERED TO OUR MASTER - RECORD MASTER INFORMATION
+            MASTER_REG_REPLY:   (None, None, lambda _data, _peerid, _host, _port: self.master_reg_reply(_data, _peerid)),
+            
+            # THE FOLLOWING PACKETS ARE RECEIVED ONLLY IF WE ARE OPERATING AS A MASTER
+            # REQUESTS FROM PEERS: WE MUST REPLY IMMEDIATELY FOR IPSC MAINTENANCE
+            MASTER_REG_REQ:     (None, None, lambda _data, _peerid, _host, _port: self.master_reg_req(_data, _peerid, _host, _port)),
+            MASTER_ALIVE_REQ:   (None, None, lambda _data, _peerid, _host, _port: self.master_alive_req(_peerid, _host, _port)),
+            PEER_LIST_REQ:      (None, None, lambda _data, _peerid, _host, _port: self.peer_list_req(_peerid))
+        }
+        
+        # PACKET IS OF AN UNKNOWN TYPE. LOG IT AND IDENTTIFY IT!
+        self._dispatch_default = (None, None, lambda _data, _peerid, _host, _port: self.unknown_message(_data[0:1], _peerid, _data))
+    
+    # Wrap one of the user packet callbacks (group_voice, private_voice, etc.) so it can be
+    # called from the dispatch table. The IPSC header fields are extracted here.
+    #
+    def user_packet_handler(self, _callback):
+        _reset_keep_alive = self.reset_keep_alive
+        
+        def handler(_data, _peerid, _host, _port):
+            # Extract IPSC header not already extracted
+            _call_info = ord(_data[17])
+            _ts        = bool(_call_info & TS_CALL_MSK) + 1
+            _end       = bool(_call_info & END_MSK)
+            
+            _reset_keep_alive(_peerid)
+            _callback(_data[6:9], _data[9:12], _ts, _end, _peerid, _data)
+        return handler
+    
+    # The IPSCPacketView of a user packet, for callbacks that need more of it than the arguments
+    # they're given. It's made the first time it's asked for, and asking again for the same packet
+    # returns the same view, so each part of a packet is only ever unpacked once.
+    #
+    def packet_view(self, _data):
+        _packet = self._packet_view
+        if _packet is None or _packet.data is not _data:
+            _packet = self._packet_view = IPSCPacketView(_data)
+        return _packet
+    
+    def de_reg_req(self, _data, _peerid, _host, _port):
+        self.de_register_peer(_peerid)
+        self._logger.warning('(%s) Peer De-Registration Request From: %s, %s:%s', self._system, int_id(_peerid), _host, _port)
+    
+    def de_reg_reply(self, _data, _peerid, _host, _port):
+        self._logger.warning('(%s) Peer De-Registration Reply From: %s, %s:%s', self._system, int_id(_peerid), _host, _port)
+    
+    def rpt_wake_up(self, _data, _peerid, _host, _port):
+        self.repeater_wake_up(_data)
+        self._logger.debug('(%s) Repeater Wake-Up Packet From: %s, %s:%s', self._system, int_id(_peerid), _host, _port)
+    
+    
     # Actions for received packets by type: For every packet received, there are some things that we need to do:
     #   Decode some of the info
     #   Check for auth and authenticate the packet
     #   Strip the hash from the end... we don't need it anymore
     #
-    # Once they're done, we move on to the processing or callbacks for each packet type.
-    #
-    # Callbacks are iterated in the order of "more likely" to "less likely" to reduce processing time
+    # Once they're done, we look up the packet type in the dispatch table built by build_dispatch,
+    # validate the sender according to the policy for that type and call the handler.
     #
     def datagramReceived(self, data, (host, port)):
         _packettype = data[0:1]
         _peerid     = data[1:5]
-        _ipsc_seq   = data[5:6]
     
         # AUTHENTICATE THE PACKET
         if self._local['AUTH_ENABLED']:
@@ -759,172 +1061,13 @@ class IPSC(DatagramProtocol):
             else:
                 data = self.strip_hash(data)
 
-        # PACKETS THAT WE RECEIVE FROM ANY VALID PEER OR VALID MASTER
-        if _packettype in ANY_PEER_REQUIRED:
-            if not(self.valid_master(_peerid) == False or self.valid_peer(_peerid) == False):
-                self._logger.warning('(%s) PeerError: Peer not in peer-list: %s, %s:%s', self._system, int_id(_peerid), host, port)
-                return
-                
-            # ORIGINATED BY SUBSCRIBER UNITS - a.k.a someone transmitted
-            if _packettype in USER_PACKETS:
-                # Extract IPSC header not already extracted
-                _src_sub    = data[6:9]
-                _dst_sub    = data[9:12]
-                _call_type  = data[12:13]
-                _unknown_1  = data[13:17]
-                _call_info  = int_id(data[17:18])                
-                _ts         = bool(_call_info & TS_CALL_MSK) + 1
-                _end        = bool(_call_info & END_MSK)
-                
-                # Extract RTP Header Fields
-                '''
-                Coming soon kids!!!
-                Looks like version, padding, extention, CSIC, payload type and SSID never change.
-                The things we might care about are below.
-                _rtp_byte_1 = int_id(data[18:19])
-                _rtp_byte_2 = int_id(data[19:20])
-                _rtp_seq    = int_id(data[20:22])
-                _rtp_tmstmp = int_id(data[22:26])
-                _rtp_ssid = int_id(data[26:30])
-                
-                # Extract RTP Payload Data Fields
-                _payload_type = int_id(data[30:31])
-                '''
-
-                # User Voice and Data Call Types:
-                if _packettype == GROUP_VOICE:
-                    self.reset_keep_alive(_peerid)
-                    self.group_voice(_src_sub, _dst_sub, _ts, _end, _peerid, data)
-                    return
-            
-                elif _packettype == PVT_VOICE:
-                    self.reset_keep_alive(_peerid)
-                    self.private_voice(_src_sub, _dst_sub, _ts, _end, _peerid, data)
-                    return
-                    
-                elif _packettype == GROUP_DATA:
-                    self.reset_keep_alive(_peerid)
-                    self.group_data(_src_sub, _dst_sub, _ts, _end, _peerid, data)
-                    return
-                    
-                elif _packettype == PVT_DATA:
-                    self.reset_keep_alive(_peerid)
-                    self.private_data(_src_sub, _dst_sub, _ts, _end, _peerid, data)
-                    return
-                return
-
-
-            # MOTOROLA XCMP/XNL CONTROL PROTOCOL: We don't process these (yet)   
-            elif _packettype == XCMP_XNL:
-                self.xcmp_xnl(data)
-                return
-
-
-            # ORIGINATED BY PEERS, NOT IPSC MAINTENANCE: Call monitoring is all we've found here so far 
-            elif _packettype == CALL_MON_STATUS:
-                self.call_mon_status(data)
-                return
-                
-            elif _packettype == CALL_MON_RPT:
-                self.call_mon_rpt(data)
-                return
-                
-            elif _packettype == CALL_MON_NACK:
-                self.call_mon_nack(data)
-                return
-            
-            
-            # IPSC CONNECTION MAINTENANCE MESSAGES
-            elif _packettype == DE_REG_REQ:
-                self.de_register_peer(_peerid)
-                self._logger.warning('(%s) Peer De-Registration Request From: %s, %s:%s', self._system, int_id(_peerid), host, port)
-                return
-            
-            elif _packettype == DE_REG_REPLY:
-                self._logger.warning('(%s) Peer De-Registration Reply From: %s, %s:%s', self._system, int_id(_peerid), host, port)
-                return
-                
-            elif _packettype == RPT_WAKE_UP:
-                self.repeater_wake_up(data)
-                self._logger.debug('(%s) Repeater Wake-Up Packet From: %s, %s:%s', self._system, int_id(_peerid), host, port)
-                return
-            return
-
-
-        # THE FOLLOWING PACKETS ARE RECEIVED ONLY IF WE ARE OPERATING AS A PEER
+        _valid, _error, _handler = self._dispatch.get(_packettype, self._dispatch_default)
         
-        # ONLY ACCEPT FROM A PREVIOUSLY VALIDATED PEER
-        if _packettype in PEER_REQUIRED:
-            if not self.valid_peer(_peerid):
-                self._logger.warning('(%s) PeerError: Peer not in peer-list: %s, %s:%s', self._system, int_id(_peerid), host, port)
-                return
-            
-            # REQUESTS FROM PEERS: WE MUST REPLY IMMEDIATELY FOR IPSC MAINTENANCE
-            if _packettype == PEER_ALIVE_REQ:
-                self.peer_alive_req(data, _peerid, host, port)
-                return
-                                
-            elif _packettype == PEER_REG_REQ:
-                self.peer_reg_req(_peerid, host, port)
-                return
-                
-            # ANSWERS FROM REQUESTS WE SENT TO PEERS: WE DO NOT REPLY
-            elif _packettype == PEER_ALIVE_REPLY:
-                self.peer_alive_reply(_peerid)
-                return                
-
-            elif _packettype == PEER_REG_REPLY:
-                self.peer_reg_reply(_peerid)
-                return
+        if _valid is not None and not _valid(_peerid):
+            self._logger.warning(_error, self._system, int_id(_peerid), host, port)
             return
-            
         
-        # PACKETS ONLY ACCEPTED FROM OUR MASTER
-
-        # PACKETS WE ONLY ACCEPT IF WE HAVE FINISHED REGISTERING WITH OUR MASTER
-        if _packettype in MASTER_REQUIRED:
-            if not self.valid_master(_peerid):
-                self._logger.warning('(%s) MasterError: %s, %s:%s is not the master peer', self._system, int_id(_peerid), host, port)
-                return
-            
-            # ANSWERS FROM REQUESTS WE SENT TO THE MASTER: WE DO NOT REPLY    
-            if _packettype == MASTER_ALIVE_REPLY:
-                self.master_alive_reply(_peerid)
-                return
-            
-            elif _packettype == PEER_LIST_REPLY:
-                self.peer_list_reply(data, _peerid)
-                return
-            return
-            
-        # THIS MEANS WE HAVE SUCCESSFULLY REGISTERED TO OUR MASTER - RECORD MASTER INFORMATION
-        elif _packettype == MASTER_REG_REPLY:
-            self.master_reg_reply(data, _peerid)
-            return
-        
-        
-        # THE FOLLOWING PACKETS ARE RECEIVED ONLLY IF WE ARE OPERATING AS A MASTER
-        # REQUESTS FROM PEERS: WE MUST REPLY IMMEDIATELY FOR IPSC MAINTENANCE
-        
-        # REQUEST TO REGISTER TO THE IPSC
-        elif _packettype == MASTER_REG_REQ:
-            self.master_reg_req(data, _peerid, host, port)           
-            return
-          
-        # REQUEST FOR A KEEP-ALIVE REPLY (WE KNOW THE PEER IS STILL ALIVE TOO) 
-        elif _packettype == MASTER_ALIVE_REQ:
-            self.master_alive_req(_peerid, host, port)
-            return
-            
-        # REQUEST FOR A PEER LIST
-        elif _packettype == PEER_LIST_REQ:
-            self.peer_list_req(_peerid)
-            return
-
-        # PACKET IS OF AN UNKNOWN TYPE. LOG IT AND IDENTTIFY IT!
-        else:
-            self.unknown_message(self._system, _packettype, _peerid, data)
-            return
+        _handler(data, _peerid, host, port)
 
     
 
@@ -23,6 +23,8 @@ import sys
 
 from socket import gethostbyname 
 
+from ipsc.peer_record import PeerRecord
+
 # Does anybody read this stuff? There's a PEP somewhere that says I should do this.
 __author__     = 'Cortney T. Buffington, N0MJS'
 __copyright__  = 'Copyright (c) 2016 Cortney T. Buffington, N0MJS and the K0USY Group'
@@ -117,29 +119,14 @@ def build_config(_config_file):
                     'NUM_PEERS': 0,
                     })
                 # Master means things we need to know about the master peer of the network
-                CONFIG['SYSTEMS'][section]['MASTER'].update({
-                    'RADIO_ID': '\x00\x00\x00\x00',
-                    'MODE': '\x00',
-                    'MODE_DECODE': '',
-                    'FLAGS': '\x00\x00\x00\x00',
-                    'FLAGS_DECODE': '',
-                    'STATUS': {
-                        'CONNECTED':               False,
-                        'PEER_LIST':               False,
-                        'KEEP_ALIVES_SENT':        0,
-                        'KEEP_ALIVES_MISSED':      0,
-                        'KEEP_ALIVES_OUTSTANDING': 0,
-                        'KEEP_ALIVES_RECEIVED':    0,
-                        'KEEP_ALIVE_RX_TIME':      0
-                        },
-                    'IP': '',
-                    'PORT': ''
-                    })
+                CONFIG['SYSTEMS'][section]['MASTER'] = PeerRecord(
+                    _radio_id = '\x00\x00\x00\x00',
+                    _mode = '\x00',
+                    _flags = '\x00\x00\x00\x00'
+                    )
                 if not CONFIG['SYSTEMS'][section]['LOCAL']['MASTER_PEER']:
-                    CONFIG['SYSTEMS'][section]['MASTER'].update({
-                        'IP': gethostbyname(config.get(section, 'MASTER_IP')),
-                        'PORT': config.getint(section, 'MASTER_PORT')
-                    })
+                    CONFIG['SYSTEMS'][section]['MASTER'].ip = gethostbyname(config.get(section, 'MASTER_IP'))
+                    CONFIG['SYSTEMS'][section]['MASTER'].port = config.getint(section, 'MASTER_PORT')
             
                 # Temporary locations for building MODE and FLAG data
                 MODE_BYTE = 0
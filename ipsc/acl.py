@@ -0,0 +1,94 @@
+# Copyright (c) 2016 Cortney T. Buffington, N0MJS and the K0USY Group. n0mjs@me.com
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike
+# 3.0 Unported License.To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-sa/3.0/ or send a letter to
+# Creative Commons, 444 Castro Street, Suite 900, Mountain View,
+# California, 94041, USA.
+
+# Subscriber access control lists, as used by bridge.py and confbridge.py.
+#
+# DMR subscriber IDs are 24 bits, so an ACL is compiled into a bitmap with one
+# bit for every possible ID (2 MB). Checking an ID is then one lookup, however
+# many IDs or ranges are in the list. An ACL is made from:
+#
+#   _action     'PERMIT' (only the IDs listed are allowed), 'DENY' (the IDs
+#               listed are not) or 'NONE' (everyone is allowed)
+#   _entries    subscriber IDs (integers) and/or inclusive ranges of them as
+#               (first, last) tuples, e.g. [1234001, (3100000, 3199999)]
+#   _systems    optional ACLs for calls from one IPSC system, or one timeslot
+#               of it: {'SYSTEM': (_action, _entries), ('SYSTEM', TS): ...}
+#
+# A call must pass every ACL that applies to it: the global one, then the one
+# for the system it came from and the one for that system and timeslot.
+
+MAX_ID = 0xFFFFFF
+
+
+# Make the bitmap for a list of IDs and ranges. Raises ValueError for anything
+# that isn't a subscriber ID.
+#
+def make_bitmap(_entries):
+    _bitmap = bytearray((MAX_ID >> 3) + 1)
+    for _entry in _entries:
+        if isinstance(_entry, (tuple, list)):
+            if len(_entry) != 2:
+                raise ValueError('ACL ranges must be (first, last): {!r}'.format(_entry))
+            _first, _last = _entry
+        else:
+            _first = _last = _entry
+        if not isinstance(_first, (int, long)) or not isinstance(_last, (int, long)) or not 0 <= _first <= _last <= MAX_ID:
+            raise ValueError('Not a subscriber ID or range of them: {!r}'.format(_entry))
+
+        # Odd bits at the start and end of the range, then whole bytes in between
+        while _first <= _last and _first & 7:
+            _bitmap[_first >> 3] |= 1 << (_first & 7)
+            _first += 1
+        while _last >= _first and (_last & 7) != 7:
+            _bitmap[_last >> 3] |= 1 << (_last & 7)
+            _last -= 1
+        if _first < _last:
+            _bitmap[_first >> 3:(_last >> 3) + 1] = '\xff' * ((_last >> 3) - (_first >> 3) + 1)
+    return _bitmap
+
+
+class SubscriberACL(object):
+    def __init__(self, _action = 'NONE', _entries = (), _systems = None):
+        self._global = self._compile(_action, _entries)
+        self._systems = {}
+        for _key, (_system_action, _system_entries) in (_systems or {}).items():
+            try:
+                _acl = self._compile(_system_action, _system_entries)
+            except ValueError as e:
+                raise ValueError('ACL for {}: {}'.format(_key, e))
+            if _acl:
+                self._systems[_key] = _acl
+
+    # (True if PERMIT, bitmap) -- or None for an ACL that allows everyone. Raises ValueError
+    # for any other action, rather than taking a typo to mean everyone is allowed.
+    @staticmethod
+    def _compile(_action, _entries):
+        if _action == 'PERMIT':
+            return (True, make_bitmap(_entries))
+        elif _action == 'DENY':
+            return (False, make_bitmap(_entries))
+        elif _action == 'NONE':
+            return None
+        raise ValueError('ACL_ACTION must be PERMIT, DENY or NONE: {!r}'.format(_action))
+
+    # True if subscriber _sub (3 bytes, as in the packet) may make a call from timeslot
+    # _ts of IPSC _system
+    #
+    def allow(self, _sub, _system = None, _ts = None):
+        _id = (ord(_sub[0]) << 16) | (ord(_sub[1]) << 8) | ord(_sub[2])
+        _byte, _bit = _id >> 3, 1 << (_id & 7)
+
+        _acl = self._global
+        if _acl and bool(_acl[1][_byte] & _bit) != _acl[0]:
+            return False
+        if self._systems:
+            for _key in (_system, (_system, _ts)):
+                _acl = self._systems.get(_key)
+                if _acl and bool(_acl[1][_byte] & _bit) != _acl[0]:
+                    return False
+        return True
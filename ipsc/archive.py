@@ -0,0 +1,124 @@
+# Copyright (c) 2016 Cortney T. Buffington, N0MJS and the K0USY Group. n0mjs@me.com
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike
+# 3.0 Unported License.To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-sa/3.0/ or send a letter to
+# Creative Commons, 444 Castro Street, Suite 900, Mountain View,
+# California, 94041, USA.
+
+# An index of recorded calls (see recorder.py), so they can be found by time,
+# talkgroup, subscriber or system without opening every recording.
+#
+# The index is an SQLite database with a row per call: when it started and how
+# long it lasted, where it came from and went to, where it is -- the recording,
+# the byte offset of its first record and the number of bytes -- and how many
+# bursts it has and how many were lost (gaps in the RTP sequence numbers) or
+# arrived late (out of order or repeated). A row is added as each call is
+# finished, by the RecordWriter's thread, and the lookups the query tool makes
+# are all covered by an index on the table.
+#
+# A CallIndex opens its database the first time it is used, from whichever
+# thread that is, and must only be used from that thread afterwards.
+
+import sqlite3
+from mmap import mmap, ACCESS_READ
+
+
+# The columns, in order, and how they are stored
+COLUMNS = (
+    ('START',    'REAL'),       # time the call started (seconds since the epoch)
+    ('DURATION', 'REAL'),       # seconds from the first burst to the last
+    ('SYSTEM',   'TEXT'),
+    ('TS',       'INTEGER'),
+    ('TYPE',     'TEXT'),       # 'g'roup or 'p'rivate
+    ('SRC',      'INTEGER'),
+    ('DST',      'INTEGER'),
+    ('PATH',     'TEXT'),       # the recording...
+    ('OFFSET',   'INTEGER'),    # ...where in it the call starts
+    ('LENGTH',   'INTEGER'),    # ...and how many bytes it takes
+    ('BURSTS',   'INTEGER'),
+    ('LOST',     'INTEGER'),
+    ('LATE',     'INTEGER')
+)
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS calls ({})'.format(', '.join('{} {}'.format(_name.lower(), _type) for _name, _type in COLUMNS)),
+    'CREATE INDEX IF NOT EXISTS calls_start ON calls (start)',
+    'CREATE INDEX IF NOT EXISTS calls_dst ON calls (dst, start)',
+    'CREATE INDEX IF NOT EXISTS calls_src ON calls (src, start)',
+    'CREATE INDEX IF NOT EXISTS calls_system ON calls (system, start)'
+)
+
+_INSERT = 'INSERT INTO calls VALUES ({})'.format(', '.join('?' * len(COLUMNS)))
+_SELECT = 'SELECT {} FROM calls'.format(', '.join(_name.lower() for _name, _type in COLUMNS))
+
+
+class CallIndex(object):
+    def __init__(self, _path):
+        self._path = _path
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self._path)
+            for _statement in SCHEMA:
+                self._db.execute(_statement)
+            self._db.commit()
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    # Add a call: _call is a dictionary with (at least) the keys in COLUMNS
+    def add(self, _call):
+        _db = self._connect()
+        _db.execute(_INSERT, [_call[_name] for _name, _type in COLUMNS])
+        _db.commit()
+
+    # The calls that match, oldest first, as dictionaries like the ones that were added. Every
+    # argument is optional: the calls that started between _since and _until, to or from an ID,
+    # on a system or timeslot. At most _limit of them, the most recent, if given.
+    #
+    def find(self, _since = None, _until = None, _dst = None, _src = None, _system = None, _ts = None, _limit = None):
+        _where = []
+        _args = []
+        for _test, _value in (('start >= ?', _since), ('start < ?', _until), ('dst = ?', _dst), ('src = ?', _src), ('system = ?', _system), ('ts = ?', _ts)):
+            if _value is not None:
+                _where.append(_test)
+                _args.append(_value)
+        _query = _SELECT
+        if _where:
+            _query += ' WHERE ' + ' AND '.join(_where)
+        if _limit is not None:
+            _query = 'SELECT * FROM ({} ORDER BY start DESC LIMIT ?) ORDER BY start'.format(_query)
+            _args.append(_limit)
+        else:
+            _query += ' ORDER BY start'
+        for _row in self._connect().execute(_query, _args):
+            yield dict(zip((_name for _name, _type in COLUMNS), _row))
+
+
+# The recorded bytes of each call (records, as recorder.py writes them), read straight out of
+# its recording without copying the rest of the file. A call whose recording has gone is left out.
+#
+def read_calls(_calls):
+    _path = _map = None
+    try:
+        for _call in _calls:
+            if _call['PATH'] != _path:
+                if _map is not None:
+                    _map.close()
+                    _map = None
+                _path = _call['PATH']
+                try:
+                    with open(_path, 'rb') as _file:
+                        _map = mmap(_file.fileno(), 0, access = ACCESS_READ)
+                except (IOError, OSError, ValueError):
+                    continue        # missing or empty
+            if _map is not None:
+                yield _call, _map[_call['OFFSET']:_call['OFFSET'] + _call['LENGTH']]
+    finally:
+        if _map is not None:
+            _map.close()
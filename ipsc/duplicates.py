@@ -0,0 +1,63 @@
+# Copyright (c) 2016 Cortney T. Buffington, N0MJS and the K0USY Group. n0mjs@me.com
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike
+# 3.0 Unported License.To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-sa/3.0/ or send a letter to
+# Creative Commons, 444 Castro Street, Suite 900, Mountain View,
+# California, 94041, USA.
+
+# Duplicate packet filter, used by bridge.py and confbridge.py to drop voice
+# packets they have already had -- the same stream arriving from the master and
+# a peer, or coming back around a loop of bridges.
+#
+# Each packet is identified by a key (see packet_key) which is remembered for
+# _window seconds. The keys are kept in a dictionary, for checking, and in a
+# ring in the order they were seen, for forgetting them again: the oldest are
+# dropped off the front of the ring once they are older than _window, or when
+# there are more than _size of them. Checking and adding a key are O(1), and
+# memory use is bounded however busy it gets.
+
+from collections import deque
+
+
+# The key for a user packet: the IPSC header from the peer that sent it on (source and
+# destination, call info...) and the RTP header (sequence number, timestamp and SSRC), which
+# together are unique to each packet of a call.
+#
+def packet_key(_data):
+    return _data[1:30]
+
+
+class DuplicateFilter(object):
+    def __init__(self, _window, _size):
+        self._window = _window
+        self._size = _size
+        self._seen = {}
+        self._ring = deque()
+
+        # Counters, for reporting
+        self.passed = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._seen)
+
+    # True if _key was seen within the last _window seconds (at time _now), otherwise False -- and
+    # it is remembered from now on.
+    #
+    def is_duplicate(self, _key, _now):
+        _seen = self._seen
+        _last = _seen.get(_key)
+        if _last is not None and _now - _last <= self._window:
+            self.dropped += 1
+            return True
+
+        _seen[_key] = _now
+        _ring = self._ring
+        _ring.append((_now, _key))
+        while _now - _ring[0][0] > self._window or len(_ring) > self._size:
+            _then, _old = _ring.popleft()
+            if _seen.get(_old) == _then:
+                del _seen[_old]
+        self.passed += 1
+        return False
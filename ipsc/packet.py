@@ -0,0 +1,191 @@
+# Copyright (c) 2016 Cortney T. Buffington, N0MJS and the K0USY Group. n0mjs@me.com
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike
+# 3.0 Unported License.To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-sa/3.0/ or send a letter to
+# Creative Commons, 444 Castro Street, Suite 900, Mountain View,
+# California, 94041, USA.
+
+# A read-only view of a received IPSC user packet (voice or data).
+#
+# Rather than slicing the same header fields out of a packet over and over (in
+# datagramReceived, then again in the application callbacks), an IPSCPacketView
+# unpacks each part of the packet at most once, the first time one of its
+# fields is asked for, with a precompiled struct layout. Parts nobody asks for
+# are never unpacked. The AMBE payload is handed out as a memoryview, so it is
+# never copied.
+#
+# Offsets are those in documents/voice_burst_decoding.txt:
+#
+#   IPSC header       [0:18]   TYPE, PEER_ID, IPSC_SEQ, SRC_SUB, DST_SUB, CALL_TYPE, CALL_CTRL, CALL_INFO
+#   RTP header        [18:30]  RTP_HEAD (2 bytes), RTP_SEQ, RTP_TIMESTAMP, RTP_SSID
+#   BURST_TYPE        [30]     see BURST_DATA_TYPE in ipsc_const
+#   Voice header and terminator (BURST_TYPE VOICE_HEAD, VOICE_TERM):
+#                     [31:47]  RSSI_THRESH_PARITY, LENGTH_TO_FOLLOW, RSSI_STATUS, SLOT_TYPE_SYNC, DATA_SIZE,
+#                              FULL_LC_BYTE1, FULL_LC_FID, VOICE_PDU_SVC_OPT, VOICE_PDU_DST, VOICE_PDU_SRC
+#   Voice bursts (BURST_TYPE SLOT1_VOICE, SLOT2_VOICE):
+#                     [31:33]  LENGTH, ???
+#                     [33:52]  AMBE_DATA
+#                     [59:65]  VOICE_PDU_DST, VOICE_PDU_SRC -- voice burst E only (66 bytes long)
+
+from struct import Struct
+
+from ipsc.ipsc_const import BURST_DATA_TYPE
+from ipsc.ipsc_mask import TS_CALL_MSK, END_MSK
+
+
+IPSC_HEADER  = Struct('>c4sB3s3sB4sB')
+RTP_HEADER   = Struct('>BBHII')
+VOICE_LC     = Struct('>BHBBHBBB3s3s')
+BURST_E_LC   = Struct('>3s3s')
+
+RTP_OFFSET   = 18
+BURST_OFFSET = 30
+LC_OFFSET    = 31
+AMBE_OFFSET  = 33
+AMBE_LENGTH  = 19
+BURST_E_LEN  = 66
+BURST_E_LC_OFFSET = 59
+
+# Where the destination and source IDs in the DMR link control start
+VOICE_LC_DST_OFFSET = 41
+VOICE_LC_SRC_OFFSET = 44
+BURST_E_DST_OFFSET  = BURST_E_LC_OFFSET
+BURST_E_SRC_OFFSET  = BURST_E_LC_OFFSET + 3
+
+_VOICE_HEAD_TERM = (BURST_DATA_TYPE['VOICE_HEAD'], BURST_DATA_TYPE['VOICE_TERM'])
+_VOICE_BURST     = (BURST_DATA_TYPE['SLOT1_VOICE'], BURST_DATA_TYPE['SLOT2_VOICE'])
+
+
+class IPSCPacketView(object):
+    __slots__ = ('data', '_header', '_rtp', '_lc')
+
+    # _data is the packet as received, with any authentication hash already removed
+    #
+    def __init__(self, _data):
+        self.data = _data
+        self._header = None
+        self._rtp = None
+        self._lc = None
+
+    def __len__(self):
+        return len(self.data)
+
+    # IPSC HEADER
+    #
+    @property
+    def header(self):
+        if self._header is None:
+            self._header = IPSC_HEADER.unpack_from(self.data)
+        return self._header
+
+    @property
+    def packet_type(self):
+        return self.header[0]
+
+    @property
+    def peer_id(self):
+        return self.header[1]
+
+    @property
+    def ipsc_seq(self):
+        return self.header[2]
+
+    @property
+    def src_sub(self):
+        return self.header[3]
+
+    @property
+    def dst_sub(self):
+        return self.header[4]
+
+    @property
+    def call_type(self):
+        return self.header[5]
+
+    @property
+    def call_ctrl(self):
+        return self.header[6]
+
+    @property
+    def call_info(self):
+        return self.header[7]
+
+    # Timeslot, 1 or 2
+    @property
+    def ts(self):
+        return bool(self.header[7] & TS_CALL_MSK) + 1
+
+    # True on the last packet of a call
+    @property
+    def end(self):
+        return bool(self.header[7] & END_MSK)
+
+    # RTP HEADER
+    #
+    @property
+    def rtp(self):
+        if self._rtp is None:
+            self._rtp = RTP_HEADER.unpack_from(self.data, RTP_OFFSET)
+        return self._rtp
+
+    @property
+    def rtp_payload_type(self):
+        return self.rtp[1] & 0x7F
+
+    @property
+    def rtp_seq(self):
+        return self.rtp[2]
+
+    @property
+    def rtp_timestamp(self):
+        return self.rtp[3]
+
+    @property
+    def rtp_ssid(self):
+        return self.rtp[4]
+
+    # BURST PAYLOAD
+    #
+    @property
+    def burst_type(self):
+        return self.data[BURST_OFFSET]
+
+    def is_voice_head(self):
+        return self.data[BURST_OFFSET] == BURST_DATA_TYPE['VOICE_HEAD']
+
+    def is_voice_term(self):
+        return self.data[BURST_OFFSET] == BURST_DATA_TYPE['VOICE_TERM']
+
+    def is_voice_burst(self):
+        return self.data[BURST_OFFSET] in _VOICE_BURST
+
+    # The fields after BURST_TYPE in a voice header or terminator, as a tuple of:
+    # (RSSI_THRESH_PARITY, LENGTH_TO_FOLLOW, RSSI_STATUS, SLOT_TYPE_SYNC, DATA_SIZE,
+    #  FULL_LC_BYTE1, FULL_LC_FID, VOICE_PDU_SVC_OPT, VOICE_PDU_DST, VOICE_PDU_SRC)
+    # None for any other kind of burst.
+    #
+    @property
+    def voice_lc(self):
+        if self._lc is None and self.data[BURST_OFFSET] in _VOICE_HEAD_TERM:
+            self._lc = VOICE_LC.unpack_from(self.data, LC_OFFSET)
+        return self._lc
+
+    # The (destination, source) IDs carried in the DMR link control: from the voice header
+    # or terminator, or voice burst E. None if this burst doesn't carry them.
+    #
+    @property
+    def lc_ids(self):
+        if self.voice_lc is not None:
+            return self._lc[8], self._lc[9]
+        if self.is_voice_burst() and len(self.data) >= BURST_E_LEN:
+            return BURST_E_LC.unpack_from(self.data, BURST_E_LC_OFFSET)
+        return None
+
+    # The 19 bytes of AMBE voice data in a voice burst, without copying them (None if this isn't one)
+    #
+    @property
+    def ambe(self):
+        if self.is_voice_burst():
+            return memoryview(self.data)[AMBE_OFFSET:AMBE_OFFSET + AMBE_LENGTH]
+        return None
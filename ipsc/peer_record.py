@@ -0,0 +1,95 @@
+# Copyright (c) 2016 Cortney T. Buffington, N0MJS and the K0USY Group. n0mjs@me.com
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike
+# 3.0 Unported License.To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-sa/3.0/ or send a letter to
+# Creative Commons, 444 Castro Street, Suite 900, Mountain View,
+# California, 94041, USA.
+
+# Records for the master and each peer of an IPSC.
+#
+# These used to be nested dictionaries: {'IP':, 'PORT':, ..., 'STATUS': {...}}.
+# With __slots__ each record is a fixed, small object and the hot paths read
+# attributes (peer.status.connected) instead of doing two dictionary lookups.
+#
+# Anything that needs the old dictionary layout (the pickle report read by
+# html_stats.py and pickle_stat_reader.py, debug logging) uses to_dict().
+
+
+# Link state and keep-alive counters for the master or a peer
+#
+class LinkStatus(object):
+    __slots__ = ('connected', 'peer_list', 'keep_alives_sent', 'keep_alives_missed',
+                 'keep_alives_outstanding', 'keep_alives_received', 'keep_alive_rx_time')
+
+    def __init__(self, _connected=False, _keep_alive_rx_time=0):
+        self.connected = _connected
+        self.peer_list = False
+        self.keep_alives_sent = 0
+        self.keep_alives_missed = 0
+        self.keep_alives_outstanding = 0
+        self.keep_alives_received = 0
+        self.keep_alive_rx_time = _keep_alive_rx_time
+
+    # PEER_LIST only means anything for the master, so only the master's dictionary has it
+    #
+    def to_dict(self, _master=False):
+        _status = {
+            'CONNECTED':               self.connected,
+            'KEEP_ALIVES_SENT':        self.keep_alives_sent,
+            'KEEP_ALIVES_MISSED':      self.keep_alives_missed,
+            'KEEP_ALIVES_OUTSTANDING': self.keep_alives_outstanding,
+            'KEEP_ALIVES_RECEIVED':    self.keep_alives_received,
+            'KEEP_ALIVE_RX_TIME':      self.keep_alive_rx_time
+            }
+        if _master:
+            _status['PEER_LIST'] = self.peer_list
+        return _status
+
+
+# The master or a peer: where it is, what it told us about itself, and how our link to it is doing.
+# mode_decode and flags_decode are '' until we've decoded them, just like the dictionaries were.
+#
+class PeerRecord(object):
+    __slots__ = ('radio_id', 'ip', 'port', 'mode', 'mode_decode', 'flags', 'flags_decode', 'status')
+
+    def __init__(self, _ip='', _port='', _mode='\x00', _mode_decode='', _flags='', _flags_decode='', _radio_id=None, _status=None):
+        self.radio_id = _radio_id
+        self.ip = _ip
+        self.port = _port
+        self.mode = _mode
+        self.mode_decode = _mode_decode
+        self.flags = _flags
+        self.flags_decode = _flags_decode
+        self.status = _status if _status is not None else LinkStatus()
+
+    # The old dictionary layout. Only the master record has a RADIO_ID, peers are keyed by theirs.
+    #
+    def to_dict(self):
+        _record = {
+            'IP':           self.ip,
+            'PORT':         self.port,
+            'MODE':         self.mode,
+            'MODE_DECODE':  self.mode_decode,
+            'FLAGS':        self.flags,
+            'FLAGS_DECODE': self.flags_decode,
+            'STATUS':       self.status.to_dict(self.radio_id is not None)
+            }
+        if self.radio_id is not None:
+            _record['RADIO_ID'] = self.radio_id
+        return _record
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+# Copy of CONFIG['SYSTEMS'] with every record turned back into a dictionary - this is what gets
+# pickled for html_stats.py and pickle_stat_reader.py, so they don't need this module to read it.
+#
+def systems_to_dict(_systems):
+    _export = {}
+    for _name, _system in _systems.items():
+        _export[_name] = dict(_system)
+        _export[_name]['MASTER'] = _system['MASTER'].to_dict()
+        _export[_name]['PEERS'] = dict((_peerid, _peer.to_dict()) for _peerid, _peer in _system['PEERS'].items())
+    return _export
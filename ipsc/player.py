@@ -0,0 +1,190 @@
+# Copyright (c) 2016 Cortney T. Buffington, N0MJS and the K0USY Group. n0mjs@me.com
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike
+# 3.0 Unported License.To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-sa/3.0/ or send a letter to
+# Creative Commons, 444 Castro Street, Suite 900, Mountain View,
+# California, 94041, USA.
+
+# Sending bursts at the rate DMR does, one every 60 ms.
+#
+# A PacingClock is the timeline of a transmission: slot N is due N x 60 ms
+# after the first, by a monotonic clock (one that setting the time of day
+# doesn't move), rather than 60 ms after the last burst went out, so the time
+# taken to get round to each one doesn't add up over a long transmission. A
+# burst that is late for its slot goes straight away, and the next ones follow
+# as quickly as they can until they're back on time. One that is more than
+# MAX_LATE behind is dropped, so a stall doesn't turn into a long run of bursts
+# back to back -- or, for a live source that can't be dropped from, the rest of
+# the timeline is moved on instead. Each clock keeps count of this, and of how
+# far from their slots the bursts went out (the jitter), see stats.
+#
+# A BurstPlayer plays a transmission out from the reactor on a PacingClock.
+# Code running in a thread of its own can use a clock's pace() to wait for each
+# slot instead.
+
+import ctypes
+import ctypes.util
+import sys
+from time import sleep, time
+
+from twisted.internet import reactor
+
+
+# Time between voice bursts
+FRAME_TIME = 0.06
+
+# How late a burst can be and still be sent
+MAX_LATE = 3 * FRAME_TIME
+
+
+# Seconds from a monotonic clock -- Python 2 doesn't have one, but Linux's clock_gettime does.
+# Anywhere else, we have to make do with the time of day.
+#
+class _timespec(ctypes.Structure):
+    _fields_ = [
+        ('tv_sec',  ctypes.c_long),
+        ('tv_nsec', ctypes.c_long)
+    ]
+
+_clock_gettime = None
+if sys.platform.startswith('linux'):
+    try:
+        _clock_gettime = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).clock_gettime
+        _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+        _clock_gettime.restype = ctypes.c_int
+    except (OSError, AttributeError, TypeError):
+        _clock_gettime = None
+
+if _clock_gettime is not None:
+    _CLOCK_MONOTONIC = 1
+
+    def monotonic():
+        _now = _timespec()
+        _clock_gettime(_CLOCK_MONOTONIC, ctypes.byref(_now))
+        return _now.tv_sec + _now.tv_nsec * 1e-9
+else:
+    monotonic = time
+
+
+class PacingClock(object):
+    # _drop: drop bursts that are too late (True), or move the timeline on (False). _clock is
+    # only there to be replaced for testing.
+    #
+    def __init__(self, _drop = True, _frame_time = FRAME_TIME, _max_late = MAX_LATE, _clock = monotonic):
+        self._drop = _drop
+        self._frame_time = _frame_time
+        self._max_late = _max_late
+        self._clock = _clock
+        self._start = _clock()
+        self._behind = False
+
+        self.slot = 0                   # the next slot to be used
+
+        # Statistics
+        self.sent = 0                   # bursts sent
+        self.late = 0                   # ...of those, a whole slot or more late (catching up)
+        self.dropped = 0                # bursts dropped for being too late
+        self.overruns = 0               # times we fell more than _max_late behind
+        self.jitter_max = 0.0           # how far from their slots bursts were sent
+        self.jitter_total = 0.0
+
+    # Start the timeline again, with slot 0 _delay seconds from now
+    def start(self, _delay = 0):
+        self._start = self._clock() + _delay
+        self.slot = 0
+        self._behind = False
+
+    # Time (by our clock) the next slot is due
+    def due(self):
+        return self._start + self.slot * self._frame_time
+
+    # Seconds until the next slot is due, 0 if it's now or past
+    def wait(self):
+        return max(self.due() - self._clock(), 0)
+
+    # Use the next slot for a burst. True if the burst is to be sent now, False if it's to be
+    # dropped. Call this when the slot is due, or as soon after as possible.
+    #
+    def tick(self):
+        _late = self._clock() - self.due()
+        if _late > self._max_late:
+            if not self._behind:
+                self._behind = True
+                self.overruns += 1
+            if self._drop:
+                self.slot += 1
+                self.dropped += 1
+                return False
+            self._start += _late        # this burst still counts as being as late as it is
+        else:
+            self._behind = False
+
+        self.slot += 1
+        self.sent += 1
+        if _late >= self._frame_time:
+            self.late += 1
+        _late = abs(_late)
+        self.jitter_total += _late
+        if _late > self.jitter_max:
+            self.jitter_max = _late
+        return True
+
+    # Wait for the next slot (blocking, not for use in the reactor), then tick()
+    def pace(self):
+        _wait = self.wait()
+        if _wait:
+            sleep(_wait)
+        return self.tick()
+
+    def stats(self):
+        return {
+            'SENT':        self.sent,
+            'LATE':        self.late,
+            'DROPPED':     self.dropped,
+            'OVERRUNS':    self.overruns,
+            'JITTER_MEAN': self.jitter_total / self.sent if self.sent else 0.0,
+            'JITTER_MAX':  self.jitter_max
+        }
+
+    def __str__(self):
+        return '{SENT} sent, {LATE} late, {DROPPED} dropped, {OVERRUNS} overruns, jitter {0:.1f} ms mean, {1:.1f} ms max'.format(
+            self.jitter_total / self.sent * 1000 if self.sent else 0.0, self.jitter_max * 1000, **self.stats())
+
+
+class BurstPlayer(object):
+    # Start sending _bursts (any iterable of packets, it's only read as they're sent) with
+    # _send(burst), the first one _delay seconds from now. _done, if given, is called with the
+    # player after the last one. The player's clock (a PacingClock) has the statistics.
+    #
+    def __init__(self, _send, _bursts, _delay = 0, _done = None):
+        self._send = _send
+        self._bursts = iter(_bursts)
+        self._done = _done
+        self.clock = PacingClock()
+        self.clock.start(_delay)
+        self._call = reactor.callLater(_delay, self._next)
+
+    # Number of bursts sent so far
+    def __len__(self):
+        return self.clock.sent
+
+    def active(self):
+        return self._call is not None
+
+    # Stop before the end (_done isn't called)
+    def stop(self):
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+    def _next(self):
+        _burst = next(self._bursts, None)
+        if _burst is None:
+            self._call = None
+            if self._done:
+                self._done(self)
+            return
+        if self.clock.tick():
+            self._send(_burst)
+        self._call = reactor.callLater(self.clock.wait(), self._next)
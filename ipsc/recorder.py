@@ -0,0 +1,156 @@
+# Copyright (c) 2016 Cortney T. Buffington, N0MJS and the K0USY Group. n0mjs@me.com
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike
+# 3.0 Unported License.To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-sa/3.0/ or send a letter to
+# Creative Commons, 444 Castro Street, Suite 900, Mountain View,
+# California, 94041, USA.
+
+# Recorded transmissions on disk, and a writer to put them there without
+# holding up the reactor.
+#
+# A recording is a file of records, one per burst: the length of the packet
+# (4 bytes, a native int) followed by the packet, exactly as it came from the
+# IPSC. That's the format of template.bin, which ambe_audio.py's readRecord
+# reads, and a record with a length of 0 (or the end of the file) ends it.
+#
+# RecordWriter does the file I/O on a thread of its own. The reactor only puts
+# requests (open, write, close) on a queue, which never blocks: a slow disk
+# can't stall the IPSCs. Each file is written through a buffer, which is
+# flushed whenever the queue runs empty, so what has been received is on disk
+# a moment later. No more than _size bursts are ever waiting in the queue --
+# any more are dropped and counted -- so memory use stays the same however long
+# or busy the calls are.
+#
+# Given a CallIndex (see archive.py), the writer also adds each call to it when
+# the call is closed, with where its records are in the file.
+
+import struct
+import sqlite3
+from threading import Thread
+from Queue import Queue
+
+
+# Length of a record, before the packet
+RECORD_LEN = struct.Struct('i')
+
+# Bursts that may be waiting to be written, and the buffer for each file
+QUEUE_SIZE = 5000
+BUFFER_SIZE = 65536
+
+
+# One burst, framed as a record
+#
+def frame(_data):
+    return RECORD_LEN.pack(len(_data)) + _data
+
+# The bursts in a recording (an open file), read as they're needed
+#
+def read_records(_file):
+    while True:
+        _len = _file.read(RECORD_LEN.size)
+        if len(_len) < RECORD_LEN.size:
+            return
+        _len, = RECORD_LEN.unpack(_len)
+        if _len <= 0:
+            return
+        _data = _file.read(_len)
+        if len(_data) < _len:
+            return
+        yield _data
+
+
+class RecordWriter(object):
+    def __init__(self, _logger, _index = None, _size = QUEUE_SIZE, _buffer = BUFFER_SIZE):
+        self._logger = _logger
+        self._index = _index
+        self._size = _size
+        self._buffer = _buffer
+        self._queue = Queue()
+        self._files = {}                # only used by the writer thread: _call -> [file, path, offset, bursts]
+
+        # Counters, for reporting
+        self.written = 0
+        self.dropped = 0
+
+        self._thread = Thread(target = self._run, name = 'RecordWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    # Start a new recording, _path, which is referred to as _call (anything hashable) from then on
+    def open(self, _call, _path):
+        self._queue.put(('open', _call, _path))
+
+    def write(self, _call, _data):
+        if self._queue.qsize() >= self._size:
+            self.dropped += 1
+            return False
+        self._queue.put(('write', _call, frame(_data)))
+        return True
+
+    # _summary, if given, is a dictionary describing the call (see archive.COLUMNS) to add to the
+    # index, less what the writer fills in: PATH, OFFSET, LENGTH and BURSTS
+    #
+    def close(self, _call, _summary = None):
+        self._queue.put(('close', _call, _summary))
+
+    # Write out everything queued so far, close all the files and wait for the thread to finish
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        _queue = self._queue
+        _files = self._files
+        while True:
+            _request = _queue.get()
+            if _request is None:
+                break
+            _op, _call, _arg = _request
+            try:
+                if _op == 'write':
+                    _file = _files.get(_call)
+                    if _file is not None:
+                        _file[0].write(_arg)
+                        _file[3] += 1
+                        self.written += 1
+                elif _op == 'open':
+                    self._close(_call)
+                    _file = open(_arg, 'ab', self._buffer)
+                    _files[_call] = [_file, _arg, _file.tell(), 0]
+                else:
+                    self._close(_call, _arg)
+            except (IOError, OSError) as e:
+                self._logger.error('Recording %s could not be written: %s', _call, e)
+                _files.pop(_call, None)
+            except sqlite3.Error as e:
+                self._logger.error('Recording %s could not be indexed: %s', _call, e)
+
+            # Nothing else to do for now, get it all on disk
+            if _queue.empty():
+                for _call, _file in _files.items():
+                    try:
+                        _file[0].flush()
+                    except (IOError, OSError) as e:
+                        self._logger.error('Recording %s could not be written: %s', _call, e)
+                        del _files[_call]
+
+        for _call in _files.keys():
+            try:
+                self._close(_call)
+            except (IOError, OSError) as e:
+                self._logger.error('Recording %s could not be written: %s', _call, e)
+
+        if self._index is not None:
+            self._index.close()
+
+    def _close(self, _call, _summary = None):
+        _file = self._files.pop(_call, None)
+        if _file is None:
+            return
+        _file, _path, _offset, _bursts = _file
+        _length = _file.tell() - _offset
+        _file.close()
+        if self._index is not None and _summary is not None:
+            _summary = dict(_summary, PATH = _path, OFFSET = _offset, LENGTH = _length, BURSTS = _bursts)
+            self._index.add(_summary)
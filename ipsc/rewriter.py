@@ -0,0 +1,82 @@
+# Copyright (c) 2016 Cortney T. Buffington, N0MJS and the K0USY Group. n0mjs@me.com
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike
+# 3.0 Unported License.To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-sa/3.0/ or send a letter to
+# Creative Commons, 444 Castro Street, Suite 900, Mountain View,
+# California, 94041, USA.
+
+# Re-writes a voice (or data) packet for sending on to another IPSC or talkgroup.
+#
+# The applications used to do this with str.replace() on the whole packet:
+# that scans every byte, changes *any* run of bytes that happens to match the
+# old ID -- including in the AMBE payload -- and makes a new copy of the
+# packet for every field changed. BurstRewriter copies the packet into a
+# bytearray it keeps between packets, patches each field at its fixed offset
+# (see ipsc/packet.py), and makes one string out of the result to send.
+#
+# The destination and source IDs are also patched where they appear in the
+# link control carried in a voice header, terminator or voice burst E, just
+# like the old replace() did.
+
+from struct import pack_into
+
+from ipsc.ipsc_const import BURST_DATA_TYPE
+from ipsc.ipsc_mask import TS_CALL_MSK
+from ipsc.packet import BURST_OFFSET, BURST_E_LEN, VOICE_LC_DST_OFFSET, VOICE_LC_SRC_OFFSET, BURST_E_DST_OFFSET, BURST_E_SRC_OFFSET
+
+
+_VOICE_HEAD  = ord(BURST_DATA_TYPE['VOICE_HEAD'])
+_VOICE_TERM  = ord(BURST_DATA_TYPE['VOICE_TERM'])
+_SLOT1_VOICE = ord(BURST_DATA_TYPE['SLOT1_VOICE'])
+_SLOT2_VOICE = ord(BURST_DATA_TYPE['SLOT2_VOICE'])
+
+
+class BurstRewriter(object):
+    def __init__(self):
+        self._buffer = bytearray()
+
+    # Return a copy of _data with:
+    #   _peerid     the IPSC peer ID (4 bytes)
+    #   _dst        the destination group or subscriber (3 bytes), None to leave it alone
+    #   _ts         the timeslot, 1 or 2 -- both the IPSC call info bit and, for voice bursts,
+    #               the burst type. None to leave it alone
+    #   _src_sub    the source subscriber (3 bytes), None to leave it alone
+    #   _rtp_seq    the RTP sequence number, None to leave it alone
+    #
+    def rewrite(self, _data, _peerid, _dst=None, _ts=None, _src_sub=None, _rtp_seq=None):
+        _buffer = self._buffer
+        _buffer[:] = _data
+        _buffer[1:5] = _peerid
+        _burst_type = _buffer[BURST_OFFSET] if len(_buffer) > BURST_OFFSET else None
+
+        if _dst is not None or _src_sub is not None:
+            if _burst_type == _VOICE_HEAD or _burst_type == _VOICE_TERM:
+                _lc_dst, _lc_src = VOICE_LC_DST_OFFSET, VOICE_LC_SRC_OFFSET
+            elif (_burst_type == _SLOT1_VOICE or _burst_type == _SLOT2_VOICE) and len(_buffer) >= BURST_E_LEN:
+                _lc_dst, _lc_src = BURST_E_DST_OFFSET, BURST_E_SRC_OFFSET
+            else:
+                _lc_dst = _lc_src = None
+            if _dst is not None:
+                _buffer[9:12] = _dst
+                if _lc_dst is not None:
+                    _buffer[_lc_dst:_lc_dst + 3] = _dst
+            if _src_sub is not None:
+                _buffer[6:9] = _src_sub
+                if _lc_src is not None:
+                    _buffer[_lc_src:_lc_src + 3] = _src_sub
+
+        if _ts is not None:
+            if _ts == 1:
+                _buffer[17] &= ~TS_CALL_MSK
+                if _burst_type == _SLOT2_VOICE:
+                    _buffer[BURST_OFFSET] = _SLOT1_VOICE
+            elif _ts == 2:
+                _buffer[17] |= TS_CALL_MSK
+                if _burst_type == _SLOT1_VOICE:
+                    _buffer[BURST_OFFSET] = _SLOT2_VOICE
+
+        if _rtp_seq is not None:
+            pack_into('>H', _buffer, 20, _rtp_seq & 0xFFFF)
+
+        return str(_buffer)
@@ -0,0 +1,120 @@
+# Copyright (c) 2016 Cortney T. Buffington, N0MJS and the K0USY Group. n0mjs@me.com
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike
+# 3.0 Unported License.To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-sa/3.0/ or send a letter to
+# Creative Commons, 444 Castro Street, Suite 900, Mountain View,
+# California, 94041, USA.
+
+# Batched UDP fan-out using the Linux sendmmsg() system call.
+#
+# An IPSC sends every packet to the master and each connected peer. Done with
+# transport.write that's one system call per destination; sendmmsg hands the
+# kernel the whole list at once. The message headers (one per destination,
+# all pointing at the same payload) are built when the destination list
+# changes, so sending only has to point them at the new payload.
+#
+# Only available on Linux with a libc that has sendmmsg (glibc 2.14+). Check
+# AVAILABLE before creating a MultiSender - if it's False, just use
+# transport.write for each destination like we always have.
+
+import ctypes
+import ctypes.util
+import struct
+import sys
+
+from socket import AF_INET, htons
+from socket import inet_aton as IPHexStr
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [
+        ('iov_base', ctypes.c_void_p),
+        ('iov_len',  ctypes.c_size_t)
+    ]
+
+class _sockaddr_in(ctypes.Structure):
+    _fields_ = [
+        ('sin_family', ctypes.c_ushort),
+        ('sin_port',   ctypes.c_ushort),
+        ('sin_addr',   ctypes.c_uint32),
+        ('sin_zero',   ctypes.c_ubyte * 8)
+    ]
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name',       ctypes.c_void_p),
+        ('msg_namelen',    ctypes.c_uint32),
+        ('msg_iov',        ctypes.POINTER(_iovec)),
+        ('msg_iovlen',     ctypes.c_size_t),
+        ('msg_control',    ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags',      ctypes.c_int)
+    ]
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_hdr', _msghdr),
+        ('msg_len', ctypes.c_uint)
+    ]
+
+
+_sendmmsg = None
+if sys.platform.startswith('linux'):
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        _sendmmsg = _libc.sendmmsg
+        _sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint, ctypes.c_int]
+        _sendmmsg.restype = ctypes.c_int
+    except (OSError, AttributeError, TypeError):
+        _sendmmsg = None
+
+AVAILABLE = _sendmmsg is not None
+
+
+# Sends one payload to a list of (IP, PORT) destinations with a single sendmmsg call
+#
+class MultiSender(object):
+    def __init__(self, _fileno):
+        self._fileno = _fileno
+        self._iov = _iovec()
+        self._addrs = None
+        self._msgs = None
+        self._count = 0
+        # System calls made - used for statistics and benchmarking
+        self.calls = 0
+
+    # Build the sockaddr and message header arrays for a new destination list
+    #
+    def set_destinations(self, _destinations):
+        _count = len(_destinations)
+        _addrs = (_sockaddr_in * _count)()
+        _msgs = (_mmsghdr * _count)()
+        _iov = ctypes.pointer(self._iov)
+
+        for i, (_host, _port) in enumerate(_destinations):
+            _addrs[i].sin_family = AF_INET
+            _addrs[i].sin_port = htons(_port)
+            _addrs[i].sin_addr = struct.unpack('=I', IPHexStr(_host))[0]  # already in network byte order
+            _msgs[i].msg_hdr.msg_name = ctypes.addressof(_addrs[i])
+            _msgs[i].msg_hdr.msg_namelen = ctypes.sizeof(_sockaddr_in)
+            _msgs[i].msg_hdr.msg_iov = _iov
+            _msgs[i].msg_hdr.msg_iovlen = 1
+
+        self._addrs, self._msgs, self._count = _addrs, _msgs, _count
+
+    # Send _packet to every destination. Returns how many destinations it was sent to,
+    # in order. Anything less than all of them (0 on error) is up to the caller to send
+    # some other way.
+    #
+    def send(self, _packet):
+        if not self._count:
+            return 0
+        _buffer = ctypes.c_char_p(_packet)
+        self._iov.iov_base = ctypes.cast(_buffer, ctypes.c_void_p)
+        self._iov.iov_len = len(_packet)
+        self.calls += 1
+        _sent = _sendmmsg(self._fileno, self._msgs, self._count, 0)
+        if _sent < 0:
+            return 0
+        return _sent
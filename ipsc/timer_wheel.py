@@ -0,0 +1,76 @@
+# Copyright (c) 2016 Cortney T. Buffington, N0MJS and the K0USY Group. n0mjs@me.com
+#
+# This work is licensed under the Creative Commons Attribution-ShareAlike
+# 3.0 Unported License.To view a copy of this license, visit
+# http://creativecommons.org/licenses/by-sa/3.0/ or send a letter to
+# Creative Commons, 444 Castro Street, Suite 900, Mountain View,
+# California, 94041, USA.
+
+# A hashed timer wheel, used for keep-alive deadlines.
+#
+# Time is cut into ticks, and a deadline goes in the slot for its tick (modulo
+# the number of slots). Advancing the wheel only looks at the slots for the
+# ticks that have passed, so the cost of a tick depends on how many deadlines
+# fell due in it, not on how many there are in total. Deadlines further out
+# than one turn of the wheel stay in their slot until their tick comes around.
+#
+# Each key has at most one deadline. Scheduling a key again replaces its old
+# deadline and cancelling just forgets it - stale entries are dropped when
+# their slot comes up, instead of searching for them.
+
+
+class TimerWheel(object):
+    def __init__(self, _tick, _slots):
+        self._tick = float(_tick)
+        self._slots = [[] for i in xrange(_slots)]
+        self._deadlines = {}
+        self._current = None
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, _key):
+        return _key in self._deadlines
+
+    # Set (or move) the deadline for _key to time _when, in seconds. Deadlines in the tick we're
+    # in, or already past, go off the next time the wheel is advanced.
+    #
+    def schedule(self, _key, _when):
+        _tick = int(_when / self._tick)
+        if self._current is not None and _tick <= self._current:
+            _tick = self._current + 1
+        self._deadlines[_key] = _tick
+        self._slots[_tick % len(self._slots)].append((_tick, _key))
+
+    def cancel(self, _key):
+        self._deadlines.pop(_key, None)
+
+    # Advance the wheel to time _now and return the keys whose deadlines have passed, in no
+    # particular order. They are no longer scheduled: schedule them again to keep them going.
+    #
+    def advance(self, _now):
+        _now_tick = int(_now / self._tick)
+        if self._current is None:
+            self._current = _now_tick - len(self._slots)    # first time: look at every slot
+        _due = []
+        _slots = self._slots
+        _deadlines = self._deadlines
+        # Only the slots for ticks that have passed -- but never more than one turn of the wheel
+        for _tick in xrange(self._current + 1, min(_now_tick, self._current + len(_slots)) + 1):
+            _index = _tick % len(_slots)
+            _slot = _slots[_index]
+            if not _slot:
+                continue
+            _pending = []
+            for _entry in _slot:
+                _deadline, _key = _entry
+                if _deadlines.get(_key) != _deadline:
+                    continue                    # cancelled or rescheduled
+                if _deadline <= _now_tick:
+                    del _deadlines[_key]
+                    _due.append(_key)
+                else:
+                    _pending.append(_entry)     # a later turn of the wheel
+            _slots[_index] = _pending
+        self._current = max(self._current, _now_tick)
+        return _due
@@ -19,8 +19,9 @@
 ###############################################################################
 
 # This is a sample application that "plays" a voice tranmission from a file
-# that was created with record.py. The file is just a pickle of an entire
-# transmission.
+# that was created with record.py: a file of length-prefixed bursts, like
+# template.bin. Older recordings, which were a pickle of the entire
+# transmission, can still be used if their name ends in .pickle.
 # 
 # This program consults a list of "trigger groups" for each timeslot that
 # will initiate playback. When playback occurs, several items are re-written:
@@ -28,18 +29,24 @@
 #   Source Peer: this DMRlink's local subscriber ID
 #   Timeslot: timeslot of the tranmission that triggered
 #   TGID: TGID of the message that triggered it
+#
+# The file is read once, at startup. The re-written copy of the transmission
+# for each timeslot and TGID is made the first time it's needed and kept, so
+# playing it again costs neither disk access nor re-writing.
 
 
 from __future__ import print_function
 from twisted.internet import reactor
 
-import sys, time
+import sys
 import cPickle as pickle
 
 from dmrlink import IPSC, systems
 
 from dmr_utils.utils import int_id, hex_str_3
 from ipsc.ipsc_const import BURST_DATA_TYPE
+from ipsc.player import BurstPlayer
+from ipsc.recorder import read_records
 
 __author__      = 'Cortney T. Buffington, N0MJS'
 __copyright__   = 'Copyright (c) 2014 - 2015 Cortney T. Buffington, N0MJS and the K0USY Group'
@@ -60,12 +67,34 @@ trigger = True
 trigger_groups_1 = ['\x00\x00\x01', '\x00\x00\x0D', '\x00\x00\x64']
 trigger_groups_2 = ['\x00\x0C\x30',]
 
+# The transmission from the file -- see load_call
+CALL_DATA = []
+
+def load_call(_filename):
+    with open(_filename, 'rb') as _file:
+        if _filename.endswith('.pickle'):
+            return pickle.load(_file)
+        return list(read_records(_file))
+
 class playIPSC(IPSC):
     def __init__(self, _name, _config, _logger):
         IPSC.__init__(self, _name, _config, _logger)
-        self.CALL_DATA = []
         self.event_id = 1
         
+        # CALL_DATA re-written for playback on each (TS, TGID), see call_for
+        self.CALLS = {}
+    
+    # The transmission re-written for timeslot _ts and group _dst_group: the peer radio ID and
+    # source subscriber ID are those of this program, and the destination Group ID and the IPSC
+    # and DMR timeslot values those given. Made the first time it's asked for.
+    #
+    def call_for(self, _ts, _dst_group):
+        _call = self.CALLS.get((_ts, _dst_group))
+        if _call is None:
+            _self_peer = self._config['LOCAL']['RADIO_ID']
+            _call = self.CALLS[(_ts, _dst_group)] = [self._rewriter.rewrite(i, _self_peer, _dst_group, _ts, _self_peer[1:]) for i in CALL_DATA]
+        return _call
+        
     #************************************************
     #     CALLBACK FUNCTIONS FOR USER PACKET TYPES
     #************************************************
@@ -80,55 +109,20 @@ class playIPSC(IPSC):
                 return
             
             if trigger == False:
-                if (_ts == 1 and _dst_group not in trigger_groups_1) or (_ts == 2 and _dst_group not in trigger_groups_2):
+                if (_ts == 1 and _dst_group in trigger_groups_1) or (_ts == 2 and _dst_group in trigger_groups_2):
                     return
             else:
                 if (_ts == 1 and _dst_group not in trigger_groups_1) or (_ts == 2 and _dst_group not in trigger_groups_2):
                     return
             
             self._logger.info('(%s) Event ID: %s - Playback triggered from SourceID: %s, TS: %s, TGID: %s, PeerID: %s', self._system, self.event_id, int_id(_src_sub), _ts, int_id(_dst_group), int_id(_peerid))
-            
-            # Determine the type of voice packet this is (see top of file for possible types)
-            _burst_data_type = _data[30]
                 
-            time.sleep(2)
-            self.CALL_DATA = pickle.load(open(filename, 'rb'))
             self._logger.info('(%s) Event ID: %s - Playing back file: %s', self._system, self.event_id, filename)
-           
-            for i in self.CALL_DATA:
-                _tmp_data = i
-                
-                # re-Write the peer radio ID to that of this program
-                _tmp_data = _tmp_data.replace(_peerid, _self_peer)
-                # re-Write the source subscriber ID to that of this program
-                _tmp_data = _tmp_data.replace(_src_sub, _self_src)
-                # Re-Write the destination Group ID
-                _tmp_data = _tmp_data.replace(_tmp_data[9:12], _dst_group)
-                
-                # Re-Write IPSC timeslot value
-                _call_info = int_id(_tmp_data[17:18])
-                if _ts == 1:
-                    _call_info &= ~(1 << 5)
-                elif _ts == 2:
-                    _call_info |= 1 << 5
-                _call_info = chr(_call_info)
-                _tmp_data = _tmp_data[:17] + _call_info + _tmp_data[18:]
-                    
-                # Re-Write DMR timeslot value
-                # Determine if the slot is present, so we can translate if need be
-                if _burst_data_type == BURST_DATA_TYPE['SLOT1_VOICE'] or _burst_data_type == BURST_DATA_TYPE['SLOT2_VOICE']:
-                    # Re-Write timeslot if necessary...
-                    if _ts == 1:
-                        _burst_data_type = BURST_DATA_TYPE['SLOT1_VOICE']
-                    elif _ts == 2:
-                        _burst_data_type = BURST_DATA_TYPE['SLOT2_VOICE']
-                    _tmp_data = _tmp_data[:30] + _burst_data_type + _tmp_data[31:]
-
-                # Send the packet to all peers in the target IPSC
-                self.send_to_ipsc(_tmp_data)
-                time.sleep(0.06)
-            self.CALL_DATA = []
-            self._logger.info('(%s) Event ID: %s - Playback Completed', self._system, self.event_id)
+            
+            # Send the packets to all peers in the target IPSC, one every 60ms, after 2 seconds
+            _event_id = self.event_id
+            BurstPlayer(self.send_to_ipsc, self.call_for(_ts, _dst_group), 2,
+                        lambda _player: self._logger.info('(%s) Event ID: %s - Playback Completed: %s', self._system, _event_id, _player.clock))
             self.event_id = self.event_id + 1
         
 
@@ -176,6 +170,13 @@ if __name__ == '__main__':
         signal.signal(sig, sig_handler)
     
     
+    # READ THE TRANSMISSION TO PLAY BACK
+    try:
+        CALL_DATA = load_call(filename)
+    except (IOError, pickle.UnpicklingError, EOFError) as e:
+        sys.exit('Transmission file {} could not be read: {}'.format(filename, e))
+    logger.info('Transmission to play back read from %s: %s bursts', filename, len(CALL_DATA))
+    
     # INITIALIZE AN IPSC OBJECT (SELF SUSTAINING) FOR EACH CONFIGUED IPSC
     for system in CONFIG['SYSTEMS']:
         if CONFIG['SYSTEMS'][system]['LOCAL']['ENABLED']:
@@ -24,9 +24,10 @@ from __future__ import print_function
 from twisted.internet import reactor
 from binascii import b2a_hex as ahex
 
-import sys, time
+import sys
 from dmrlink import IPSC, systems
 from dmr_utils.utils import int_id, hex_str_3
+from ipsc.player import BurstPlayer
 
 __author__      = 'Cortney T. Buffington, N0MJS'
 __copyright__   = 'Copyright (c) 2014 Cortney T. Buffington, N0MJS and the K0USY Group'
@@ -43,7 +44,6 @@ except ImportError:
 
 HEX_TGID    = hex_str_3(TGID)
 HEX_SUB     = hex_str_3(SUB)
-BOGUS_SUB   = '\xFF\xFF\xFF'
 
 class playbackIPSC(IPSC):
     def __init__(self, _name, _config, _logger):
@@ -75,18 +75,20 @@ class playbackIPSC(IPSC):
                     self.CALL_DATA.append(_tmp_data)
                 if _end:
                     self.CALL_DATA.append(_data)
-                    time.sleep(2)
+                    _call_data, self.CALL_DATA = self.CALL_DATA, []
                     self._logger.info('(%s) Playing back transmission from subscriber: %s', self._system, int_id(_src_sub))
-                    for i in self.CALL_DATA:
-                        _tmp_data = i
-                        _tmp_data = _tmp_data.replace(_peerid, self._config['LOCAL']['RADIO_ID'])
-                        if GROUP_SRC_SUB:
-                            _tmp_data = _tmp_data.replace(_src_sub, self.GROUP_SRC_SUB)
-                        # Send the packet to all peers in the target IPSC
-                        self.send_to_ipsc(_tmp_data)
-                        time.sleep(0.06)
-                    self.CALL_DATA = []
+                    if GROUP_SRC_SUB:
+                        _bursts = (self._rewriter.rewrite(i, self._config['LOCAL']['RADIO_ID'], _src_sub=self.GROUP_SRC_SUB) for i in _call_data)
+                    else:
+                        _bursts = (self._rewriter.rewrite(i, self._config['LOCAL']['RADIO_ID']) for i in _call_data)
+                    # Send the packets to all peers in the target IPSC, one every 60ms, after 2 seconds -- the
+                    # reactor (and anything else being received or played back) carries on in the meantime
+                    BurstPlayer(self.send_to_ipsc, _bursts, 2, self.playback_done)
                 
+    # How the playback went: the pacing clock's statistics
+    def playback_done(self, _player):
+        self._logger.info('(%s) Playback complete: %s', self._system, _player.clock)
+
     if PRIVATE_REPEAT:
         def private_voice(self, _src_sub, _dst_sub, _ts, _end, _peerid, _data):
             if HEX_SUB == _dst_sub and _ts in PRIVATE_TS:
@@ -97,20 +99,14 @@ class playbackIPSC(IPSC):
                     self.CALL_DATA.append(_tmp_data)
                 if _end:
                     self.CALL_DATA.append(_data)
-                    time.sleep(1)
+                    _call_data, self.CALL_DATA = self.CALL_DATA, []
                     self._logger.info('(%s) Playing back transmission from subscriber: %s, to subscriber %s', self._system, int_id(_src_sub), int_id(_dst_sub))
                     _orig_src = _src_sub
                     _orig_dst = _dst_sub
-                    for i in self.CALL_DATA:
-                        _tmp_data = i
-                        _tmp_data = _tmp_data.replace(_peerid, self._config['LOCAL']['RADIO_ID'])
-                        _tmp_data = _tmp_data.replace(_dst_sub, BOGUS_SUB)
-                        _tmp_data = _tmp_data.replace(_src_sub, _orig_dst)
-                        _tmp_data = _tmp_data.replace(BOGUS_SUB, _orig_src)
-                        # Send the packet to all peers in the target IPSC
-                        self.send_to_ipsc(_tmp_data)
-                        time.sleep(0.06)
-                    self.CALL_DATA = []
+                    # Swap the source and destination subscribers, so it goes back to whoever sent it
+                    _bursts = (self._rewriter.rewrite(i, self._config['LOCAL']['RADIO_ID'], _orig_src, _src_sub=_orig_dst) for i in _call_data)
+                    # Send the packets to all peers in the target IPSC, one every 60ms, after 1 second
+                    BurstPlayer(self.send_to_ipsc, _bursts, 1, self.playback_done)
         
 
 if __name__ == '__main__':
@@ -19,16 +19,31 @@
 ###############################################################################
 
 # This is a sample application that "records" voice transmissions to
-# a datafile... presumably to be played back later.
+# datafiles... presumably to be played back later.
+#
+# It runs as a daemon, recording every call that matches (see the command line
+# options) to a file of its own in the recordings directory, named for when it
+# started, the system, timeslot, source and destination. The bursts are
+# written as they arrive, by an ipsc.recorder.RecordWriter, in the same
+# length-prefixed format as template.bin. A call ends with its terminator, or
+# if nothing is heard of it for CALL_TIMEOUT seconds.
+#
+# Each finished call is added to an index of the recordings (an
+# ipsc.archive.CallIndex, calls.db in the recordings directory unless told
+# otherwise), which call_archive.py searches.
 
 from __future__ import print_function
-from twisted.internet import reactor
+from twisted.internet import reactor, task
 from binascii import b2a_hex as h
 
+import os
 import sys
-import cPickle as pickle
+from struct import unpack_from
+from time import time, strftime, localtime
 from dmrlink import IPSC, systems
 from dmr_utils.utils import hex_str_3, int_id
+from ipsc.recorder import RecordWriter
+from ipsc.archive import CallIndex
 
 __author__      = 'Cortney T. Buffington, N0MJS'
 __copyright__   = 'Copyright (c) 2014 Cortney T. Buffington, N0MJS and the K0USY Group'
@@ -38,70 +53,110 @@ __maintainer__  = 'Cort Buffington, N0MJS'
 __email__       = 'n0mjs@me.com'
 
 
-print('This program will record the first matching voice call and exit.\n')
-
-while True:
-    tx_type = raw_input('Group (g) or Private voice (p)? ')
-    if tx_type == 'g' or tx_type == 'p':
-        break
-    print('...input must be either \'g\' or \'p\'')
-
-while True:
-    ts = raw_input('Which timeslot (1, 2 or \'both\')? ')
-    if ts == '1' or ts == '2' or ts =='both':
-        if ts == '1':
-            ts = (1,)
-        if ts == '2':
-            ts = (2,)
-        if ts == 'both':
-            ts = (1,2)
-        break
-    print('...input must be \'1\', \'2\' or \'both\'')
-
-id = raw_input('Which Group or Subscriber ID to record? ')
-id = int(id)
-id = hex_str_3(id)
+# What to record: group (g) and/or private (p) calls, on which timeslots and to which
+# destination IDs (empty for all of them), and the directory for the recordings. These are
+# set from the command line.
+#
+tx_types = ('g', 'p')
+timeslots = (1, 2)
+ids = frozenset()
+directory = 'recordings'
+index = None        # calls.db in the directory
+
+# A call that nothing has been heard of for this many seconds (we missed the terminator)
+# is ended anyway
+#
+CALL_TIMEOUT = 2
 
-filename = raw_input('Filename to use for this recording? ')
 
 class recordIPSC(IPSC):
-    def __init__(self, _name, _config, _logger):
+    def __init__(self, _name, _config, _logger, _writer):
         IPSC.__init__(self, _name, _config, _logger)
-        self.CALL_DATA = []
+        self._writer = _writer
+
+        # The call being recorded on each timeslot
+        self.CALLS = {}
         
     #************************************************
     #     CALLBACK FUNCTIONS FOR USER PACKET TYPES
     #************************************************
     #
-    if tx_type == 'g':
-	print('Initializing to record GROUP VOICE transmission')
-        def group_voice(self, _src_sub, _dst_sub, _ts, _end, _peerid, _data):
-            if id == _dst_sub and _ts in ts:
-                if not _end:
-                    if not self.CALL_DATA:
-                        print('({}) Recording transmission from subscriber: {}' .format(self._system, int_id(_src_sub)))
-                    self.CALL_DATA.append(_data)
-                if _end:
-                    self.CALL_DATA.append(_data)
-                    print('({}) Transmission ended, writing to disk: {}' .format(self._system, filename))
-                    pickle.dump(self.CALL_DATA, open(filename, 'wb'))
-                    reactor.stop()
-                    print('Recording created, program terminating')
+    def group_voice(self, _src_sub, _dst_sub, _ts, _end, _peerid, _data):
+        if 'g' in tx_types:
+            self.record('g', _src_sub, _dst_sub, _ts, _end, _data)
                 
-    if tx_type == 'p':
-	print('Initializing ro record PRIVATE VOICE transmission')
-        def private_voice(self, _src_sub, _dst_sub, _ts, _end, _peerid, _data):
-            if id == _dst_sub and _ts in ts:
-                if not _end:
-                    if not self.CALL_DATA:
-                        print('({}) Recording transmission from subscriber: {}' .format(self._system, int_id(_src_sub)))
-                    self.CALL_DATA.append(_data)
-                if _end:
-                    self.CALL_DATA.append(_data)
-                    print('({}) Transmission ended, writing to disk: {}' .format(self._system, filename))
-                    pickle.dump(self.CALL_DATA, open(filename, 'wb'))
-                    reactor.stop()
-                    print('Recording created, program terminating')
+    def private_voice(self, _src_sub, _dst_sub, _ts, _end, _peerid, _data):
+        if 'p' in tx_types:
+            self.record('p', _src_sub, _dst_sub, _ts, _end, _data)
+
+    def record(self, _type, _src_sub, _dst_sub, _ts, _end, _data):
+        if _ts not in timeslots or (ids and _dst_sub not in ids):
+            return
+
+        now = time()
+        _call = self.CALLS.get(_ts)
+        if _call is not None and (_call['TYPE'], _call['SRC'], _call['DST']) != (_type, _src_sub, _dst_sub):
+            self.end_call(_ts, 'interrupted')
+            _call = None
+
+        if _call is None:
+            if _end:
+                return      # the rest of a call we've already finished
+            _path = os.path.join(directory, '{}_{}_TS{}_{}_{}{}.bin'.format(strftime('%Y%m%d-%H%M%S', localtime(now)), self._system, _ts, int_id(_src_sub), 'TG' if _type == 'g' else 'ID', int_id(_dst_sub)))
+            _call = self.CALLS[_ts] = {'TYPE': _type, 'SRC': _src_sub, 'DST': _dst_sub, 'PATH': _path, 'START': now, 'LAST': now, 'BURSTS': 0, 'SEQ': None, 'LOST': 0, 'LATE': 0}
+            self._writer.open(_path, _path)
+            self._logger.info('(%s) Recording transmission from subscriber: %s, TS: %s, Destination: %s to %s', self._system, int_id(_src_sub), _ts, int_id(_dst_sub), _path)
+
+        self._writer.write(_call['PATH'], _data)
+        _call['BURSTS'] += 1
+        _call['LAST'] = now
+
+        # Keep count of the bursts we never got (gaps in the RTP sequence numbers) and the ones
+        # that came late (out of order, or again)
+        _seq, = unpack_from('>H', _data, 20)
+        if _call['SEQ'] is not None:
+            _gap = (_seq - _call['SEQ']) & 0xFFFF
+            if _gap == 0 or _gap >= 0x8000:
+                _call['LATE'] += 1
+                _seq = _call['SEQ']
+            else:
+                _call['LOST'] += _gap - 1
+        _call['SEQ'] = _seq
+
+        if _end:
+            self.end_call(_ts, 'ended')
+
+    def end_call(self, _ts, _why):
+        _call = self.CALLS.pop(_ts)
+        self._writer.close(_call['PATH'], {
+            'START':    _call['START'],
+            'DURATION': _call['LAST'] - _call['START'],
+            'SYSTEM':   self._system,
+            'TS':       _ts,
+            'TYPE':     _call['TYPE'],
+            'SRC':      int_id(_call['SRC']),
+            'DST':      int_id(_call['DST']),
+            'LOST':     _call['LOST'],
+            'LATE':     _call['LATE']
+        })
+        self._logger.info('(%s) Transmission %s, recorded to %s: %s bursts (%s lost, %s late), %.1f seconds', self._system, _why, _call['PATH'], _call['BURSTS'], _call['LOST'], _call['LATE'], _call['LAST'] - _call['START'])
+
+    def expire_calls(self, _now):
+        for _ts in [_ts for _ts in self.CALLS if _now - self.CALLS[_ts]['LAST'] > CALL_TIMEOUT]:
+            self.end_call(_ts, 'timed out')
+
+
+# End the calls that have gone quiet, and warn if the writer can't keep up
+#
+def call_maintenance(_writer):
+    now = time()
+    for system in systems:
+        systems[system].expire_calls(now)
+    if _writer.dropped != WRITER_DROPPED[0]:
+        logger.warning('Recording writer is falling behind, %s bursts dropped (%s in total)', _writer.dropped - WRITER_DROPPED[0], _writer.dropped)
+        WRITER_DROPPED[0] = _writer.dropped
+
+WRITER_DROPPED = [0]
 
 
 if __name__ == '__main__':
@@ -119,8 +174,19 @@ if __name__ == '__main__':
     # CLI argument parser - handles picking up the config file from the command line, and sending a "help" message
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', action='store', dest='CFG_FILE', help='/full/path/to/config.file (usually dmrlink.cfg)')
+    parser.add_argument('-t', '--type', action='store', dest='TYPE', choices=['g', 'p', 'both'], default='both', help='record group (g) or private (p) calls, or both (default)')
+    parser.add_argument('-s', '--ts', action='store', dest='TS', choices=['1', '2', 'both'], default='both', help='timeslot to record: 1, 2 or both (default)')
+    parser.add_argument('-i', '--id', action='append', dest='IDS', type=int, default=[], help='group or subscriber ID to record, may be repeated (default: all)')
+    parser.add_argument('-d', '--directory', action='store', dest='DIRECTORY', default=directory, help='directory for the recordings (default: %(default)s)')
+    parser.add_argument('-x', '--index', action='store', dest='INDEX', help='index of the recordings (default: calls.db in the directory)')
     cli_args = parser.parse_args()
 
+    tx_types = ('g', 'p') if cli_args.TYPE == 'both' else (cli_args.TYPE,)
+    timeslots = (1, 2) if cli_args.TS == 'both' else (int(cli_args.TS),)
+    ids = frozenset(hex_str_3(_id) for _id in cli_args.IDS)
+    directory = cli_args.DIRECTORY
+    index = cli_args.INDEX or os.path.join(directory, 'calls.db')
+
     if not cli_args.CFG_FILE:
         cli_args.CFG_FILE = os.path.dirname(os.path.abspath(__file__))+'/dmrlink.cfg'
     
@@ -131,6 +197,16 @@ if __name__ == '__main__':
     logger = dmrlink_log.config_logging(CONFIG['LOGGER'])
 
     logger.info('DMRlink \'record.py\' (c) 2014 N0MJS & the K0USY Group - SYSTEM STARTING...')
+
+    # START THE RECORDING WRITER
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            sys.exit('Recording directory {} could not be created: {}'.format(directory, e))
+    writer = RecordWriter(logger, CallIndex(index))
+    logger.info('Recording %s calls on TS %s to %s in %s', '/'.join(tx_types), '/'.join(str(_ts) for _ts in timeslots), ', '.join(str(int_id(_id)) for _id in sorted(ids)) or 'any destination', directory)
+    logger.info('Recordings are indexed in %s', index)
     
     # Shut ourselves down gracefully with the IPSC peers.
     def sig_handler(_signal, _frame):
@@ -151,7 +227,19 @@ if __name__ == '__main__':
     # INITIALIZE AN IPSC OBJECT (SELF SUSTAINING) FOR EACH CONFIGUED IPSC
     for system in CONFIG['SYSTEMS']:
         if CONFIG['SYSTEMS'][system]['LOCAL']['ENABLED']:
-            systems[system] = recordIPSC(system, CONFIG, logger)
+            systems[system] = recordIPSC(system, CONFIG, logger, writer)
             reactor.listenUDP(CONFIG['SYSTEMS'][system]['LOCAL']['PORT'], systems[system], interface=CONFIG['SYSTEMS'][system]['LOCAL']['IP'])
     
+    # END CALLS THAT HAVE GONE QUIET
+    maintenance = task.LoopingCall(call_maintenance, writer)
+    maintenance.start(CALL_TIMEOUT, now = False)
+
+    # FINISH OFF THE RECORDINGS IN PROGRESS WHEN WE'RE STOPPED
+    def finish_recordings():
+        for system in systems:
+            for _ts in list(systems[system].CALLS):
+                systems[system].end_call(_ts, 'stopped')
+        writer.stop()
+    reactor.addSystemEventTrigger('before', 'shutdown', finish_recordings)
+
     reactor.run()
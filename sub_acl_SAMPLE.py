@@ -1,6 +1,15 @@
-ACL_ACTION = "DENY"  # May be PERMIT|DENY
+ACL_ACTION = "DENY"  # May be PERMIT|DENY|NONE
 ACL = [
     1234001,
     1234002,
-    1234003
-    ]
\ No newline at end of file
+    1234003,
+    (1235000, 1235999)  # a range of IDs: (first, last)
+    ]
+
+# Optional: more ACLs, just like the one above, for calls from one system (as named in the
+# main configuration file) or one timeslot of a system. A call has to pass all that apply.
+#
+# SYSTEM_ACL = {
+#     'MASTER-1':      {'ACL_ACTION': 'PERMIT', 'ACL': [(3100000, 3199999)]},
+#     ('CLIENT-1', 2): {'ACL_ACTION': 'DENY',   'ACL': [1234004]}
+#     }